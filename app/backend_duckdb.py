@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Etapa opcional de agregación en DuckDB (engine="duckdb") para los pasos 9-14 del pipeline.
+
+Registra el DataFrame en una conexión DuckDB en memoria (sin copia) y resuelve varios conjuntos
+de agrupación en una sola consulta con GROUPING SETS: los agregados parciales por (partido,
+equipo, rival) y por (partido, jugador) de todos los partidos nuevos, y los agregados de la
+ventana (equipo, rival y pareja) sobre esos parciales (ver app.services.match_partials). DuckDB
+usa todos los núcleos y, si se queda sin memoria, vuelca a disco en `temp_directory`.
+
+duckdb no es una dependencia obligatoria: si no está instalado, `require_duckdb()` lanza un
+ImportError explicativo.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+try:
+    import duckdb
+except ImportError:  # pragma: no cover - dependencia opcional
+    duckdb = None
+
+def has_duckdb():
+    return duckdb is not None
+
+
+def require_duckdb():
+    if duckdb is None:
+        raise ImportError("engine='duckdb' requiere el paquete duckdb (pip install duckdb)")
+
+
+def _q(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _vista(df, columns, keys=()):
+    """
+    Solo las columnas usadas, sin copiar los arrays numéricos. DuckDB no admite categorías de
+    tipos mezclados (p.ej. texto y el 0 de fillna): las claves categóricas se pasan como sus
+    códigos (nulo para NaN), que ordenan igual que el groupby de pandas y vuelven intactas con
+    _de_codigos; el resto de categóricas pasa a object.
+    """
+    data = {}
+    for c in dict.fromkeys(columns):
+        s = df[c]
+        if isinstance(s.dtype, pd.CategoricalDtype):
+            if c in keys:
+                codes = s.cat.codes
+                data[c] = pd.array(codes.to_numpy(), dtype="Int32")
+                data[c][codes.to_numpy() < 0] = pd.NA
+            else:
+                data[c] = s.astype(object).to_numpy()
+        else:
+            data[c] = s.to_numpy()
+    return pd.DataFrame(data, copy=False)
+
+
+def _de_codigos(codes, dtype):
+    """Categórica de `dtype` a partir de los códigos devueltos por DuckDB."""
+    return pd.Categorical.from_codes(codes.fillna(-1).astype(np.int64).to_numpy(), dtype=dtype)
+
+
+def _sum_expr(df, c):
+    # Todo NaN -> 0, como el sum de pandas; los enteros se suman en BIGINT (no HUGEINT)
+    if df[c].dtype.kind in "biu":
+        return f"COALESCE(SUM(CAST({_q(c)} AS BIGINT)), 0)::BIGINT AS {_q(c)}"
+    return f"COALESCE(SUM({_q(c)}), 0)::DOUBLE AS {_q(c)}"
+
+
+def _pandas_sum_dtype(dtype):
+    """dtype que devuelve groupby().sum() de pandas para una columna de tipo `dtype`."""
+    if dtype.kind == "b":
+        return np.dtype("int64")
+    if dtype.kind in "iu":
+        return np.dtype(f"{dtype.kind}8")
+    return dtype
+
+
+def rollups(df, cols, sets, extra=None, temp_directory=None, memory_limit=None):
+    """
+    Suma de `cols` para cada conjunto de `sets` ({nombre: columnas de agrupación}) en una sola
+    consulta GROUPING SETS. `extra` ({nombre: {col: "min"|"max"}}) añade a un conjunto columnas
+    con otra función, delante de las sumas (p.ej. {"df_agr_pair": {"localDate": "min"}}).
+
+    Devuelve {nombre: DataFrame} con el mismo contenido y orden que
+    df.groupby(by, as_index=False).agg(...) (claves nulas descartadas, ordenado por las claves).
+    """
+    require_duckdb()
+    sets = dict(sets)
+    extra = {name: dict(e) for name, e in (extra or {}).items()}
+    extra_cols = {c: f for e in extra.values() for c, f in e.items()}
+    cols = [c for c in cols if c not in extra_cols]
+    keys = list(dict.fromkeys(k for by in sets.values() for k in by))
+
+    con = duckdb.connect(database=":memory:")
+    try:
+        tmp = temp_directory or os.getenv("ABP_DUCKDB_TEMP")
+        if tmp:
+            con.execute(f"SET temp_directory = '{tmp}'")
+        mem = memory_limit or os.getenv("ABP_DUCKDB_MEMORY")
+        if mem:
+            con.execute(f"SET memory_limit = '{mem}'")
+        con.register("eventos", _vista(df, keys + list(extra_cols) + cols, keys))
+
+        grouping = ", ".join("(" + ", ".join(_q(k) for k in by) + ")" for by in sets.values())
+        select = [_q(k) for k in keys]
+        select += [f"GROUPING({', '.join(_q(k) for k in keys)}) AS __gid"]
+        select += [f"{f.upper()}({_q(c)}) AS {_q(c)}" for c, f in extra_cols.items()]
+        select += [_sum_expr(df, c) for c in cols]
+        sql = f"SELECT {', '.join(select)} FROM eventos GROUP BY GROUPING SETS ({grouping})"
+        out = con.execute(sql).df()
+    finally:
+        con.close()
+
+    res = {}
+    for name, by in sets.items():
+        # GROUPING(): bit a 1 = columna no agrupada en ese conjunto (el primer key es el bit más alto)
+        gid = sum(1 << (len(keys) - 1 - i) for i, k in enumerate(keys) if k not in by)
+        part = out[out["__gid"] == gid]
+        part = part[part[list(by)].notna().all(axis=1)]
+        part = part.sort_values(list(by), kind="stable").reset_index(drop=True)
+        part = part[list(by) + list(extra.get(name, {})) + cols]
+        dtypes = {k: df[k].dtype for k in by if not isinstance(df[k].dtype, pd.CategoricalDtype)}
+        dtypes.update({c: _pandas_sum_dtype(df[c].dtype) for c in cols})
+        part = part.astype(dtypes)
+        for k in by:
+            if isinstance(df[k].dtype, pd.CategoricalDtype):
+                part[k] = _de_codigos(part[k], df[k].dtype)
+        res[name] = part
+    return res
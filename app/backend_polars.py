@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+Backend opcional en polars para el cálculo de métricas (engine="polars").
+
+Replica transform_events_agg, calcula_medidas_compuestas y las agregaciones por grupo del
+pipeline con planes lazy de polars (filtros empujados antes del group_by y group_by multihilo).
+Las entradas y salidas son DataFrames de pandas, de modo que table_builders y docgen no cambian.
+
+polars no es una dependencia obligatoria: si no está instalado, `require_polars()` lanza un
+ImportError explicativo y el resto de la app sigue usando pandas.
+"""
+
+import numpy as np
+import pandas as pd
+
+try:
+    import polars as pl
+except ImportError:  # pragma: no cover - dependencia opcional
+    pl = None
+
+import app.fun_calculo_metricas as cm
+
+def has_polars():
+    return pl is not None
+
+
+def require_polars():
+    if pl is None:
+        raise ImportError("engine='polars' requiere el paquete polars (pip install polars)")
+
+
+def _to_polars(df, columns, nan_to_null=True, as_codes=()):
+    """
+    Solo las columnas necesarias; NaN -> null para que las comparaciones no lo cuenten (como pandas).
+    Se construye columna a columna desde numpy para no depender de pyarrow. Las categóricas de
+    `as_codes` pasan como sus códigos (Int32, null para NaN): sin recorrer fila a fila, conservando
+    el valor original de cada categoría (el 0 de fillna no se vuelve '0') y ordenando como el
+    groupby de pandas. Devuelve (DataFrame de polars, {columna: CategoricalDtype}).
+    """
+    columns = list(dict.fromkeys(c for c in columns if c in df.columns))
+    data, cats = {}, {}
+    for c in columns:
+        s = df[c]
+        if c in as_codes and isinstance(s.dtype, pd.CategoricalDtype):
+            codes = s.cat.codes.to_numpy()
+            data[c] = pl.Series(c, codes, dtype=pl.Int32).set(pl.Series(codes < 0), None)
+            cats[c] = s.dtype
+            continue
+        values = s.to_numpy()
+        if values.dtype.kind in "biuf":
+            data[c] = pl.Series(c, values, nan_to_null=nan_to_null and values.dtype.kind == "f")
+        else:
+            # object (texto): None/NaN -> null
+            data[c] = pl.Series(c, [None if v is None or v != v else v for v in values.tolist()], strict=False)
+    return pl.DataFrame(data), cats
+
+
+def _to_pandas(out, cats=None):
+    """
+    Vuelta a pandas columna a columna (sin pyarrow); los null numéricos pasan a NaN y los códigos
+    de `cats` vuelven a su categórica.
+    """
+    cats = cats or {}
+    data = {}
+    for c in out.columns:
+        if c in cats:
+            codes = out[c].fill_null(-1).to_numpy()
+            data[c] = pd.Categorical.from_codes(codes, dtype=cats[c])
+        else:
+            data[c] = out[c].to_numpy()
+    return pd.DataFrame(data)
+
+
+# ---------------------------------------------------------------------
+# transform_events_agg
+# ---------------------------------------------------------------------
+def _flag_column(pred, columns):
+    """Columna de flags que resuelve el predicado sobre `qualifiers`, si existe."""
+    col, op, val = pred
+    qualifier = cm._QUALIFIER_NEEDLE_RE.match(val) if col == "qualifiers" and isinstance(val, str) else None
+    flag = cm.QUALIFIER_FLAG.format(qualifier.group(1)) if qualifier else None
+    return flag if flag in columns else None
+
+
+def _categorical_predicate_expr(pred, dtype):
+    """
+    Predicado sobre una categórica pasada como códigos: se evalúa con cm._eval_predicate sobre
+    las categorías (más un nulo) y se traduce a un is_in de los códigos que cumplen.
+    """
+    col, op, val = pred
+    valores = pd.Series(list(dtype.categories) + [None], dtype=object)
+    m = cm._eval_predicate(pd.DataFrame({col: valores}), pred)
+    codigos = np.flatnonzero(m[:-1]).tolist()
+    return pl.col(col).is_in(codigos).fill_null(bool(m[-1]))
+
+
+def _predicate_expr(pred, columns, cats=None):
+    col, op, val = pred
+    if cats and col in cats:
+        return _categorical_predicate_expr(pred, cats[col])
+    c = pl.col(col)
+    if op in ("==", "!=", ">", ">=", "<", "<="):
+        e = {"==": c == val, "!=": c != val, ">": c > val, ">=": c >= val, "<": c < val, "<=": c <= val}[op]
+        # pandas: NaN != x es True; el resto de comparaciones con NaN son False
+        return e.fill_null(op == "!=")
+    if op == "in":
+        return c.is_in(list(val)).fill_null(False)
+    flag = _flag_column(pred, columns)
+    if flag is not None:
+        # La variante "or" (regex) solo ve la forma "N}" (bit 1 del flag)
+        e = (pl.col(flag) & 1) != 0 if op.startswith("re_") else pl.col(flag) != 0
+    elif op in ("contains", "ncontains"):
+        s = c.cast(pl.Utf8)
+        e = s.str.contains(val, literal=True) | s.str.contains(val.replace("}", "."), literal=True)
+    else:
+        e = c.cast(pl.Utf8).str.contains(val)
+    e = e.fill_null(False)
+    return ~e if op.endswith("ncontains") else e
+
+
+def transform_events_agg(event_data, series_config, gr_cols):
+    """Mismo resultado que cm.transform_events_agg, con un único plan lazy de polars."""
+    require_polars()
+    plan = cm.compile_series_config(series_config)
+    names = plan.names
+
+    flags = cm.qualifier_flag_columns(event_data)
+    columns = set(flags)
+    # `qualifiers` (texto, lo más caro de convertir) solo si algún predicado no lo cubren los flags
+    needed = list(gr_cols) + ["type_displayName"] + flags
+    needed += [p[0] for p in plan.predicates if _flag_column(p, columns) is None]
+    needed += [s[2] for s in plan.series if s[2] is not None]
+    df, cats = _to_polars(event_data, needed, as_codes=event_data.columns)
+    lf = df.lazy()
+
+    # Cada predicado y cada máscara de serie se calculan una sola vez como columna; el group_by
+    # solo suma columnas ya materializadas
+    preds = [_predicate_expr(p, columns, cats).alias(f"__p{i}") for i, p in enumerate(plan.predicates)]
+    masks = []
+    for j, (name, terms, agg_col, convert) in enumerate(plan.series):
+        m = pl.lit(True)
+        for term in terms:
+            t = pl.col(f"__p{term[0]}")
+            for idx in term[1:]:
+                t = t | pl.col(f"__p{idx}")
+            m = m & t
+        masks.append(m.alias(f"__m{j}"))
+
+    counted = pl.col("type_displayName").is_not_null()
+    values, present = [], []
+    for j, (name, terms, agg_col, convert) in enumerate(plan.series):
+        m = pl.col(f"__m{j}")
+        if agg_col is not None:
+            v = pl.col(agg_col).cast(pl.Float64, strict=False)
+            e = pl.when(m & v.is_not_null() & ~v.is_nan()).then(v).otherwise(0.0)
+        else:
+            e = (m & counted).cast(pl.Float64)
+        values.append(e.sum().alias(name))
+        present.append(m.any().alias(f"__present_{j}"))
+
+    mask_cols = [pl.col(f"__m{j}") for j in range(len(masks))]
+    any_mask = pl.any_horizontal(mask_cols) if masks else pl.lit(False)
+    keys_ok = pl.all_horizontal([pl.col(c).is_not_null() for c in gr_cols])
+    out = (
+        lf.with_columns(preds)
+          .with_columns(masks)
+          .filter(any_mask & keys_ok)
+          .group_by(gr_cols)
+          .agg(values + present)
+          .sort(gr_cols)
+          .collect()
+    )
+
+    present = [bool(out[f"__present_{j}"].any()) if out.height else False for j in range(len(names))]
+    final_df = _to_pandas(out.select(list(gr_cols) + names), cats)
+    for name, terms, agg_col, convert in plan.series:
+        if convert:
+            final_df[name] = final_df[name] * 0.9144
+
+    empty = [name for name, p in zip(names, present) if not p]
+    final_df = final_df[list(gr_cols) + [name for name, p in zip(names, present) if p]]
+    if empty:
+        zeros = pd.DataFrame(0, index=final_df.index, columns=empty)
+        final_df = pd.concat([final_df, zeros], axis=1)
+    return final_df
+
+
+# ---------------------------------------------------------------------
+# Medidas compuestas
+# ---------------------------------------------------------------------
+def evaluate_composites(data, spec=None, dtype=None):
+    """Mismo resultado que cm.evaluate_composites (dict {nombre: np.ndarray}) con expresiones polars."""
+    require_polars()
+    plan = cm.compile_composite_spec(spec)
+    needed = [c for _, _, cols in plan.measures for c in cols if c in data.columns]
+    lf = _to_polars(data, needed, nan_to_null=False)[0].lazy()
+
+    exprs = {}
+
+    def col(c):
+        if c in exprs:
+            return exprs[c]
+        # Enteros en Int64, como cm.evaluate_composites (Int8 + Int8 daría la vuelta)
+        return pl.col(c).cast(pl.Int64) if data[c].dtype.kind in "biu" else pl.col(c)
+
+    for name, op, cols in plan.measures:
+        if op == "ratio":
+            r = col(cols[0]).cast(pl.Float64) / col(cols[1]).cast(pl.Float64)
+            e = pl.when(r.is_finite()).then(r).otherwise(0.0)
+        else:
+            e = col(cols[0])
+            for c in cols[1:]:
+                e = e + col(c) if op == "sum" else e - col(c)
+        exprs[name] = e
+
+    out = lf.select([e.alias(n) for n, e in exprs.items()]).collect()
+    res = {}
+    for name in plan.names:
+        v = out[name].to_numpy()
+        if dtype is not None and np.issubdtype(v.dtype, np.floating):
+            v = v.astype(dtype, copy=False)
+        res[name] = v
+    return res
+
+
+def calcula_medidas_compuestas(dd, spec=None, dtype=None):
+    return cm._asigna_columnas(dd, evaluate_composites(dd, spec, dtype))
+
+
+# ---------------------------------------------------------------------
+# Agregaciones por grupo (pasos 9-14 del pipeline)
+# ---------------------------------------------------------------------
+def group_agg(df, by, cols, agg=None):
+    """
+    Equivale a df.groupby(by, as_index=False).agg(...): `agg` ({col: "min"|"max"|"sum"}) primero y
+    el resto de `cols` sumadas. Las claves nulas se descartan y el resultado va ordenado por `by`.
+    """
+    require_polars()
+    agg = dict(agg or {})
+    cols = [c for c in cols if c not in agg]
+    pdf, cats = _to_polars(df, list(by) + list(agg) + cols, as_codes=by)
+    lf = pdf.lazy()
+    # pandas suma los booleanos como enteros y omite los NaN (null en polars)
+    sums = [pl.col(c).cast(pl.Int64).sum() if df[c].dtype == bool else pl.col(c).sum() for c in cols]
+    exprs = [getattr(pl.col(c), f)() for c, f in agg.items()] + sums
+    out = (
+        lf.filter(pl.all_horizontal([pl.col(c).is_not_null() for c in by]))
+          .group_by(list(by))
+          .agg(exprs)
+          .sort(list(by))
+          .collect()
+    )
+    return _to_pandas(out.select(list(by) + list(agg) + cols), cats)
+
@@ -10,6 +10,13 @@ class Settings:
     DB_USER: str
     DB_PASSWORD: str
     TZ: str = "Europe/Madrid"  # por defecto
+    # Pool compartido de app.db.get_engine
+    DB_DRIVER: str = "pymysql"
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: int = 30
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
 
 def get_settings() -> Settings:
     """
@@ -24,4 +31,10 @@ def get_settings() -> Settings:
         DB_USER=os.getenv("DB_USER", "admin"),
         DB_PASSWORD=os.getenv("DB_PASSWORD", "dpeQwertyuiop135790_!#"),
         TZ=os.getenv("TZ", "Europe/Madrid"),
+        DB_DRIVER=os.getenv("DB_DRIVER", "pymysql"),
+        DB_POOL_SIZE=int(os.getenv("DB_POOL_SIZE", "5")),
+        DB_MAX_OVERFLOW=int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        DB_POOL_TIMEOUT=int(os.getenv("DB_POOL_TIMEOUT", "30")),
+        DB_POOL_RECYCLE=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        DB_POOL_PRE_PING=os.getenv("DB_POOL_PRE_PING", "1").lower() not in ("0", "false", "no"),
     )
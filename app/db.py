@@ -1,13 +1,271 @@
-from sqlalchemy import create_engine
+"""
+Registro de motores SQLAlchemy del proceso.
+
+Todos los módulos piden su conexión a get_engine(): hay un solo Engine (y un solo pool) por URL en
+todo el proceso, en lugar de un create_engine por llamada. El pool se configura con las variables
+DB_POOL_* de app.config (tamaño, overflow, timeout, recycle y pre-ping) y lleva contadores de
+checkouts, esperas y conexiones abiertas (pool_stats()).
+
+Las consultas con parámetros se registran como sentencias con nombre (register_statement): un
+text() con parámetros :nombre que se reutiliza en cada llamada (mismo SQL, solo cambian los
+valores) y que acumula tiempo y filas por sentencia (statement_stats()). Statement.read_chunks
+lee por bloques con un cursor de servidor para resultados que no caben en memoria.
+"""
+
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+from sqlalchemy import bindparam, create_engine, event, text
+from sqlalchemy.engine import URL, Engine
+from sqlalchemy.pool import QueuePool
+
 from app.config import get_settings
 
-def get_engine():
-    """
-    Crea un motor SQLAlchemy con pre_ping para conexiones robustas.
-    """
+_ENGINES = {}
+_LOCK = threading.Lock()
+_STATEMENTS = {}
+
+
+class _TimedQueuePool(QueuePool):
+    """QueuePool que cuenta checkouts, su latencia y las esperas por falta de conexiones libres."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.counters = {
+            "checkouts": 0,
+            "checkout_seconds": 0.0,
+            "checkout_max_seconds": 0.0,
+            "waits": 0,
+            "connections_opened": 0,
+        }
+
+    def _do_get(self):
+        # Espera si no hay conexiones libres ni hueco para abrir otra (overflow agotado)
+        espera = self.checkedin() == 0 and 0 <= self._max_overflow <= self.overflow()
+        t0 = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            dt = time.perf_counter() - t0
+            with self._stats_lock:
+                c = self.counters
+                c["checkouts"] += 1
+                c["checkout_seconds"] += dt
+                c["checkout_max_seconds"] = max(c["checkout_max_seconds"], dt)
+                c["waits"] += espera
+
+    def recreate(self):
+        # dispose()/recreate() conservan los contadores del pool anterior
+        pool = super().recreate()
+        pool.counters = self.counters
+        return pool
+
+
+def _cuenta_conexion(pool) -> None:
+    with pool._stats_lock:
+        pool.counters["connections_opened"] += 1
+
+
+def database_url(user=None, password=None, host=None, port=None, database=None, driver=None) -> URL:
+    """URL MySQL; lo que no se pase se toma de get_settings()."""
     s = get_settings()
-    uri = (
-        f"mysql+pymysql://{s.DB_USER}:{s.DB_PASSWORD}"
-        f"@{s.DB_HOST}:{s.DB_PORT}/{s.DB_NAME}?charset=utf8mb4"
+    return URL.create(
+        f"mysql+{driver or s.DB_DRIVER}",
+        username=user or s.DB_USER,
+        password=password or s.DB_PASSWORD,
+        host=host or s.DB_HOST,
+        port=int(port or s.DB_PORT),
+        database=database or s.DB_NAME,
+        query={"charset": "utf8mb4"},
     )
-    return create_engine(uri, pool_pre_ping=True)
+
+
+def get_engine(url=None):
+    """
+    Engine compartido del proceso para `url` (por defecto database_url()), creado la primera vez
+    con el pool de app.config y pre_ping para conexiones robustas.
+    """
+    url = url or database_url()
+    key = url.render_as_string(hide_password=False) if isinstance(url, URL) else str(url)
+    with _LOCK:
+        eng = _ENGINES.get(key)
+        if eng is None:
+            s = get_settings()
+            eng = create_engine(
+                url,
+                poolclass=_TimedQueuePool,
+                pool_size=s.DB_POOL_SIZE,
+                max_overflow=s.DB_MAX_OVERFLOW,
+                pool_timeout=s.DB_POOL_TIMEOUT,
+                pool_recycle=s.DB_POOL_RECYCLE,
+                pool_pre_ping=s.DB_POOL_PRE_PING,
+            )
+            event.listen(eng, "connect", lambda *_, eng=eng: _cuenta_conexion(eng.pool))
+            _ENGINES[key] = eng
+    return eng
+
+
+def pool_stats() -> dict:
+    """{URL sin contraseña: contadores del pool + estado actual (size, checkedout, overflow)}."""
+    with _LOCK:
+        engines = list(_ENGINES.values())
+    out = {}
+    for eng in engines:
+        pool = eng.pool
+        with pool._stats_lock:
+            stats = dict(pool.counters)
+        stats.update(size=pool.size(), checkedout=pool.checkedout(), overflow=pool.overflow())
+        out[eng.url.render_as_string(hide_password=True)] = stats
+    return out
+
+
+def dispose_engines() -> None:
+    """Cierra y olvida todos los motores (p.ej. tras un fork o al cambiar la configuración)."""
+    with _LOCK:
+        engines = list(_ENGINES.values())
+        _ENGINES.clear()
+    for eng in engines:
+        eng.dispose()
+
+
+class Statement:
+    """Sentencia con nombre: text(sql) con parámetros :nombre (los de `expanding` admiten listas para IN)."""
+
+    def __init__(self, name: str, sql: str, expanding=()):
+        self.name = name
+        self.sql = sql
+        self.expanding = tuple(expanding)
+        self.clause = text(sql)
+        if self.expanding:
+            self.clause = self.clause.bindparams(*(bindparam(p, expanding=True) for p in self.expanding))
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "rows": 0, "seconds": 0.0, "max_seconds": 0.0}
+
+    def read(self, conn, **params) -> pd.DataFrame:
+        """pd.read_sql de la sentencia con `params`, anotando tiempo y filas."""
+        t0 = time.perf_counter()
+        df = pd.read_sql(self.clause, conn, params=self._params(params))
+        self._anota(len(df), time.perf_counter() - t0)
+        return df
+
+    def read_chunks(self, conn, chunksize: int, prefetch: int = 1, **params):
+        """
+        Como read() pero devuelve un iterador de DataFrames de hasta `chunksize` filas, leídos con
+        un cursor de servidor (stream_results): ni el driver ni pandas tienen el resultado entero
+        en memoria. Con `prefetch` > 0 un hilo va leyendo hasta `prefetch` bloques por delante
+        mientras se procesa el actual. El tiempo anotado es solo el de lectura.
+        """
+        chunks = self._iter_chunks(conn, chunksize, self._params(params))
+        return _prefetch(chunks, prefetch) if prefetch > 0 else chunks
+
+    def _iter_chunks(self, conn, chunksize, params):
+        rows, dt = 0, 0.0
+        try:
+            with _stream_connection(conn) as c:
+                t0 = time.perf_counter()
+                it = iter(pd.read_sql(self.clause, c, params=params, chunksize=chunksize))
+                while True:
+                    chunk = next(it, None)
+                    dt += time.perf_counter() - t0
+                    if chunk is None:
+                        break
+                    rows += len(chunk)
+                    yield chunk
+                    t0 = time.perf_counter()
+        finally:
+            self._anota(rows, dt)
+
+    def _params(self, params):
+        return {k: list(v) if k in self.expanding else v for k, v in params.items()}
+
+    def _anota(self, rows, dt):
+        with self._lock:
+            st = self.stats
+            st["calls"] += 1
+            st["rows"] += rows
+            st["seconds"] += dt
+            st["max_seconds"] = max(st["max_seconds"], dt)
+
+
+@contextmanager
+def _stream_connection(conn):
+    """Conexión con stream_results (cursor de servidor, p.ej. SSCursor en pymysql)."""
+    if isinstance(conn, Engine):
+        with conn.connect() as c:
+            yield c.execution_options(stream_results=True)
+    else:
+        yield conn.execution_options(stream_results=True)
+
+
+_FIN = object()
+
+
+def _prefetch(gen, depth: int):
+    """
+    Recorre el generador `gen` en un hilo aparte con hasta `depth` elementos por delante. Si el
+    consumidor para antes de tiempo, el hilo cierra `gen` (y con él la conexión).
+    """
+    q = queue.Queue(maxsize=depth)
+    parar = threading.Event()
+
+    def pon(item):
+        while not parar.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def productor():
+        try:
+            for x in gen:
+                if not pon((None, x)):
+                    break
+            else:
+                pon((_FIN, None))
+        except BaseException as e:  # se relanza en el consumidor
+            pon((e, None))
+        finally:
+            gen.close()
+
+    hilo = threading.Thread(target=productor, daemon=True)
+    hilo.start()
+    try:
+        while True:
+            err, x = q.get()
+            if err is _FIN:
+                return
+            if err is not None:
+                raise err
+            yield x
+    finally:
+        parar.set()
+        hilo.join()
+
+
+def register_statement(name: str, sql: str, expanding=()) -> Statement:
+    """
+    Sentencia `name` del registro. Si ya existe con el mismo SQL se reutiliza (con sus
+    estadísticas); si el SQL cambia se sustituye.
+    """
+    with _LOCK:
+        stmt = _STATEMENTS.get(name)
+        if stmt is None or stmt.sql != sql or stmt.expanding != tuple(expanding):
+            stmt = _STATEMENTS[name] = Statement(name, sql, expanding)
+    return stmt
+
+
+def statement_stats() -> pd.DataFrame:
+    """Llamadas, filas y tiempos de cada sentencia registrada (una fila por nombre)."""
+    with _LOCK:
+        stmts = list(_STATEMENTS.values())
+    rows = []
+    for stmt in stmts:
+        with stmt._lock:
+            rows.append({"name": stmt.name, **stmt.stats})
+    return pd.DataFrame(rows, columns=["name", "calls", "rows", "seconds", "max_seconds"])
@@ -5,463 +5,1161 @@ Created on Thu Jun 19 00:19:17 2025
 @author: aleex
 """
 
+import re
+import json
+import hashlib
+from pathlib import Path
 import pandas as pd
 import numpy as np
-from functools import reduce
+from dataclasses import dataclass
 
 
-def get_gk_events(event_data,player_data,dim_team):
-    ev=event_data[(event_data.type_value.isin([1,13,14,15,16]))]
-    player_data=pd.merge(player_data,dim_team[['teamId','teamName']],how='left',on="teamId")
+# ---------------------------------------------------------------------
+# Índice de qualifiers (parseo único de la columna `qualifiers`)
+# ---------------------------------------------------------------------
+QUALIFIER_FLAG = "qualifier_{}"
+_QUALIFIER_RE = r"'qualifierId': (\d+)([}.])"
+_QUALIFIER_NEEDLE_RE = re.compile(r"^'qualifierId': (\d+)}$")
+
+# qualifierIds consultados fuera de series_config (aux columns, porteros, contactos)
+QUALIFIER_IDS_AUX = (5, 6, 15, 89, 107, 167, 210)
+
+
+@dataclass
+class QualifierIndex:
+    """
+    Índice disperso (formato COO) de los qualifierId de cada fila de eventos.
+
+    row: posición de la fila en el DataFrame sobre el que se construyó.
+    qualifier_id: qualifierId presente en esa fila.
+    form: bits de la forma en la que aparece en el texto: 1 = "'qualifierId': N}",
+          2 = "'qualifierId': N." (ids serializados como float).
+    """
+    n_rows: int
+    row: np.ndarray
+    qualifier_id: np.ndarray
+    form: np.ndarray
+
+    def flag(self, qualifier_id):
+        """Columna uint8 (una posición por fila) con los bits de forma del qualifierId."""
+        out = np.zeros(self.n_rows, dtype=np.uint8)
+        sel = self.qualifier_id == qualifier_id
+        out[self.row[sel]] = self.form[sel]
+        return out
+
+    @classmethod
+    def combine(cls, n_rows, parts):
+        """
+        Índice de un DataFrame de `n_rows` filas a partir de los de sus trozos: `parts` es una
+        lista de (posiciones de las filas del trozo en el DataFrame, QualifierIndex del trozo).
+        """
+        parts = [(np.asarray(pos), idx) for pos, idx in parts]
+        if not parts:
+            return cls(n_rows, np.empty(0, np.int32), np.empty(0, np.uint16), np.empty(0, np.uint8))
+        return cls(
+            n_rows=n_rows,
+            row=np.concatenate([pos[idx.row] for pos, idx in parts]).astype(np.int32),
+            qualifier_id=np.concatenate([idx.qualifier_id for _, idx in parts]),
+            form=np.concatenate([idx.form for _, idx in parts]),
+        )
+
+
+def qualifier_digest(qualifiers):
+    """
+    Huella del texto de `qualifiers` (en orden): un QualifierIndex guardado solo vale para unas
+    filas con la misma huella. Mucho más barata que volver a parsear.
+    """
+    h = pd.util.hash_pandas_object(pd.Series(qualifiers.to_numpy(dtype=object)), index=False)
+    return hashlib.md5(h.to_numpy().tobytes()).hexdigest()
+
+
+def build_qualifier_index(qualifiers):
+    """
+    Parsea una sola vez la columna `qualifiers` (repr de la lista de qualifiers) y devuelve
+    un QualifierIndex posicional respecto a la serie recibida.
+    """
+    q = pd.Series(qualifiers.astype(str).to_numpy())
+    found = q.str.extractall(_QUALIFIER_RE)
+    rows = found.index.get_level_values(0).to_numpy(dtype=np.int64)
+    ids = found[0].astype(np.int64).to_numpy()
+    forms = np.where(found[1].to_numpy() == "}", 1, 2).astype(np.uint8)
+
+    # Una entrada por (fila, qualifierId), combinando las formas en las que aparece
+    keys, inv = np.unique(rows * 65536 + ids, return_inverse=True)
+    form = np.zeros(len(keys), dtype=np.uint8)
+    np.bitwise_or.at(form, inv, forms)
+    return QualifierIndex(
+        n_rows=len(q),
+        row=(keys // 65536).astype(np.int32),
+        qualifier_id=(keys % 65536).astype(np.uint16),
+        form=form,
+    )
+
+
+def add_qualifier_flags(df, qualifier_ids, index=None):
+    """
+    Añade a `df` una columna uint8 `qualifier_<id>` por cada qualifierId pedido que no exista ya.
+    `index` debe ser el QualifierIndex construido sobre las filas de `df` (mismo orden); si no
+    se pasa, se parsea `df.qualifiers`.
+    """
+    missing = sorted({int(q) for q in qualifier_ids if QUALIFIER_FLAG.format(q) not in df.columns})
+    if not missing:
+        return df
+    if index is None:
+        index = build_qualifier_index(df["qualifiers"])
+    flags = pd.DataFrame({QUALIFIER_FLAG.format(q): index.flag(q) for q in missing}, index=df.index)
+    return pd.concat([df, flags], axis=1)
+
+
+def qualifier_flag_columns(df):
+    """Columnas de flags de qualifiers presentes en `df`."""
+    return [c for c in df.columns if re.fullmatch(QUALIFIER_FLAG.format(r"\d+"), c)]
+
+
+def has_qualifier(df, qualifier_id, exact=False):
+    """
+    Máscara booleana: la fila tiene el qualifierId. Con exact=True solo cuenta la forma
+    "'qualifierId': N}" (equivalente a un str.contains de ese literal).
+    Usa la columna de flags si existe; si no, recurre al escaneo del texto.
+    """
+    col = QUALIFIER_FLAG.format(qualifier_id)
+    if col in df.columns:
+        flags = df[col].to_numpy()
+        return (flags & 1).astype(bool) if exact else flags != 0
+    needle = "'qualifierId': {}}}".format(qualifier_id)
+    q = df["qualifiers"].astype(str)
+    m = q.str.contains(needle, regex=False)
+    if not exact:
+        m = m | q.str.contains(needle.replace("}", "."), regex=False)
+    return m.to_numpy(dtype=bool)
+
+
+def plan_qualifier_ids(plan):
+    """qualifierIds que referencian los filtros contains/ncontains de un SeriesPlan."""
+    ids = set()
+    for col, op, val in plan.predicates:
+        if col == "qualifiers" and op.endswith("contains") and isinstance(val, str):
+            m = _QUALIFIER_NEEDLE_RE.match(val)
+            if m:
+                ids.add(int(m.group(1)))
+    return ids
+
+
+
+GK_INTERVENTION_TYPES = [1, 2, 3, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 41, 42, 50, 52, 54, 61]
+GK_KEYS = ["keeperId", "matchId"]
+# Columnas que necesita get_gk_events en los eventos y en sw_player_data
+GK_EVENT_COLUMNS = [
+    "id", "matchId", "oppositionTeamName", "type_value", "minute", "tercio_id", "x", "y",
+    "xG", "ps_xG", "qualifiers", "value_Blocked", "value_Cross", "value_BigChance",
+    "value_HighLeft", "value_LowRight", "value_HighRight", "value_LowLeft",
+    "value_BoxCentre", "value_SmallBoxLeft", "value_SmallBoxRight", "value_SmallBoxCentre",
+]
+GK_PLAYER_COLUMNS = ["matchId", "teamId", "keeperId", "subbedInExpandedMinute"]
+
+
+def gk_missing_columns(event_data, player_data=None):
+    """
+    Columnas de GK_EVENT_COLUMNS / GK_PLAYER_COLUMNS que faltan para get_gk_events (sin
+    player_data solo se comprueban los eventos).
+    """
+    faltan = [c for c in GK_EVENT_COLUMNS if c not in event_data.columns]
+    if player_data is not None:
+        faltan += [c for c in GK_PLAYER_COLUMNS if c not in player_data.columns]
+    return faltan
+
+
+def _gk_eventos_rival(event_data, player_data, dim_team):
+    """Eventos (pases y tiros) del rival con el portero en el campo, con su keeperId."""
+    ev = event_data[(event_data.type_value.isin([1,13,14,15,16]))]
+    player_data = pd.merge(player_data,dim_team[['teamId','teamName']],how='left',on="teamId")
     try:
-        player_data['teamName']=player_data.teamName_y
+        player_data['teamName'] = player_data.teamName_y
     except:
         pass
     evs = pd.merge(ev,player_data[["matchId","teamName","keeperId","subbedInExpandedMinute"]],
                   left_on=["matchId","oppositionTeamName"],right_on=["matchId","teamName"])
-    #evs = pd.merge(evs,match_data[["matchId","season"]],on="matchId",how='left')  
-    evs = evs[evs.minute<evs.subbedInExpandedMinute]  
-    evs['ps_xG'] = np.where((evs.type_value.isin([15,16])) & (evs.value_Blocked==1) ,0,evs.ps_xG)
-    evs['isPass'] =np.where(evs.type_value==1,1,0)    
-    evs['isShot'] =np.where(evs.type_value.isin([13,14,15,16]),1,0)  
-    evs['isGoal'] =np.where(evs.type_value.isin([16]),1,0)     
-    evs['isIntervention'] =np.where(evs.type_value.isin([1, 2, 3, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 41, 42, 50, 52, 54,61]),1,0)
-    evs['isIntervention_finalthird'] = np.where((evs['isIntervention']==1) & (evs.tercio_id==3),1,0)
-    evs['isIntervention_box'] = np.where((evs['isIntervention']==1) & (evs.x>=83) & ((evs.y>=21.1) | (evs.y<=78.9)),1,0)            
-    ev_group = evs.groupby(by=["keeperId","matchId"],as_index=False)[["value_Cross","ps_xG","xG","isShot","isGoal","isIntervention","isIntervention_finalthird","isIntervention_box"]].sum()
-    ev_sotgoalside = evs[(evs.type_value.isin([15,16])) & ((evs.value_Blocked!=1) | (evs.value_Blocked.isna()==True)) & (evs.isShot==1) & ((evs.value_HighLeft==1) | (evs.value_LowRight==1) | (evs.value_HighRight==1) | (evs.value_LowLeft==1) )].groupby(by=["keeperId","matchId"],as_index=False).id.count()
-    ev_sotgoalside.rename({"id":"opp_sotgoalside"},inplace=True,axis=1)
-    ev_savegoalside = evs[(evs.type_value.isin([15,16])) & ((evs.value_Blocked!=1) | (evs.value_Blocked.isna()==True)) & (evs.type_value==15) & ((evs.value_HighLeft==1) | (evs.value_LowRight==1) | (evs.value_HighRight==1) | (evs.value_LowLeft==1) )].groupby(by=["keeperId","matchId"],as_index=False).id.count()
-    ev_savegoalside.rename({"id":"save_goalside"},inplace=True,axis=1)
-    ev_sotcc = evs[(evs.type_value.isin([15,16])) & ((evs.value_Blocked!=1) | (evs.value_Blocked.isna()==True)) & (evs.isShot==1) & (evs.value_BigChance==1)].groupby(by=["keeperId","matchId"],as_index=False).id.count()
-    ev_sotcc.rename({"id":"opp_sotcc"},inplace=True,axis=1)
-    ev_savecc = evs[(evs.type_value.isin([15,16])) & ((evs.value_Blocked!=1) | (evs.value_Blocked.isna()==True)) & (evs.type_value==15) & (evs.value_BigChance==1)].groupby(by=["keeperId","matchId"],as_index=False).id.count()
-    ev_savecc.rename({"id":"save_cc"},inplace=True,axis=1)
-    ev_sotboxdanger = evs[(evs.type_value.isin([15,16])) & ((evs.value_Blocked!=1) | (evs.value_Blocked.isna()==True)) & (evs.isShot==1) & ((evs.value_BoxCentre==1) | (evs.value_SmallBoxLeft==1) | (evs.value_SmallBoxRight==1) | (evs.value_SmallBoxCentre==1) )].groupby(by=["keeperId","matchId"],as_index=False).id.count()
-    ev_sotboxdanger.rename({"id":"opp_sotboxdanger"},inplace=True,axis=1)
-    ev_saveboxdanger = evs[(evs.type_value.isin([15,16])) & ((evs.value_Blocked!=1) | (evs.value_Blocked.isna()==True)) & (evs.type_value==15) & ((evs.value_BoxCentre==1) | (evs.value_SmallBoxLeft==1) | (evs.value_SmallBoxRight==1) | (evs.value_SmallBoxCentre==1) )].groupby(by=["keeperId","matchId"],as_index=False).id.count()
-    ev_saveboxdanger.rename({"id":"save_boxdanger"},inplace=True,axis=1)
-    ev_sot = evs[(evs.type_value.isin([15,16])) & ((evs.value_Blocked!=1) | (evs.value_Blocked.isna()==True)) ].groupby(by=["keeperId","matchId"],as_index=False).id.count()
-    ev_sot.rename({"id":"opp_sot"},inplace=True,axis=1)
-    ev_sotoneonone = evs[(evs.type_value.isin([15,16])) & ((evs.value_Blocked!=1) | (evs.value_Blocked.isna()==True)) & (evs.isShot==1) & ((evs.qualifiers.str.contains("'qualifierId': 89}")) | (evs["qualifiers"].apply(lambda x: "'qualifierId': 89}".replace("qualifierId", "value").replace("}", ".") not in x)))].groupby(by=["keeperId","matchId"],as_index=False).id.count()
-    ev_sotoneonone.rename({"id":"opp_sotboxdanger"},inplace=True,axis=1)
-    ev_saveoneonone = evs[(evs.type_value.isin([15,16])) & ((evs.value_Blocked!=1) | (evs.value_Blocked.isna()==True)) & (evs.type_value==15) & ((evs["qualifiers"].apply(lambda x: "'qualifierId': 89}".replace("qualifierId", "value").replace("}", ".") not in x)))].groupby(by=["keeperId","matchId"],as_index=False).id.count()
-    ev_saveoneonone.rename({"id":"saves_oneonone"},inplace=True,axis=1)
-    
-    ev_group.rename({"value_Cross":"opp_cross","isShot":"opp_shot","xG":"opp_xG","ps_xG":"opp_psxG","isGoal":"opp_goal",
-                     "isIntervention":"op_ob_interventions","isIntervention_finalthird":"op_ob_interventions_finalthird",
-                     "isIntervention_box":"op_ob_interventions_box"},inplace=True,axis=1)
-    ev_group = pd.merge(ev_group,ev_sot,how="left",on=["keeperId","matchId"])
-    
-    ev_group = pd.merge(ev_group,ev_sotgoalside,how="left",on=["keeperId","matchId"])
-    ev_group = pd.merge(ev_group,ev_savegoalside,how="left",on=["keeperId","matchId"])
-    ev_group = pd.merge(ev_group,ev_sotcc,how="left",on=["keeperId","matchId"])
-    ev_group = pd.merge(ev_group,ev_savecc,how="left",on=["keeperId","matchId"])
-    ev_group = pd.merge(ev_group,ev_sotboxdanger,how="left",on=["keeperId","matchId"])
-    ev_group = pd.merge(ev_group,ev_saveboxdanger,how="left",on=["keeperId","matchId"])
-    ev_group = pd.merge(ev_group,ev_saveoneonone,how="left",on=["keeperId","matchId"])
-    
+    return evs[evs.minute<evs.subbedInExpandedMinute]
+
+
+def get_gk_events(event_data,player_data,dim_team):
+    """
+    Métricas de portero por (playerId, matchId) en una sola pasada: todas las máscaras
+    (tiro a puerta no bloqueado, parada, zona de portería, ocasión clara, zona de peligro...)
+    se calculan una vez y se agregan con un único groupby.
+
+    Vale para cualquier conjunto de eventos (un partido o una competición-temporada entera):
+    player_data debe traer matchId, teamId, keeperId y subbedInExpandedMinute.
+    """
+    evs = _gk_eventos_rival(event_data, player_data, dim_team)
+
+    tv = evs.type_value
+    blocked_shot = tv.isin([15,16]) & (evs.value_Blocked==1)
+    is_shot = tv.isin([13,14,15,16])
+    intervention = tv.isin(GK_INTERVENTION_TYPES)
+    has_id = evs.id.notna()
+
+    sot = tv.isin([15,16]) & ~(evs.value_Blocked==1) & has_id
+    save = sot & (tv==15)
+    goalside = (evs.value_HighLeft==1) | (evs.value_LowRight==1) | (evs.value_HighRight==1) | (evs.value_LowLeft==1)
+    bigchance = evs.value_BigChance==1
+    boxdanger = (evs.value_BoxCentre==1) | (evs.value_SmallBoxLeft==1) | (evs.value_SmallBoxRight==1) | (evs.value_SmallBoxCentre==1)
+    # Se mantiene la comprobación original sobre "'value': 89." (no es un qualifierId)
+    no_oneonone = ~evs["qualifiers"].astype(str).str.contains("'value': 89.", regex=False)
+
+    medidas = pd.DataFrame({
+        "opp_cross": evs.value_Cross,
+        "opp_psxG": evs.ps_xG.where(~blocked_shot, 0),
+        "opp_xG": evs.xG,
+        "opp_shot": is_shot,
+        "opp_goal": tv==16,
+        "op_ob_interventions": intervention,
+        "op_ob_interventions_finalthird": intervention & (evs.tercio_id==3),
+        "op_ob_interventions_box": intervention & (evs.x>=83) & ((evs.y>=21.1) | (evs.y<=78.9)),
+        "opp_sot": sot,
+        "opp_sotgoalside": sot & goalside,
+        "save_goalside": save & goalside,
+        "opp_sotcc": sot & bigchance,
+        "save_cc": save & bigchance,
+        "opp_sotboxdanger": sot & boxdanger,
+        "save_boxdanger": save & boxdanger,
+        "saves_oneonone": save & no_oneonone,
+    }, index=evs.index)
+    bools = medidas.columns[medidas.dtypes == bool]
+    medidas[bools] = medidas[bools].astype(np.int64)
+    medidas[GK_KEYS] = evs[GK_KEYS]
+
+    ev_group = medidas.groupby(by=GK_KEYS,as_index=False).sum()
     ev_group.rename({"keeperId":"playerId"},axis=1,inplace=True)
     ev_group = ev_group.fillna(0)
     return ev_group
 
 
-def get_pu_claims(events_gk):
-    pu_claims=pd.DataFrame()
-    pus=events_gk[((events_gk['type_displayName'].isin(["Claim","Punch"])) & (events_gk['outcomeType_value']!=1)) | (events_gk['type_displayName'].isin(["KeeperPickup","Keeper pick-up"]))]
-    for m in pus.matchId.unique():
-        match = pus[pus.matchId==m]
-        cn= match[(match['type_displayName'].isin(["Claim","Punch"])) & (match['outcomeType_value']!=1)]
-        puck = match[(match['type_displayName'].isin(["KeeperPickup","Keeper pick-up"]))]
-        for i,j in cn.iterrows():
-            p=puck[(puck.time_seconds>=j['time_seconds']) & (puck.time_seconds<=j['time_seconds']+5)]
-            p['seconds_after'] = p.time_seconds-j['time_seconds']
-            p['claim_id'] = j['id']
-            if p.shape[0]>0:
-                pu_claims=pd.concat([pu_claims,p])
-    return pu_claims
+PU_CLAIM_WINDOW = 5  # segundos tras la salida (Claim/Punch fallido) en los que buscar el blocaje
 
 
-def add_auxiliary_columns(df):
+def get_pu_claims(events_gk):
     """
-    Añade columnas auxiliares necesarias para los filtros.
+    Empareja cada Claim/Punch no exitoso con los KeeperPickup del mismo partido que ocurren en
+    los `PU_CLAIM_WINDOW` segundos siguientes (ambos extremos incluidos).
+
+    Join por ventana temporal: los blocajes se ordenan por (partido, time_seconds) y el rango de
+    cada salida se obtiene con searchsorted, sin recorrer las salidas fila a fila.
+
+    Returns:
+        Filas de blocaje (con su índice original) más `seconds_after` y `claim_id`, ordenadas por
+        partido, salida y tiempo; DataFrame vacío si no hay emparejamientos.
     """
-    df = df.reset_index(drop=True)
+    tipo = events_gk['type_displayName']
+    es_claim = (tipo.isin(["Claim","Punch"]) & (events_gk['outcomeType_value']!=1)).to_numpy()
+    es_pick = tipo.isin(["KeeperPickup","Keeper pick-up"]).to_numpy()
+    if not es_claim.any() or not es_pick.any():
+        return pd.DataFrame()
+
+    # Partidos en orden de primera aparición (NaN -> -1, nunca empareja)
+    pus = np.flatnonzero(es_claim | es_pick)
+    codes = np.full(len(events_gk), -1, dtype=np.int64)
+    codes[pus] = pd.factorize(events_gk['matchId'].to_numpy()[pus])[0]
+    time = events_gk['time_seconds'].to_numpy(dtype=np.float64)
+    valido = (codes >= 0) & ~np.isnan(time)
+
+    cn = np.flatnonzero(es_claim & valido)
+    pk = np.flatnonzero(es_pick & valido)
+    if len(cn) == 0 or len(pk) == 0:
+        return pd.DataFrame()
+    cn = cn[np.lexsort((cn, codes[cn]))]
+    pk = pk[np.lexsort((time[pk], codes[pk]))]
+
+    # Clave (partido, tiempo) monótona: cada partido ocupa un tramo mayor que la ventana
+    t0 = min(time[cn].min(), time[pk].min())
+    tramo = max(time[cn].max(), time[pk].max()) - t0 + 2 * PU_CLAIM_WINDOW + 1
+    clave_pk = codes[pk] * tramo + (time[pk] - t0)
+    clave_cn = codes[cn] * tramo + (time[cn] - t0)
+    lo = np.searchsorted(clave_pk, clave_cn - 0.5, side="left")
+    hi = np.searchsorted(clave_pk, clave_cn + PU_CLAIM_WINDOW + 0.5, side="right")
+
+    n = hi - lo
+    c_idx = np.repeat(cn, n)
+    p_idx = pk[np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n) + np.repeat(lo, n)]
+    # Comparación exacta de la ventana (la clave solo acota el rango candidato)
+    dentro = ((codes[p_idx] == codes[c_idx]) & (time[p_idx] >= time[c_idx])
+              & (time[p_idx] <= time[c_idx] + PU_CLAIM_WINDOW))
+    c_idx, p_idx = c_idx[dentro], p_idx[dentro]
+    if len(p_idx) == 0:
+        return pd.DataFrame()
+
+    pu_claims = events_gk.iloc[p_idx].copy()
+    pu_claims['seconds_after'] = time[p_idx] - time[c_idx]
+    pu_claims['claim_id'] = events_gk['id'].to_numpy()[c_idx]
+    return pu_claims
+
+
+OPEN_PASS_EXCLUDED_QUALIFIERS = (5, 6, 107)
+AUXILIARY_COLUMNS = ["progressive_pass", "progressive_carry", "open_pass", "final_third_pass",
+                     "claim_safe", "value_Length_alt"]
+
+
+def _auxiliary_columns(df):
+    """add_auxiliary_columns sobre un bloque de partidos completos (índice ya reseteado)."""
     df['qualifiers'] = df['qualifiers'].astype(str)
-    cols_to_init = [
-        "progressive_pass",
-        "progressive_carry",
-        "open_pass",
-        "final_third_pass",
-        "claim_safe",
-        "value_Length_alt"
-    ]
-    for col in cols_to_init:
-        df[col] = False
-    gpu = get_pu_claims(df)
+    is_pass = (df['type_displayName']=="Pass").to_numpy()
+    x, endX = df.x.to_numpy(), df.endX.to_numpy()
+    aux = {}
+
     # --- Progressive Pass ---
-    df["progressive_pass"] = ((df['type_displayName']=="Pass") &
+    aux["progressive_pass"] = ((df['type_displayName']=="Pass") &
                       (df.endX>df.x) &
                       (((df.endX-df.x)*105/100 > 30) & (df.endX<50)
                        | ((df.endX-df.x)*105/100 > 15) & (df.endX>50) & (df.x<=50)
                        | ((df.endX-df.x)*105/100 > 10) & (df.endX>50) & (df.x>=50)
-                       ))
-    df["progressive_carry"] = ((df['type_value']==101) &
-                      ((df.endX-df.x)>=5))
-                     
+                       )).to_numpy()
+    aux["progressive_carry"] = ((df['type_value']==101) &
+                      ((df.endX-df.x)>=5)).to_numpy()
+
     # --- Open Play Pass ---
-    df["open_pass"] = (
-        (df["type_displayName"] == "Pass") &
-        ((~df.qualifiers.str.contains("'qualifierId': 5}")) & ((df["qualifiers"].apply(lambda x: "'qualifierId': 5}".replace("qualifierId", "value").replace("}", ".") not in x)))) &
-        ((~df.qualifiers.str.contains("'qualifierId': 6}")) & ((df["qualifiers"].apply(lambda x: "'qualifierId': 6}".replace("qualifierId", "value").replace("}", ".") not in x)))) &
-        (df.value_Chipped==1) & (df.endX>df.x) & (df.y>21.1) & (df.y<=78.9) &
-        ((~df.qualifiers.str.contains("'qualifierId': 107}")) & ((df["qualifiers"].apply(lambda x: "'qualifierId': 107}".replace("qualifierId", "value").replace("}", ".") not in x)))) & 
-        (df.endX<=50) & (df.endX>17) & ((df.endY<21.1) | (df.endY>78.9))
+    # Primero las condiciones numéricas; las exclusiones por qualifiers solo se evalúan en los candidatos
+    open_pass = (
+        is_pass & (df.value_Chipped==1).to_numpy() & (endX>x) & (df.y>21.1).to_numpy() & (df.y<=78.9).to_numpy() &
+        (endX<=50) & (endX>17) & ((df.endY<21.1) | (df.endY>78.9)).to_numpy()
     )
+    cand = np.flatnonzero(open_pass)
+    if len(cand):
+        sub = df.iloc[cand]
+        excluded = np.zeros(len(cand), dtype=bool)
+        for q in OPEN_PASS_EXCLUDED_QUALIFIERS:
+            excluded |= has_qualifier(sub, q, exact=True)
+            # Se mantiene la comprobación original sobre "'value': N." (no es un qualifierId)
+            excluded |= sub["qualifiers"].str.contains(f"'value': {q}.", regex=False).to_numpy()
+        open_pass[cand[excluded]] = False
+    aux["open_pass"] = open_pass
 
     # --- Final Third Pass ---
-    df["final_third_pass"] = (
-        (df["type_displayName"] == "Pass") &
-        (df["endX"] >= 66.6) & (df.x<66.6)  # Consideramos final third como último tercio
-    )
-    if gpu.shape[0]>0:
+    aux["final_third_pass"] = is_pass & (endX >= 66.6) & (x < 66.6)  # Consideramos final third como último tercio
+
     # --- Safe Claim ---
-        df["claim_safe"] = ((
-            (df["type_displayName"].isin(["Claim", "Punch"])) &
-            (df["outcomeType_value"] != 1)  # Exitoso
-            & (df.id.isin(gpu.claim_id.unique())))
-            | ((df["type_displayName"].isin(["Punch"])) & (df["outcomeType_value"] == 1))
-        )
+    gpu = get_pu_claims(df)
+    claim_ids = gpu.claim_id.unique() if len(gpu) else []
+    aux["claim_safe"] = ((
+        (df["type_displayName"].isin(["Claim", "Punch"])) &
+        (df["outcomeType_value"] != 1)  # Exitoso
+        & (df.id.isin(claim_ids)))
+        | ((df["type_displayName"].isin(["Punch"])) & (df["outcomeType_value"] == 1))
+    ).to_numpy()
 
     # --- Alternativa para pases: calcular longitud alternativa (positivo/negativo) ---
-    df["value_Length_alt"] = df.apply(
-        lambda x: -x["value_Length"] if x["x"] > x["endX"] else x["value_Length"],
-        axis=1
-    )
+    length = df["value_Length"].to_numpy()
+    aux["value_Length_alt"] = np.where(x > endX, -length, length)
     #df.replace({False:0,True:1},inplace=True)
-    return df
+    return _asigna_columnas(df, aux)
+
+
+def _match_chunks(df, chunk_rows):
+    """Posiciones de filas agrupadas en bloques de partidos completos de ~chunk_rows filas."""
+    codes = pd.factorize(df["matchId"], use_na_sentinel=False)[0]
+    orden = np.argsort(codes, kind="stable")
+    cortes = np.flatnonzero(np.diff(codes[orden])) + 1
+    bloque, n = [], 0
+    for pos in np.split(orden, cortes):
+        if bloque and n + len(pos) > chunk_rows:
+            yield np.concatenate(bloque)
+            bloque, n = [], 0
+        bloque.append(pos)
+        n += len(pos)
+    if bloque:
+        yield np.concatenate(bloque)
+
+
+def iter_auxiliary_columns(chunks):
+    """
+    Versión en streaming de add_auxiliary_columns: recibe un iterable de DataFrames de eventos
+    (cada uno con partidos completos, p.ej. leídos de la BBDD por tandas) y devuelve cada bloque
+    con las columnas auxiliares. La memoria queda acotada por el tamaño del bloque.
+    """
+    for chunk in chunks:
+        yield _auxiliary_columns(chunk.reset_index(drop=True))
+
+
+def add_auxiliary_columns(df, chunk_rows=None):
+    """
+    Añade columnas auxiliares necesarias para los filtros.
+
+    Con `chunk_rows` se procesa por bloques de partidos completos de ~chunk_rows filas
+    (los emparejamientos Claim/Punch -> KeeperPickup nunca cruzan partidos); el resultado
+    conserva el orden de filas de `df`.
+    """
+    df = df.reset_index(drop=True)
+    if not chunk_rows or len(df) <= chunk_rows:
+        return _auxiliary_columns(df)
+    posiciones = list(_match_chunks(df, chunk_rows))
+    out = pd.concat(list(iter_auxiliary_columns(df.iloc[p] for p in posiciones)), ignore_index=True)
+    orden = np.argsort(np.concatenate(posiciones), kind="stable")
+    return out.iloc[orden].reset_index(drop=True)
+
+CARRY_KEYS = ['playerId', 'season', 'playerName']
+CARRY_KPIS = ['carry_box', 'carry_succ_box', 'carry_prog', 'carries', 'carries_finalthird', 'carries_ext']
+
+
+def _carry_flags(df):
+    """Condiciones de conducción de `df` como dict {kpi: array bool}, sin modificar `df`."""
+    carry = df['type_displayName'].isin(['Carry']).to_numpy()
+    box = ((df['endX'] >= 83) & (df['endY'] >= 21.1) & (df['endY'] <= 78.9)).to_numpy()
+    if 'progressive_carry' in df.columns:
+        prog = df['progressive_carry'].astype(bool).to_numpy()
+    else:
+        # Misma regla que add_auxiliary_columns
+        prog = ((df['type_value']==101) & ((df.endX-df.x)>=5)).to_numpy()
+    return {
+        'carry_box': carry & box,
+        'carry_succ_box': carry & (df['outcomeType_value'] == 1).to_numpy() & box,
+        'carry_prog': prog,
+        'carries': carry,
+        'carries_finalthird': carry & (df['tercio_id'] == 3).to_numpy(),
+        'carries_ext': carry & (df['carril_id'] == 'EXT').to_numpy(),
+    }
+
 
 def calcular_kpis_carries(df):
     # Asegurarse de que ciertas columnas están en el formato correcto
     df['progressive_carry'] = df['progressive_carry'].astype(bool)
 
-    # Columnas con condiciones
-    df['carry_box'] = (
-        (df['type_displayName'].isin(['Carry'])) &
-        (df['endX'] >= 83) &
-        (df['endY'] >= 21.1) & (df['endY'] <= 78.9)
-    )
+    # Columnas con condiciones (se siguen añadiendo a `df`, como antes)
+    for col, values in _carry_flags(df).items():
+        df[col] = values
 
-    df['carry_succ_box'] = (
-        (df['type_displayName'].isin(['Carry'])) &
-        (df['outcomeType_value'] == 1) &
-        (df['endX'] >= 83) &
-        (df['endY'] >= 21.1) & (df['endY'] <= 78.9)
-    )
+    # Agrupar y contar cada métrica
+    kpis = df.groupby(CARRY_KEYS, observed=True)[CARRY_KPIS].sum().reset_index()
 
-    df['carry_prog'] = (df['progressive_carry'] == True)
+    return kpis
 
-    df['carries'] = df['type_displayName'].isin(['Carry'])
 
-    df['carries_finalthird'] = (
-        df['type_displayName'].isin(['Carry']) &
-        (df['tercio_id'] == 3)
-    )
+def calcular_kpis_carries_stream(chunks):
+    """
+    KPIs de conducción por jugador a partir de un iterable de bloques de eventos (p.ej. un partido
+    o una tanda de partidos leída de la BBDD). No modifica los bloques: de cada uno solo se
+    agregan sumas parciales por jugador, así que la memoria depende del nº de jugadores y del
+    tamaño del bloque, no de la temporada. Mismo resultado que calcular_kpis_carries sobre la
+    concatenación de los bloques.
+    """
+    acumulado = None
+    for chunk in chunks:
+        if len(chunk) == 0:
+            continue
+        flags = pd.DataFrame(_carry_flags(chunk), index=chunk.index).astype(np.int64)
+        parcial = pd.concat([chunk[CARRY_KEYS], flags], axis=1).groupby(CARRY_KEYS, observed=True)[CARRY_KPIS].sum()
+        acumulado = parcial if acumulado is None else pd.concat([acumulado, parcial]).groupby(level=CARRY_KEYS, observed=True).sum()
+    if acumulado is None:
+        return pd.DataFrame(columns=CARRY_KEYS + CARRY_KPIS)
+    return acumulado.reset_index()
 
-    df['carries_ext'] = (
-        df['type_displayName'].isin(['Carry']) &
-        (df['carril_id'] == 'EXT')
-    )
+# ---------------------------------------------------------------------
+# Plan compilado de series (series_config_abp.json)
+# ---------------------------------------------------------------------
+_COMPARE_OPS = {
+    "==": lambda col, val: col == val,
+    "!=": lambda col, val: col != val,
+    ">": lambda col, val: col > val,
+    ">=": lambda col, val: col >= val,
+    "<": lambda col, val: col < val,
+    "<=": lambda col, val: col <= val,
+    "in": lambda col, val: col.isin(val),
+}
 
-    # Agrupar y contar cada métrica
-    kpis = df.groupby(['playerId', 'season', 'playerName'])[
-        ['carry_box', 'carry_succ_box', 'carry_prog', 'carries', 'carries_finalthird', 'carries_ext']
-    ].sum().reset_index()
 
-    return kpis
+@dataclass
+class SeriesPlan:
+    """
+    Plan compilado a partir de un series_config.
+
+    predicates: lista de predicados únicos (column, op, value); cada uno se evalúa una sola vez.
+    series: lista de (nombre, términos, agg_column, convert_meters). Cada término es una tupla
+            de índices de predicados que se combinan con OR (un único índice = filtro simple).
+    """
+    predicates: list
+    series: list
+
+    @property
+    def names(self):
+        return [s[0] for s in self.series]
+
+
+def _freeze(value):
+    return tuple(value) if isinstance(value, list) else value
+
+
+def compile_series_config(series_config):
+    """
+    Compila un series_config en un SeriesPlan, deduplicando los predicados de los filtros.
+    Los "contains" dentro de un bloque "or" se compilan como "re_contains" para respetar
+    la semántica original (regex, sin la variante con ".").
+    """
+    if isinstance(series_config, SeriesPlan):
+        return series_config
+
+    pred_ids = {}
+    predicates = []
+
+    def _pred(col, op, val):
+        key = (col, op, _freeze(val))
+        if key not in pred_ids:
+            pred_ids[key] = len(predicates)
+            predicates.append(key)
+        return pred_ids[key]
 
-def transform_events_agg(event_data, series_config,gr_cols):
-    
-    results = {}
-    
-    
+    series = []
     for name, config in series_config.items():
-            df_filtered = event_data.copy()
-            
-            if "filters" in config:
-                for f in config["filters"]:
-                    if "or" in f:
-                        op_map = {
-                            "==": lambda col, val: col == val,
-                            "!=": lambda col, val: col != val,
-                            ">": lambda col, val: col > val,
-                            ">=": lambda col, val: col >= val,
-                            "<": lambda col, val: col < val,
-                            "<=": lambda col, val: col <= val,
-                            "in": lambda col, val: col.isin(val),
-                            "contains": lambda col, val: col.str.contains(val, na=False),
-                            "ncontains": lambda col, val: ~col.str.contains(val, na=False)
-                        }
-
-                        or_conditions = []
-                        for cond in f["or"]:
-                            col, op, val = cond["column"], cond["op"], cond["value"]
-                            if op in op_map:
-                                or_conditions.append(op_map[op](df_filtered[col], val))
-                        
-                        if or_conditions:
-                            df_filtered = df_filtered[pd.concat(or_conditions, axis=1).any(axis=1)]
-                    else:
-                        col, op, val = f["column"], f["op"], f["value"]
-                        if op == "==":
-                            df_filtered = df_filtered[df_filtered[col] == val]
-                        elif op == "!=":
-                            df_filtered = df_filtered[df_filtered[col] != val]
-                        elif op == ">":
-                            df_filtered = df_filtered[df_filtered[col] > val]
-                        elif op == ">=":
-                            df_filtered = df_filtered[df_filtered[col] >= val]
-                        elif op == "<":
-                            df_filtered = df_filtered[df_filtered[col] < val]
-                        elif op == "<=":
-                            df_filtered = df_filtered[df_filtered[col] <= val]
-                        elif op == "in":
-                            df_filtered = df_filtered[df_filtered[col].isin(val)]
-                        elif op == "contains":
-                            df_filtered = df_filtered[(df_filtered[col].str.contains(val,regex=False)) | (df_filtered[col].str.contains(val.replace("}", "."),regex=False)) ]
-                        elif op == "ncontains":
-                            df_filtered = df_filtered[(~df_filtered[col].str.contains(val,regex=False)) & (~df_filtered[col].str.contains(val.replace("}", "."),regex=False)) ]
-            if "aggregation" in config:
-                agg_col = config["aggregation"]["agg_column"]
-                grouped = df_filtered.groupby(by=gr_cols, as_index=False)[agg_col].sum()
-                
-                if config["aggregation"].get("convert_meters", False): 
-                    grouped[agg_col] = grouped[agg_col] * 0.9144
-            else:
-                grouped = df_filtered.groupby(by=gr_cols, as_index=False).type_displayName.count()
-            
-            grouped.columns = gr_cols+[name]
-            results[name] = grouped
-        
-    dfs = [df for df in list(results.values()) if not df.empty]
-    final_df = reduce(lambda left, right: pd.merge(left, right, on=gr_cols, how="outer"), dfs)   
-    
-    
-    
-    
-    ni = [i for i in series_config if i not in final_df.columns]
-    if len(ni)>0:
-        for i in ni:
-            final_df[i]=0
-    final_df = final_df.fillna(0)
+        terms = []
+        for f in config.get("filters", []):
+            if "or" in f:
+                ors = []
+                for cond in f["or"]:
+                    op = cond["op"]
+                    if op in ("contains", "ncontains"):
+                        op = "re_" + op
+                    elif op not in _COMPARE_OPS:
+                        continue
+                    ors.append(_pred(cond["column"], op, cond["value"]))
+                if ors:
+                    terms.append(tuple(ors))
+            elif f["op"] in _COMPARE_OPS or f["op"] in ("contains", "ncontains"):
+                terms.append((_pred(f["column"], f["op"], f["value"]),))
+
+        agg = config.get("aggregation")
+        agg_col = agg["agg_column"] if agg else None
+        convert = bool(agg.get("convert_meters", False)) if agg else False
+        series.append((name, tuple(terms), agg_col, convert))
+    return SeriesPlan(predicates=predicates, series=series)
+
+
+def _eval_predicate(event_data, pred):
+    col, op, val = pred
+    s = event_data[col]
+    if op in _COMPARE_OPS:
+        return _COMPARE_OPS[op](s, list(val) if isinstance(val, tuple) else val).to_numpy(dtype=bool)
+    qualifier = _QUALIFIER_NEEDLE_RE.match(val) if col == "qualifiers" else None
+    if qualifier and QUALIFIER_FLAG.format(qualifier.group(1)) in event_data.columns:
+        # Lookup sobre el índice de qualifiers: la variante "or" (regex) solo ve la forma "N}"
+        m = has_qualifier(event_data, int(qualifier.group(1)), exact=op.startswith("re_"))
+    elif op in ("contains", "ncontains"):
+        m = (s.str.contains(val, regex=False, na=False)
+             | s.str.contains(val.replace("}", "."), regex=False, na=False)).to_numpy(dtype=bool)
+    else:
+        m = s.str.contains(val, na=False).to_numpy(dtype=bool)
+    return ~m if op.endswith("ncontains") else m
+
+
+def transform_events_agg(event_data, series_config, gr_cols, engine="pandas"):
+    """
+    Calcula todas las series de `series_config` agregadas por `gr_cols`.
+
+    Compila la configuración en un SeriesPlan (o recibe uno ya compilado), evalúa cada
+    predicado distinto una única vez como máscara booleana compartida y resuelve todas
+    las series en un solo groupby sobre las filas que cumplen alguna de ellas.
+    Con engine="polars" se usa app/backend_polars.py (mismo resultado).
+    """
+    if engine == "polars":
+        from app import backend_polars
+        return backend_polars.transform_events_agg(event_data, series_config, gr_cols)
+    plan = compile_series_config(series_config)
+    n = len(event_data)
+
+    masks = {}
+
+    def _mask(idx):
+        if idx not in masks:
+            masks[idx] = _eval_predicate(event_data, plan.predicates[idx])
+        return masks[idx]
+
+    series_masks = []
+    for name, terms, agg_col, convert in plan.series:
+        m = np.ones(n, dtype=bool)
+        for term in terms:
+            t = _mask(term[0])
+            for idx in term[1:]:
+                t = t | _mask(idx)
+            m = m & t
+        series_masks.append(m)
+
+    keys_ok = event_data[gr_cols].notna().all(axis=1).to_numpy()
+    rows = np.flatnonzero(np.logical_or.reduce(series_masks) & keys_ok) if series_masks else np.array([], dtype=int)
+
+    values = np.zeros((len(rows), len(plan.series)), dtype=np.float64)
+    present = np.zeros(len(plan.series), dtype=bool)
+    counted = event_data["type_displayName"].notna().to_numpy()[rows]
+    for j, (name, terms, agg_col, convert) in enumerate(plan.series):
+        m = series_masks[j][rows]
+        present[j] = m.any()
+        if agg_col is not None:
+            v = pd.to_numeric(event_data[agg_col], errors="coerce").to_numpy(dtype=np.float64)[rows]
+            values[:, j] = np.where(m & ~np.isnan(v), v, 0.0)
+        else:
+            values[:, j] = m & counted
+
+    names = plan.names
+    keys = event_data[gr_cols].iloc[rows].reset_index(drop=True)
+    final_df = pd.concat([keys, pd.DataFrame(values, columns=names)], axis=1)
+    final_df = final_df.groupby(by=gr_cols, as_index=False, sort=True, observed=True)[names].sum()
+
+    for name, terms, agg_col, convert in plan.series:
+        if convert:
+            final_df[name] = final_df[name] * 0.9144
+
+    # Mismo orden de columnas que el antiguo merge encadenado: primero las series con datos,
+    # después las vacías inicializadas a 0
+    empty = [name for name, p in zip(names, present) if not p]
+    final_df = final_df[gr_cols + [name for name, p in zip(names, present) if p]]
+    if empty:
+        zeros = pd.DataFrame(0, index=final_df.index, columns=empty)
+        final_df = pd.concat([final_df, zeros], axis=1)
     return final_df
 
-def calcula_medidas_compuestas(dd):
-    dd["goals_fromcorner_pct"] = (dd["goals_fromcorner"] / dd["actions_fromcorner"]).replace([np.inf, -np.inf], 0).fillna(0)
-    dd["xg_fromcorner_pct"] = (dd["xg_fromcorner"] / dd["shots_fromcorner"]).replace([np.inf, -np.inf], 0).fillna(0)
-    dd["shots_fromcorner_pct"] = (dd["shots_fromcorner"] / dd["actions_fromcorner"]).replace([np.inf, -np.inf], 0).fillna(0)
-    dd["actions_succ_fromcorner_pct"] = (dd["actions_succ_fromcorner"] / dd["actions_fromcorner"]).replace([np.inf, -np.inf], 0).fillna(0)
-    
-    dd["goals_fromdfk_pct"] = (dd["goals_fromdfk"] / dd["shots_fromdfk"]).replace([np.inf, -np.inf], 0).fillna(0)
-    dd["xg_fromdfk_pct"] = (dd["xg_fromdfk"] / dd["shots_fromdfk"]).replace([np.inf, -np.inf], 0).fillna(0)
-    dd["shots_dfk_pct"] = (dd["shots_succ_fromdfk"] / dd["shots_fromdfk"]).replace([np.inf, -np.inf], 0).fillna(0)
-
-    dd["goals_fromifkbox_pct"] = (dd["goals_fromifkbox"] / dd["shots_fromifkbox"]).replace([np.inf, -np.inf], 0).fillna(0)
-    dd["xg_fromifkbox_pct"] = (dd["xg_fromifkbox"] / dd["shots_fromifkbox"]).replace([np.inf, -np.inf], 0).fillna(0)
-    dd["shots_fromifkbox_pct"] = (dd["shots_fromifkbox"] / dd["actions_fromifkbox"]).replace([np.inf, -np.inf], 0).fillna(0)
-    
-    dd["goals_fromifk_pct"] = (dd["goals_fromifk"] / dd["actions_fromifkbox"]).replace([np.inf, -np.inf], 0).fillna(0)
-    dd["xg_fromifk_pct"] = (dd["xg_fromifk"] / dd["shots_fromifk"]).replace([np.inf, -np.inf], 0).fillna(0)
-    dd["shots_fromifk_pct"] = (dd["shots_fromifk"] / dd["actions_fromifkbox"]).replace([np.inf, -np.inf], 0).fillna(0)
-    dd["actions_succ_fromifkbox_pct"] = (dd["actions_succ_fromifkbox"] / dd["actions_fromifkbox"]).replace([np.inf, -np.inf], 0).fillna(0)
-
-    dd["goals_fromthrowin_pct"] = (dd["goals_fromthrowin"] / dd["actions_fromthrowinbox"]).replace([np.inf, -np.inf], 0).fillna(0)
-    dd["xg_fromthrowin_pct"] = (dd["xg_fromthrowin"] / dd["shots_fromthrowin"]).replace([np.inf, -np.inf], 0).fillna(0)
-    dd["shots_fromthrowin_pct"] = (dd["shots_fromthrowin"] / dd["actions_fromthrowinbox"]).replace([np.inf, -np.inf], 0).fillna(0)
-    dd["actions_succ_fromthrowinbox_pct"] = (dd["actions_succ_fromthrowinbox"] / dd["actions_fromthrowinbox"]).replace([np.inf, -np.inf], 0).fillna(0)
-    
-    
-    # Porcentajes y ratios con protección contra división por cero
-    dd["actions_sp"] = dd["passes_sp"] + dd["shots_fromdfk"]
-    dd["actions_succ_sp"] = dd["passes_succ_sp"] + dd["shots_fromdfk"]
-    dd["actions_succ_sp_pct"] = (dd["actions_succ_sp"] / dd["actions_sp"]).replace([np.inf, -np.inf], 0).fillna(0)
-    dd["goals_sp_pct"] = (dd["goals_sp"] / dd["actions_sp"]).replace([np.inf, -np.inf], 0).fillna(0)
-    dd["shots_sp_pct"] = (dd["shots_sp"] / dd["actions_sp"]).replace([np.inf, -np.inf], 0).fillna(0)
-    dd["xg_sp_pct"] = (dd["xg_sp"] / dd["actions_sp"]).replace([np.inf, -np.inf], 0).fillna(0)
-    
-    dd["actions_1p_fromcorner"] = dd.actions_right_1p_fromcorner + dd.actions_left_1p_fromcorner
-    dd["actions_2p_fromcorner"] = dd.actions_right_2p_fromcorner + dd.actions_left_2p_fromcorner
-    dd["actions_pfoot_fromcorner"] = dd.actions_right_pfoot_fromcorner + dd.actions_left_pfoot_fromcorner
-    dd["actions_ofoot_fromcorner"] = dd.actions_right_ofoot_fromcorner + dd.actions_left_ofoot_fromcorner
-    dd["actions_toolong_fromcorner"] = dd.actions_right_toolong_fromcorner + dd.actions_left_toolong_fromcorner
-    dd["actions_near_fromcorner"] = dd.actions_right_near_fromcorner + dd.actions_left_near_fromcorner
-    dd["shots_created_fromcorner"] = dd["shots_created_left_fromcorner"] + dd["shots_created_right_fromcorner"]
-    dd["xg_created_fromcorner"] = dd["xg_created_left_fromcorner"] + dd["xg_created_right_fromcorner"]
-    
-    dd["actions_lat_fromifkbox"] = dd.actions_right_fromifkbox + dd.actions_left_fromifkbox
-    dd["actions_other_fromifk"] = dd.actions_fromifk - dd.actions_fromifkbox
-    dd["actions_1p_fromifkbox"] = dd.actions_right_1p_fromifkbox + dd.actions_left_1p_fromifkbox
-    dd["actions_2p_fromifkbox"] = dd.actions_right_2p_fromifkbox + dd.actions_left_2p_fromifkbox
-    dd["actions_pfoot_fromifkbox"] = dd.actions_right_pfoot_fromifkbox + dd.actions_left_pfoot_fromifkbox
-    dd["actions_ofoot_fromifkbox"] = dd.actions_right_ofoot_fromifkbox + dd.actions_left_ofoot_fromifkbox
-    
-    dd["actions_1p_fromthrowinbox"] = dd.actions_right_1p_fromthrowinbox + dd.actions_left_1p_fromthrowinbox
-    dd["actions_2p_fromthrowinbox"] = dd.actions_right_2p_fromthrowinbox + dd.actions_left_2p_fromthrowinbox
-    return dd
+# ---------------------------------------------------------------------
+# Tipos compactos para las medidas por evento
+# ---------------------------------------------------------------------
+def measure_dtypes(df, columns, float_dtype=np.float32):
+    """
+    Tipo compacto de cada columna de medida de `df` (ya sin NaN de los indicadores):
+      - indicadores (solo 0/1) -> int8. No uint8: groupby().sum() de uint8 da uint64 y las
+        restas de medidas compuestas darían la vuelta; ni bool: bool + bool es un OR.
+      - el resto de medidas decimales (xG, metros...) -> `float_dtype`.
+      - None: columna no numérica o entera no indicadora, se deja como está.
+    Las columnas inexistentes no aparecen en el resultado.
+    """
+    dtypes = {}
+    for c in dict.fromkeys(columns):
+        if c not in df.columns:
+            continue
+        v = df[c].to_numpy()
+        if v.dtype.kind not in "biuf":
+            dtypes[c] = None
+        elif ((v == 0) | (v == 1)).all():
+            dtypes[c] = np.int8
+        else:
+            dtypes[c] = float_dtype if v.dtype.kind == "f" else None
+    return dtypes
+
+
+def merge_measure_dtypes(a, b):
+    """
+    Combina los measure_dtypes de dos trozos del mismo DataFrame (p.ej. lotes de partidos) en los
+    que daría el DataFrame completo: int8 solo si la columna es indicadora en ambos.
+    """
+    out = dict(a)
+    for c, t in b.items():
+        if c not in out:
+            out[c] = t
+        elif out[c] is None or t is None:
+            out[c] = None
+        elif out[c] != t:
+            out[c] = t if out[c] == np.int8 else out[c]
+    return out
+
+
+def compact_measure_dtypes(df, columns, float_dtype=np.float32, dtypes=None):
+    """
+    Reduce el tipo de las columnas de medida de `df` según measure_dtypes. `dtypes` permite
+    aplicar un plan ya calculado (p.ej. el de todo el scope en el modo streaming).
+    """
+    if dtypes is None:
+        dtypes = measure_dtypes(df, columns, float_dtype)
+    dtypes = {c: t for c, t in dtypes.items() if t is not None and c in df.columns}
+    return df.astype(dtypes) if dtypes else df
+
+
+# ---------------------------------------------------------------------
+# Medidas compuestas (config/medidas_compuestas.json)
+# ---------------------------------------------------------------------
+COMPOSITES_CONFIG = Path(__file__).resolve().parent / "config" / "medidas_compuestas.json"
+_COMPOSITE_OPS = ("ratio", "sum", "diff")
+
+
+@dataclass(frozen=True)
+class CompositePlan:
+    """Medidas compuestas en orden de evaluación: (nombre, op, columnas de entrada)."""
+    measures: tuple
+
+    @property
+    def names(self):
+        return [name for name, _, _ in self.measures]
+
+
+def compile_composite_spec(spec=None):
+    """
+    Compila el spec de medidas compuestas. Acepta un CompositePlan ya compilado, un dict
+    {nombre: {"op": "ratio", "num": a, "den": b} | {"op": "sum"|"diff", "cols": [a, b, ...]}}
+    o la ruta a un JSON con ese formato (por defecto config/medidas_compuestas.json).
+    """
+    if isinstance(spec, CompositePlan):
+        return spec
+    if spec is None or isinstance(spec, (str, Path)):
+        with open(spec or COMPOSITES_CONFIG, "r", encoding="utf-8") as f:
+            spec = json.load(f)
+    measures = []
+    for name, d in spec.items():
+        op = d["op"]
+        if op not in _COMPOSITE_OPS:
+            raise ValueError(f"Operación no soportada en '{name}': {op}")
+        cols = (d["num"], d["den"]) if op == "ratio" else tuple(d["cols"])
+        measures.append((name, op, cols))
+    return CompositePlan(tuple(measures))
+
+
+def evaluate_composites(data, spec=None, dtype=None):
+    """
+    Evalúa las medidas compuestas sobre `data` (DataFrame o dict de arrays) y devuelve un dict
+    {nombre: np.ndarray} en el orden del spec. Las medidas pueden usar otras definidas antes.
+
+    Los ratios usan división segura: x/0, 0/0 y NaN valen 0 (equivale al antiguo
+    `(a / b).replace([inf, -inf], 0).fillna(0)`). Con `dtype` (p.ej. np.float32) los ratios
+    y las sumas decimales se escriben en ese tipo; las sumas enteras se hacen en int64 (los
+    agregados de indicadores int8 pueden seguir en int8 y la suma daría la vuelta).
+    """
+    plan = compile_composite_spec(spec)
+    out = {}
+
+    def col(c):
+        if c in out:
+            return out[c]
+        v = data[c]
+        return v.to_numpy() if isinstance(v, pd.Series) else np.asarray(v)
+
+    for name, op, cols in plan.measures:
+        if op == "ratio":
+            num = np.asarray(col(cols[0]), dtype=np.float64)
+            den = np.asarray(col(cols[1]), dtype=np.float64)
+            res = np.zeros(len(num), dtype=np.float64)
+            with np.errstate(invalid="ignore", over="ignore"):
+                np.divide(num, den, out=res, where=den != 0)
+            res[~np.isfinite(res)] = 0
+        else:
+            res = col(cols[0])
+            if res.dtype.kind in "biu":
+                res = res.astype(np.int64)
+            for c in cols[1:]:
+                res = res + col(c) if op == "sum" else res - col(c)
+        if dtype is not None and np.issubdtype(res.dtype, np.floating):
+            res = res.astype(dtype, copy=False)
+        out[name] = res
+    return out
+
+
+def calcula_medidas_compuestas(dd, spec=None, dtype=None, engine="pandas"):
+    """
+    Añade a `dd` las medidas compuestas (ratios y sumas) definidas en config/medidas_compuestas.json.
+    Las columnas que ya existen se sobrescriben en su sitio y las nuevas se añaden en un único concat.
+    Con engine="polars" las medidas se evalúan con app/backend_polars.py.
+
+    Returns:
+        DataFrame con las medidas compuestas
+    """
+    if engine == "polars":
+        from app import backend_polars
+        return backend_polars.calcula_medidas_compuestas(dd, spec, dtype)
+    return _asigna_columnas(dd, evaluate_composites(dd, spec, dtype))
+
+
+# ---------------------------------------------------------------------
+# Medidas de secuencia (series_config_secuencia.json)
+# ---------------------------------------------------------------------
+SEQ_SORT = ['matchId', 'period_value', 'time_seconds']
+SHOT_TYPES = [13, 14, 15, 16]
+
+
+@dataclass
+class SecuenciaContext:
+    """
+    Contexto compartido por todas las medidas de secuencia de un partido (o conjunto de partidos).
+    Se construye una sola vez: orden por partido/periodo/tiempo, bloques de periodo, posiciones
+    de tiros y posiciones de las acciones de cada jugador.
+
+    df: DataFrame ordenado por SEQ_SORT con índice 0..n-1.
+    bloque: id del bloque (matchId, period_value) de cada fila; las filas sin partido o
+            periodo tienen un id propio negativo (nunca se enlazan con otras).
+    inicios: posición de inicio de cada bloque.
+    time: time_seconds como float64.
+    tiros: posiciones de las acciones de tiro (type_value en SHOT_TYPES).
+    jugadores: MultiIndex (matchId, period_value, playerId) de los grupos de jugador.
+    acciones: posiciones de las acciones con jugador y tiempo, ordenadas por (grupo, posición).
+    clave_acciones: clave ordenable (grupo, rango del tiempo) de `acciones`.
+    """
+    df: pd.DataFrame
+    bloque: np.ndarray
+    inicios: np.ndarray
+    time: np.ndarray
+    tiros: np.ndarray
+    jugadores: pd.MultiIndex
+    grupo: np.ndarray
+    rango: np.ndarray
+    acciones: np.ndarray
+    clave_acciones: np.ndarray
+
+    @property
+    def n(self):
+        return len(self.df)
+
+
+def build_secuencia_context(df):
+    """Ordena una única vez y precalcula las estructuras que usan las medidas de secuencia."""
+    if isinstance(df, SecuenciaContext):
+        return df
+    df = df.sort_values(by=SEQ_SORT, ascending=True).reset_index(drop=True)
+    n = len(df)
+    pos = np.arange(n)
+
+    # Bloques (matchId, period_value): el df ya está ordenado, basta detectar los cambios
+    claves = df[["matchId", "period_value"]]
+    nulas = claves.isna().any(axis=1).to_numpy()
+    cambio = np.ones(n, dtype=bool)
+    if n > 1:
+        cambio[1:] = (claves.iloc[1:].to_numpy() != claves.iloc[:-1].to_numpy()).any(axis=1)
+    cambio |= nulas
+    bloque = np.cumsum(cambio) - 1
+    bloque[nulas] = -(pos[nulas] + 1)
+    inicios = np.flatnonzero(cambio & ~nulas)
+
+    time = df["time_seconds"].to_numpy(dtype=np.float64)
+    tiros = np.flatnonzero(df["type_value"].isin(SHOT_TYPES).to_numpy())
+
+    # Grupos de jugador por (partido, periodo, playerId) y clave (grupo, rango del tiempo):
+    # dentro de cada grupo el orden de df ya es temporal
+    player = pd.to_numeric(df["playerId"], errors="coerce").to_numpy(dtype=np.float64)
+    grupo, jugadores = pd.MultiIndex.from_arrays(
+        [df["matchId"].to_numpy(), df["period_value"].to_numpy(), player]
+    ).factorize()
+    grupo = np.asarray(grupo, dtype=np.int64)
+    grupo[nulas | np.isnan(player)] = -1
+    rango = pd.Series(time).rank(method="dense").fillna(0).to_numpy(dtype=np.int64)
+    acciones = np.flatnonzero((grupo >= 0) & ~np.isnan(time))
+    acciones = acciones[np.lexsort((acciones, grupo[acciones]))]
+    clave_acciones = grupo[acciones] * (n + 1) + rango[acciones]
+
+    return SecuenciaContext(df=df, bloque=bloque, inicios=inicios, time=time, tiros=tiros,
+                            jugadores=jugadores, grupo=grupo, rango=rango, acciones=acciones,
+                            clave_acciones=clave_acciones)
+
+
+def _mask(ctx, col):
+    return (ctx.df[col] == 1).to_numpy()
+
+
+def _link_next_shot(ctx, pre):
+    """
+    Enlaza cada posición de `pre` con el primer tiro posterior (en el orden del contexto) si
+    está en el mismo partido y periodo y con tiempo mayor o igual. searchsorted: O(n log n).
+
+    Returns:
+        (pre, siguiente): posiciones de las filas enlazadas y de su tiro.
+    """
+    tiros = ctx.tiros
+    k = np.searchsorted(tiros, pre, side="right")
+    ok = k < len(tiros)
+    pre, siguiente = pre[ok], tiros[k[ok]]
+    ok = (ctx.bloque[siguiente] == ctx.bloque[pre]) & (ctx.time[siguiente] >= ctx.time[pre])
+    return pre[ok], siguiente[ok]
+
+
+def _first_contact(ctx, pre):
+    """
+    Enlaza cada posición de `pre` con la primera acción (en el orden del contexto) de su
+    receptor (`pase_receptor_id`) en el mismo partido y periodo con tiempo mayor o igual.
+    As-of agrupado por (matchId, period_value, playerId) resuelto con searchsorted.
+
+    Returns:
+        (pre, contacto): posiciones de las entregas enlazadas y de su primer contacto.
+    """
+    df, n = ctx.df, ctx.n
+    receptor = pd.to_numeric(df["pase_receptor_id"], errors="coerce").to_numpy(dtype=np.float64)[pre]
+    g_pre = ctx.jugadores.get_indexer(pd.MultiIndex.from_arrays(
+        [df["matchId"].to_numpy()[pre], df["period_value"].to_numpy()[pre], receptor]
+    ))
+    ok = (g_pre >= 0) & ~np.isnan(receptor) & ~np.isnan(ctx.time[pre])
+    pre, g_pre = pre[ok], g_pre[ok]
+
+    k = np.searchsorted(ctx.clave_acciones, g_pre * (n + 1) + ctx.rango[pre], side="left")
+    ok = k < len(ctx.acciones)
+    ok[ok] = ctx.grupo[ctx.acciones[k[ok]]] == g_pre[ok]
+    return pre[ok], ctx.acciones[k[ok]]
+
+
+def _secuencia_xg(ctx, col_tiro):
+    pre, siguiente = _link_next_shot(ctx, np.flatnonzero(_mask(ctx, col_tiro)))
+    xg = np.full(ctx.n, np.nan)
+    xg[pre] = ctx.df["xG"].to_numpy(dtype=np.float64)[siguiente]
+    return xg
+
+
+def _shotproc_columnas(col_sec, col_tiro):
+    """Columna de tiros (sin lado/longitud) y columna de acción ABP genérica de una medida shotproc."""
+    col_shots = col_sec.replace("_left_","_").replace("_right_","_").replace("_short_","_").replace("_long_","_").replace("__","_")
+    col_abp = col_tiro.split("_")[0]+ "_" + col_tiro.split("_")[-1]
+    return col_shots, col_abp
+
+
+def _secuencia_shotproc(ctx, medidas):
+    pos = np.arange(ctx.n)
+    por_abp = {}
+    for col_sec, col_tiro in medidas.items():
+        col_shots, col_abp = _shotproc_columnas(col_sec, col_tiro)
+        por_abp.setdefault(col_abp, []).append((col_sec, col_tiro, col_shots))
+
+    nuevas = dict.fromkeys(medidas)
+    for col_abp, destinos in por_abp.items():
+        # As-of hacia atrás: acción ABP inmediatamente anterior (estrictamente) a cada fila
+        pre = np.flatnonzero(_mask(ctx, col_abp))
+        k = np.searchsorted(pre, pos, side="left") - 1
+        enlazada = k >= 0
+        prev = pre[np.maximum(k, 0)] if len(pre) else np.zeros(ctx.n, dtype=np.int64)
+        enlazada &= (ctx.bloque[prev] == ctx.bloque) & (ctx.time[prev] <= ctx.time)
+
+        for col_sec, col_tiro, col_shots in destinos:
+            shots = ctx.df[col_shots].to_numpy()
+            m = enlazada & (shots == 1) & _mask(ctx, col_tiro)[prev]
+            nuevas[col_sec] = np.where(m, shots, np.nan).astype(np.float64)
+    return nuevas
+
+
+def _secuencia_contacts(ctx, col_tiro):
+    df = ctx.df
+    col_abp = col_tiro.split("_")[-1]
+    contacto = np.unique(_first_contact(ctx, np.flatnonzero(_mask(ctx, col_tiro)))[1])
+
+    # Flags de la fila de contacto: cabezazo, resultado, fuera y pase clave
+    header = has_qualifier(df, 15)[contacto]
+    outcome = df["outcomeType_value"].to_numpy()[contacto]
+    succ = outcome == 1
+    lost = outcome == 0
+    out = has_qualifier(df, 167)[contacto]
+    kp = succ & has_qualifier(df, 210)[contacto]
+
+    def _col(m):
+        v = np.full(ctx.n, np.nan)
+        v[contacto[m]] = 1
+        return v
+
+    return {
+        "actions_contacts_{}".format(col_abp): _col(np.ones(len(contacto), dtype=bool)),
+        "actions_contacts_header_{}".format(col_abp): _col(header),
+        "actions_contacts_header_succ_{}".format(col_abp): _col(header & succ),
+        "actions_contacts_header_lostinplay_{}".format(col_abp): _col(header & lost),
+        "actions_contacts_header_lostout_{}".format(col_abp): _col(header & out),
+        "actions_contacts_header_kp_{}".format(col_abp): _col(header & kp),
+        "actions_contacts_succ_{}".format(col_abp): _col(~header & succ),
+        "actions_contacts_lostinplay_{}".format(col_abp): _col(~header & lost),
+        "actions_contacts_lostout_{}".format(col_abp): _col(~header & out),
+        "actions_contacts_kp_{}".format(col_abp): _col(~header & kp),
+    }
+
+
+def _asigna_columnas(df, nuevas):
+    """Asigna las columnas calculadas: las existentes en su sitio, las nuevas en un único concat."""
+    nuevas = dict(nuevas)
+    for c in [c for c in nuevas if c in df.columns]:
+        df[c] = nuevas.pop(c)
+    if nuevas:
+        df = pd.concat([df, pd.DataFrame(nuevas, index=df.index)], axis=1)
+    return df
 
 
 def calcula_secuencia_xg(df, col_xg,col_tiro):
     """
-    Para cada fila del DataFrame, asigna en 'col_xg_secuencia' el xG de la primera acción de tiro siguiente 
-    (type_value en [13,14,15,16]) en el mismo partido y periodo, y con tiempo posterior.
-    
+    Para cada fila con `col_tiro` == 1, asigna en `col_xg` el xG de la primera acción de tiro
+    siguiente (type_value en [13,14,15,16]) en el mismo partido y periodo, y con tiempo posterior.
+
     Args:
-        df: DataFrame de entrada
-        col_xg: columna que contiene xG
-        tipo_tiro_col: columna que indica tipo de acción
-        tiros: lista de valores que definen un tiro
-        
+        df: DataFrame de entrada o SecuenciaContext ya construido
+        col_xg: columna a calcular
+        col_tiro: columna de la acción previa al tiro
+
     Returns:
-        df con nueva columna 'col_xg_secuencia'
-    """
-    
-    df = df.sort_values(by=['matchId','period_value','time_seconds'],ascending=True).reset_index(drop=True)
-    df[col_xg] = np.nan
-    
-    # Índices de todas las acciones de tiro
-    indices_pretiros = df.index[df[col_tiro]==1].to_list()
-    indices_tiros = df.index[df["type_value"].isin([13,14,15,16])].to_list()
-    
-
-
-    
-    for i in indices_pretiros:
-        candidatos = [p for p in indices_tiros if p > i]
-        if len(candidatos)>0:
-            
-            siguiente_idx = min(candidatos)
-                    # Comprobamos mismo match, mismo periodo y tiempo mayor o igual
-            if (df.at[siguiente_idx, 'matchId'] == df.at[i, 'matchId'] and
-                        df.at[siguiente_idx, 'period_value'] == df.at[i, 'period_value'] and
-                        df.at[siguiente_idx, 'time_seconds'] >= df.at[i, 'time_seconds']):
-                        df.at[i, col_xg] = df.at[siguiente_idx, "xG"]
-    
-    return df
-    
+        df ordenado con la nueva columna `col_xg`
+    """
+    ctx = build_secuencia_context(df)
+    return _asigna_columnas(ctx.df, {col_xg: _secuencia_xg(ctx, col_tiro)})
+
+
 def calcula_secuencia_shotproc(df, col_sec,col_tiro):
     """
-    Para cada fila del DataFrame, asigna en 'col_xg_secuencia' el xG de la primera acción de tiro siguiente 
-    (type_value en [13,14,15,16]) en el mismo partido y periodo, y con tiempo posterior.
-    
+    Para cada tiro de `col_shots`, marca en `col_sec` si la acción ABP previa más cercana
+    (mismo partido y periodo, tiempo anterior o igual) es una acción de `col_tiro`.
+
     Args:
-        df: DataFrame de entrada
-        col_xg: columna que contiene xG
-        tipo_tiro_col: columna que indica tipo de acción
-        tiros: lista de valores que definen un tiro
-        
+        df: DataFrame de entrada o SecuenciaContext ya construido
+        col_sec: columna a calcular
+        col_tiro: columna de la acción ABP de origen
+
     Returns:
-        df con nueva columna 'col_xg_secuencia'
+        df ordenado con la nueva columna `col_sec`
     """
-    col_shots = col_sec.replace("_left_","_").replace("_right_","_").replace("_short_","_").replace("_long_","_").replace("__","_")
-    col_abp = col_tiro.split("_")[0]+ "_" + col_tiro.split("_")[-1]
-    df = df.sort_values(by=['matchId','period_value','time_seconds'],ascending=True).reset_index(drop=True)
-    
-        
-    # Índices de todas las acciones de tiro
-    indices_pretiros = df.index[df[col_abp]==1].to_list()
-    indices_tiros = df.index[df[col_shots] ==1].to_list()
-        
-    
-        
-    # Inicializamos la columna
-    df[col_sec] = np.nan
-        
-    for i in indices_tiros:
-        candidatos = [p for p in indices_pretiros if p < i]
-        if len(candidatos)>0:
-            siguiente_idx = max(candidatos)
-            if (df.at[siguiente_idx, 'matchId'] == df.at[i, 'matchId'] and
-                df.at[siguiente_idx, 'period_value'] == df.at[i, 'period_value'] and
-                df.at[siguiente_idx, 'time_seconds'] <= df.at[i, 'time_seconds'] and
-                df.at[siguiente_idx, col_tiro] == 1):
-                             
-                    df.at[i, col_sec] = df.at[i, col_shots]
-    
-    return df
+    return calcula_secuencia_shotproc_batch(df, {col_sec: col_tiro})
+
+
+def calcula_secuencia_shotproc_batch(df, medidas):
+    """
+    Calcula de una vez todas las medidas `secuencia_shotproc` de `medidas` ({col_sec: col_tiro}).
 
+    Hace un as-of hacia atrás por cada columna ABP de origen distinta (`col_abp`: para cada
+    fila, la acción ABP anterior más cercana) y rellena todas las columnas destino que
+    comparten ese origen con asignaciones vectorizadas.
+    """
+    ctx = build_secuencia_context(df)
+    return _asigna_columnas(ctx.df, _secuencia_shotproc(ctx, medidas))
 
 
 def calcula_secuencia_contacts(df, col_tiro):
     """
-    Para cada fila del DataFrame, asigna en 'col_xg_secuencia' el xG de la primera acción de tiro siguiente 
-    (type_value en [13,14,15,16]) en el mismo partido y periodo, y con tiempo posterior.
-    
+    Para cada entrega ABP con éxito (`col_tiro` == 1), localiza el primer contacto de su receptor
+    (`pase_receptor_id`) en el mismo partido y periodo, con tiempo igual o posterior, y marca en
+    esa fila las columnas actions_contacts_*_<abp> (cabezazo, éxito, pérdida en juego, fuera
+    y pase clave).
+
     Args:
-        df: DataFrame de entrada
-        col_xg: columna que contiene xG
-        tipo_tiro_col: columna que indica tipo de acción
-        tiros: lista de valores que definen un tiro
-        
+        df: DataFrame de entrada o SecuenciaContext ya construido
+        col_tiro: columna de la entrega ABP de origen
+
     Returns:
-        df con nueva columna 'col_xg_secuencia'
-    """
-
-    df = df.sort_values(by=['matchId','period_value','time_seconds'],ascending=True).reset_index(drop=True)
-    
-        
-    indices_tiros = df.index[df[col_tiro] ==1].to_list()
-    col_abp = col_tiro.split("_")[-1]    
-    df["actions_contacts_{}".format(col_abp)] = np.nan
-    df["actions_contacts_header_{}".format(col_abp)] = np.nan
-    df["actions_contacts_header_succ_{}".format(col_abp)] = np.nan
-    df["actions_contacts_header_lostinplay_{}".format(col_abp)] = np.nan
-    df["actions_contacts_header_lostout_{}".format(col_abp)] = np.nan
-    df["actions_contacts_header_kp_{}".format(col_abp)] = np.nan
-    df["actions_contacts_succ_{}".format(col_abp)] = np.nan
-    df["actions_contacts_lostinplay_{}".format(col_abp)] = np.nan
-    df["actions_contacts_lostout_{}".format(col_abp)] = np.nan
-    df["actions_contacts_kp_{}".format(col_abp)] = np.nan
-        
-    for i in indices_tiros:
-        df_i = df[(df.playerId==df[df.index==i].pase_receptor_id.values[0]) & (df.time_seconds>=df[df.index==i].time_seconds.values[0]) & (df.matchId==df[df.index==i].matchId.values[0]) & (df.period_value==df[df.index==i].period_value.values[0])].head(1)
-        if df_i.shape[0]>0:
-            qualifier = df_i.qualifiers.astype(str).values[0]
-            idx = df_i.index[0]
-            
-            df.at[idx, "actions_contacts_{}".format(col_abp)] = 1
-            
-            if "'qualifierId': 15}" in qualifier or "'qualifierId': 15." in qualifier:
-                df.at[idx, "actions_contacts_header_{}".format(col_abp)] = 1
-                if df_i.outcomeType_value.values[0]==1:
-                    df.at[idx, "actions_contacts_header_succ_{}".format(col_abp)] = 1
-                if df_i.outcomeType_value.values[0]==0:
-                    df.at[idx, "actions_contacts_header_lostinplay_{}".format(col_abp)] = 1
-                if "'qualifierId': 167}" in qualifier or "'qualifierId': 167." in qualifier:
-                    df.at[idx, "actions_contacts_header_lostout_{}".format(col_abp)] = 1
-                if df_i.outcomeType_value.values[0]==1 and ( "'qualifierId': 210}" in qualifier or "'qualifierId': 210." in qualifier):
-                    df.at[idx, "actions_contacts_header_kp_{}".format(col_abp)] = 1
-            else:
-                if df_i.outcomeType_value.values[0]==1:
-                    df.at[idx, "actions_contacts_succ_{}".format(col_abp)] = 1
-                if df_i.outcomeType_value.values[0]==0:
-                    df.at[idx, "actions_contacts_lostinplay_{}".format(col_abp)] = 1
-                if "'qualifierId': 167}" in qualifier or "'qualifierId': 167." in qualifier:
-                    df.at[idx, "actions_contacts_lostout_{}".format(col_abp)] = 1
-                if df_i.outcomeType_value.values[0]==1 and ( "'qualifierId': 210}" in qualifier or "'qualifierId': 210." in qualifier):
-                    df.at[idx, "actions_contacts_kp_{}".format(col_abp)] = 1
-        
-    return df
-    
+        df ordenado con las columnas actions_contacts_*_<abp>
+    """
+    ctx = build_secuencia_context(df)
+    return _asigna_columnas(ctx.df, _secuencia_contacts(ctx, col_tiro))
+
 
 def calcula_medidas_secuencia(df,medidas):
+    """
+    Calcula todas las medidas de `medidas` (series_config_secuencia) sobre un mismo
+    SecuenciaContext: se ordena una vez y las columnas nuevas se añaden en un único concat,
+    en el mismo orden en que las crearía el cálculo medida a medida.
+    """
+    ctx = build_secuencia_context(df)
+    shotproc = {m: medidas[m]['columna_origen'] for m in medidas
+                if medidas[m]['funcion_calculo'] == "secuencia_shotproc"}
+    nuevas = {}
+    contacts_hechos = set()
     for medida in medidas:
         func=medidas[medida]['funcion_calculo']
         origen = medidas[medida]['columna_origen']
         if func=="secuencia_xg":
-            df=calcula_secuencia_xg(df,medida,origen)
-        if func=="secuencia_shotproc":
-            df=calcula_secuencia_shotproc(df,medida,origen)
-        if func=="secuencia_contacts":
-            df=calcula_secuencia_contacts(df, origen)
-        
-    return df
\ No newline at end of file
+            nuevas[medida] = _secuencia_xg(ctx, origen)
+        # Las shotproc no dependen de otras medidas de secuencia: todas juntas en la primera
+        if func=="secuencia_shotproc" and shotproc:
+            nuevas.update(_secuencia_shotproc(ctx, shotproc))
+            shotproc = {}
+        # Las contacts de un mismo origen comparten cálculo: una sola pasada por origen
+        if func=="secuencia_contacts" and origen not in contacts_hechos:
+            nuevas.update(_secuencia_contacts(ctx, origen))
+            contacts_hechos.add(origen)
+
+    return _asigna_columnas(ctx.df, nuevas)
+
+
+
+# ---------------------------------------------------------------------
+# Tabla de episodios ABP (una fila por acción a balón parado)
+# ---------------------------------------------------------------------
+# Columna de la serie que marca la entrega de cada tipo de ABP, su éxito y su lado.
+# En las faltas directas la propia entrega es el tiro.
+SET_PIECE_KINDS = {
+    "corner": {"col": "actions_fromcorner", "succ": "actions_succ_fromcorner",
+               "left": "actions_left_fromcorner", "right": "actions_right_fromcorner"},
+    "ifk": {"col": "actions_fromifkbox", "succ": "actions_succ_fromifkbox",
+            "left": "actions_left_fromifkbox", "right": "actions_right_fromifkbox"},
+    "throwin": {"col": "actions_fromthrowinbox", "succ": "actions_succ_fromthrowinbox",
+                "left": "actions_left_fromthrowinbox", "right": "actions_right_fromthrowinbox"},
+    "dfk": {"col": "shots_fromdfk", "succ": "shots_succ_fromdfk",
+            "left": "shots_left_fromdfk", "right": "shots_right_fromdfk", "direct": True},
+}
+
+EPISODE_COLS = ["matchId", "period_value", "time_seconds", "id", "teamName", "oppositionTeamName",
+                "playerId", "playerName", "pase_receptor_id", "x", "y", "endX", "endY",
+                "tercio_id_end", "carril_id_end"]
+EPISODE_LINK_COLS = ["kind", "side", "succ", "contact_id", "contact_playerId", "contact_header",
+                     "contact_outcome", "shot_id", "shot_playerId", "shot_xG", "goal"]
+
+# Niveles de episode_metrics que guarda el pipeline (df_episodes_<nivel>)
+EPISODE_LEVELS = {
+    "team": ["teamName", "kind"],
+    "opposition": ["oppositionTeamName", "kind"],
+    "player": ["playerId", "playerName", "teamName", "kind"],
+}
+
+
+def _enlace(pos, pre, destino):
+    """Devuelve, alineado con `pos`, la posición enlazada (o -1) a partir de pares (pre, destino)."""
+    out = np.full(len(pos), -1, dtype=np.int64)
+    out[np.searchsorted(pos, pre)] = destino
+    return out
+
+
+def build_set_piece_episodes(df, kinds=None):
+    """
+    Construye la tabla de episodios ABP en una pasada vectorizada: una fila por entrega
+    (córner, falta indirecta al área, saque de banda al área, falta directa) con su primer
+    contacto del receptor, el primer tiro posterior, su xG y su resultado.
+
+    Args:
+        df: eventos con las columnas de series_config_abp (o un SecuenciaContext, p.ej. el de
+            calcula_medidas_secuencia del mismo partido). Debe conservar los NaN originales
+            (antes del fillna(0) del pipeline).
+        kinds: especificación de tipos de ABP; por defecto SET_PIECE_KINDS.
+
+    Returns:
+        DataFrame con EPISODE_COLS de la entrega y EPISODE_LINK_COLS.
+    """
+    ctx = build_secuencia_context(df)
+    d = ctx.df
+    kinds = SET_PIECE_KINDS if kinds is None else kinds
+
+    header = has_qualifier(d, 15)
+    ids = d["id"].to_numpy()
+    players = d["playerId"].to_numpy()
+    outcome = d["outcomeType_value"].to_numpy()
+    xg = d["xG"].to_numpy(dtype=np.float64)
+    type_value = d["type_value"].to_numpy()
+    cols = [c for c in EPISODE_COLS if c in d.columns]
+
+    frames = []
+    for kind, spec in kinds.items():
+        if spec["col"] not in d.columns:
+            continue
+        pos = np.flatnonzero(_mask(ctx, spec["col"]))
+        contacto = _enlace(pos, *_first_contact(ctx, pos))
+        tiro = pos if spec.get("direct") else _enlace(pos, *_link_next_shot(ctx, pos))
+        con_contacto, con_tiro = contacto >= 0, tiro >= 0
+
+        ep = d[cols].iloc[pos].reset_index(drop=True)
+        ep["kind"] = kind
+        side = np.full(len(pos), None, dtype=object)
+        for lado in ("left", "right"):
+            if spec.get(lado) in d.columns:
+                side[_mask(ctx, spec[lado])[pos]] = lado
+        ep["side"] = side
+        ep["succ"] = _mask(ctx, spec["succ"])[pos] if spec.get("succ") in d.columns else False
+        ep["contact_id"] = np.where(con_contacto, ids[contacto], np.nan)
+        ep["contact_playerId"] = np.where(con_contacto, players[contacto], np.nan)
+        ep["contact_header"] = con_contacto & header[contacto]
+        ep["contact_outcome"] = np.where(con_contacto, outcome[contacto], np.nan)
+        ep["shot_id"] = np.where(con_tiro, ids[tiro], np.nan)
+        ep["shot_playerId"] = np.where(con_tiro, players[tiro], np.nan)
+        ep["shot_xG"] = np.where(con_tiro, xg[tiro], np.nan)
+        ep["goal"] = con_tiro & (type_value[tiro] == 16)
+        frames.append(ep)
+
+    if not frames:
+        return pd.DataFrame(columns=cols + EPISODE_LINK_COLS)
+    return pd.concat(frames, ignore_index=True)
+
+
+def episode_metrics(episodes, by):
+    """
+    Métricas ABP agregadas sobre la tabla de episodios: p. ej. by=["teamName", "kind"] (equipo),
+    ["oppositionTeamName", "kind"] (concedidas) o ["playerId", "playerName", "kind"] (lanzador).
+    """
+    e = pd.DataFrame({
+        "episodes": 1,
+        "succ": episodes["succ"].astype(bool),
+        "contacts": episodes["contact_id"].notna(),
+        "contacts_header": episodes["contact_header"].astype(bool),
+        "shots": episodes["shot_id"].notna(),
+        "goals": episodes["goal"].astype(bool),
+        "xg": episodes["shot_xG"].astype(np.float64).fillna(0),
+    }, index=episodes.index)
+    by = [by] if isinstance(by, str) else list(by)
+    return pd.concat([episodes[by], e], axis=1).groupby(by, as_index=False, observed=True).sum()
@@ -0,0 +1,181 @@
+# app/services/match_executor.py
+# -*- coding: utf-8 -*-
+
+"""
+Ejecución paralela de trabajo independiente por partido.
+
+El cálculo de secuencias de un partido no depende de ningún otro, así que se reparte entre
+procesos con un ProcessPoolExecutor. El orden de los resultados es siempre el de entrada
+(executor.map), con independencia de qué proceso termine antes.
+
+El pool se crea la primera vez y se reutiliza en las siguientes construcciones del mismo proceso
+(arrancar procesos e importar pandas en cada uno cuesta más que muchos partidos). Dentro de
+Streamlit no se usan procesos: en Windows/macOS los hijos se arrancan con spawn y reimportan el
+script principal, que bajo `streamlit run` no tiene guarda `if __name__ == "__main__"`, y en
+Linux hacer fork de un servidor con hilos puede dejar locks tomados en el hijo. Ahí se usa un
+pool de hilos.
+
+Configuración (variables de entorno, como en app/config.py):
+  - ABP_WORKERS    nº de procesos/hilos (por defecto os.cpu_count(); 1 = en serie, sin pool)
+  - ABP_CHUNKSIZE  partidos por tarea enviada a cada proceso (por defecto se reparte en ~4 tandas por proceso)
+  - ABP_EXECUTOR   "process", "thread" o "serial" (por defecto "process", o "thread" dentro de Streamlit)
+"""
+
+from __future__ import annotations
+
+import atexit
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Iterable
+
+import pandas as pd
+
+import app.fun_calculo_metricas as cm
+from app.services.match_store import MatchStore
+
+EXECUTORS = ("process", "thread", "serial")
+
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def default_workers() -> int:
+    return max(1, int(os.getenv("ABP_WORKERS", os.cpu_count() or 1)))
+
+
+def running_in_streamlit() -> bool:
+    """True si el proceso es un servidor de Streamlit (no basta con tener streamlit importado)."""
+    if "streamlit" not in sys.modules:
+        return False
+    try:
+        from streamlit import runtime
+    except ImportError:
+        return False
+    return runtime.exists()
+
+
+def default_executor() -> str:
+    env = os.getenv("ABP_EXECUTOR")
+    if env:
+        if env not in EXECUTORS:
+            raise ValueError(f"ABP_EXECUTOR debe ser uno de {EXECUTORS}: {env!r}")
+        return env
+    return "thread" if running_in_streamlit() else "process"
+
+
+def _pool(kind: str, workers: int):
+    """Pool compartido del proceso para (kind, workers); se crea la primera vez."""
+    with _POOLS_LOCK:
+        ex = _POOLS.get((kind, workers))
+        if ex is None:
+            cls = ProcessPoolExecutor if kind == "process" else ThreadPoolExecutor
+            ex = _POOLS[(kind, workers)] = cls(max_workers=workers)
+        return ex
+
+
+def _descarta(kind: str, workers: int) -> None:
+    with _POOLS_LOCK:
+        ex = _POOLS.pop((kind, workers), None)
+    if ex is not None:
+        ex.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_executors() -> None:
+    """Cierra los pools compartidos (al salir del proceso, o tras cambiar ABP_WORKERS)."""
+    with _POOLS_LOCK:
+        pools = list(_POOLS.values())
+        _POOLS.clear()
+    for ex in pools:
+        ex.shutdown(wait=True)
+
+
+atexit.register(shutdown_executors)
+
+
+def default_chunksize(n_items: int, workers: int) -> int:
+    env = os.getenv("ABP_CHUNKSIZE")
+    if env:
+        return max(1, int(env))
+    return max(1, n_items // (workers * 4))
+
+
+def map_ordered(
+    fn: Callable,
+    items: Iterable,
+    workers: int | None = None,
+    chunksize: int | None = None,
+    executor: str | None = None,
+) -> list:
+    """
+    Aplica `fn` a cada elemento de `items` y devuelve los resultados en el mismo orden.
+    `fn` debe ser una función de módulo (picklable) si se usan procesos. Con 1 worker, 1 elemento
+    o executor="serial" no se usa pool; si no, el pool compartido de `executor` (default_executor()).
+    """
+    items = list(items)
+    executor = default_executor() if executor is None else executor
+    if executor not in EXECUTORS:
+        raise ValueError(f"executor debe ser uno de {EXECUTORS}: {executor!r}")
+    # El pool se dimensiona con los workers pedidos (no recortados a len(items)) para reutilizarlo
+    pool_workers = default_workers() if workers is None else max(1, int(workers))
+    workers = min(pool_workers, len(items)) if items else 1
+    if workers <= 1 or executor == "serial":
+        return [fn(it) for it in items]
+    if executor == "thread":
+        return list(_pool("thread", pool_workers).map(fn, items))
+    if chunksize is None:
+        chunksize = default_chunksize(len(items), workers)
+    try:
+        return list(_pool("process", pool_workers).map(fn, items, chunksize=chunksize))
+    except BrokenProcessPool:
+        # Un hijo murió (p.ej. sin memoria): la próxima llamada arranca un pool nuevo
+        _descarta("process", pool_workers)
+        raise
+
+
+def _secuencias_partido(args: tuple) -> object:
+    match_id, dfg, series_config, store, episodes = args
+    # Un único contexto (orden y enlaces del partido) para la tabla de episodios y las secuencias
+    ctx = cm.build_secuencia_context(dfg)
+    if episodes is not None:
+        episodes.put(match_id, cm.build_set_piece_episodes(ctx))
+    dfg = cm.calcula_medidas_secuencia(ctx, series_config)
+    if store is None:
+        return dfg
+    # El proceso hijo escribe directamente en el almacén: no se devuelve el DataFrame al padre
+    store.put(match_id, dfg)
+    return match_id
+
+
+def calcula_secuencias_por_partido(
+    dft: pd.DataFrame,
+    series_config: dict,
+    match_ids: list | None = None,
+    store: MatchStore | None = None,
+    episodes: MatchStore | None = None,
+    workers: int | None = None,
+    chunksize: int | None = None,
+) -> pd.DataFrame | None:
+    """
+    calcula_medidas_secuencia partido a partido, en paralelo.
+
+    - series_config: medidas de series_config_secuencia ({medida: {funcion_calculo, columna_origen}}).
+    - match_ids: orden de salida (por defecto, orden de aparición en dft).
+    - store: si se indica, cada partido se guarda en el almacén y se devuelve None;
+      si no, se devuelve un único concat con los partidos en el orden de match_ids.
+    - episodes: si se indica, la tabla de episodios ABP de cada partido
+      (cm.build_set_piece_episodes) se guarda en este almacén.
+    """
+    grupos = {m: g for m, g in dft.groupby("matchId", sort=False)}
+    if match_ids is None:
+        match_ids = list(grupos)
+    tareas = [(m, grupos[m], series_config, store, episodes) for m in match_ids if m in grupos]
+
+    res = map_ordered(_secuencias_partido, tareas, workers=workers, chunksize=chunksize)
+    if store is not None:
+        return None
+    if not res:
+        return dft.iloc[0:0].copy()
+    return pd.concat(res, ignore_index=True)
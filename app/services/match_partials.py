@@ -0,0 +1,175 @@
+# app/services/match_partials.py
+# -*- coding: utf-8 -*-
+
+"""
+Agregados parciales por partido.
+
+df_agr, df_agr_agg, df_agr_pair y df_jug_team son sumas sobre los partidos del scope, así que se
+guardan las sumas de cada partido por (matchId, teamName, oppositionTeamName) y por
+(matchId, playerId, playerName, teamName). Cualquier ventana (otro lastn, otra selección de
+partidos) se resuelve sumando los parciales de sus partidos y recalculando después las medidas
+compuestas, sin volver a agregar los eventos.
+
+Los parciales de cada nivel se guardan en un MatchStore (un pickle por partido). Tanto los
+parciales como los agregados de la ventana se resuelven con aggregate_sets, con el motor de la
+construcción (pandas, polars o una consulta GROUPING SETS de DuckDB).
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import app.utils_bbdd as ub
+from app.backend_duckdb import rollups as duckdb_rollups
+from app.backend_polars import group_agg as group_agg_polars
+from app.services.match_store import MatchStore
+
+# Nivel del parcial -> columnas de agrupación (con matchId) y funciones distintas de la suma
+PARTIAL_SETS = {
+    "team": ["matchId", "teamName", "oppositionTeamName"],
+    "player": ["matchId", "playerId", "playerName", "teamName"],
+}
+PARTIAL_EXTRA = {"team": {"localDate": "min"}}
+
+# Agregado de la ventana -> (nivel del parcial, columnas de agrupación, funciones distintas de la suma)
+WINDOW_SETS = {
+    "df_agr": ("team", ["teamName"], {}),
+    "df_agr_agg": ("team", ["oppositionTeamName"], {}),
+    "df_agr_pair": ("team", ["teamName", "oppositionTeamName"], {"localDate": "min"}),
+    "df_jug_team": ("player", ["playerId", "playerName"], {}),
+}
+
+
+def _agrupa(df: pd.DataFrame, by: list, cols: list, engine: str, agg: dict | None = None) -> pd.DataFrame:
+    """groupby(by) con `agg` ({col: función}) delante y el resto de `cols` sumadas."""
+    if engine == "polars":
+        return group_agg_polars(df, by, cols, agg)
+    agg = agg or {}
+    g = df.groupby(by, observed=True)
+    # Un solo sum para todas las columnas (un agg por columna es mucho más lento) y `agg` delante
+    out = g[[c for c in cols if c not in agg]].sum()
+    if agg:
+        out = pd.concat([g.agg(agg), out], axis=1)
+    return out.reset_index()
+
+
+def aggregate_sets(df: pd.DataFrame, cols: list, engine: str, sets: dict, extra: dict | None = None) -> dict:
+    """
+    Suma de `cols` por cada conjunto de `sets` ({nombre: columnas}), con `extra`
+    ({nombre: {col: función}}) delante. Con engine="duckdb", todos los conjuntos en una sola
+    consulta GROUPING SETS.
+    """
+    extra = extra or {}
+    if engine == "duckdb":
+        return duckdb_rollups(df, cols, sets=sets, extra=extra)
+    return {name: _agrupa(df, by, cols, engine, agg=extra.get(name)) for name, by in sets.items()}
+
+
+def build_partials(df: pd.DataFrame, cols: list, engine: str = "pandas") -> dict:
+    """
+    {matchId: {nivel: parcial}} de todos los partidos de `df` en una sola agregación por nivel
+    (las claves de PARTIAL_SETS ya llevan matchId).
+
+    `df` debe traer las medidas con los tipos del cálculo, sin compactar: las decimales se suman
+    en float64 (sumar el float32 de df.csv cambiaría los totales de xG). Las decimales que en un
+    partido solo valen 0/1 quedan como enteros en su parcial, como si el partido se hubiera
+    compactado por separado: el parcial no depende de la ventana en que se calculó.
+    """
+    floats = [c for c in cols if df[c].dtype.kind == "f"]
+    if floats:
+        df = df.astype(dict.fromkeys(floats, np.float64))
+    indicadores = ((df[floats] == 0) | (df[floats] == 1)).groupby(df["matchId"], observed=True).all()
+    aggs = aggregate_sets(df, cols, engine, PARTIAL_SETS, PARTIAL_EXTRA)
+    grupos = {level: dict(list(a.groupby("matchId", sort=False))) for level, a in aggs.items()}
+
+    out = {}
+    for m in df["matchId"].dropna().unique():
+        enteros = indicadores.columns[indicadores.loc[m].to_numpy()].tolist() if floats else []
+        out[m] = {}
+        for level, a in aggs.items():
+            p = grupos[level][m].reset_index(drop=True) if m in grupos[level] else a.iloc[0:0]
+            out[m][level] = p.astype(dict.fromkeys(enteros, np.int64)) if enteros else p
+    return out
+
+
+class PartialStore:
+    """Parciales por partido de cada nivel de PARTIAL_SETS en `root/<nivel>/<fingerprint>/<matchId>.pkl`."""
+
+    def __init__(self, root: str | Path, fingerprint: str):
+        self.levels = {level: MatchStore(Path(root) / level, fingerprint) for level in PARTIAL_SETS}
+
+    def prune(self) -> list:
+        """Borra los parciales de otras huellas en todos los niveles (ver MatchStore.prune)."""
+        return [d for s in self.levels.values() for d in s.prune()]
+
+    def missing(self, match_ids) -> list:
+        """matchIds (en el orden recibido) a los que les falta algún nivel."""
+        return [m for m in match_ids if not all(s.has(m) for s in self.levels.values())]
+
+    def put(self, match_id, partials: dict) -> None:
+        for level, df in partials.items():
+            self.levels[level].put(match_id, df)
+
+    def load(self, match_ids) -> dict[str, pd.DataFrame]:
+        """{nivel: parciales de `match_ids`}. Lanza KeyError si falta alguno."""
+        falta = self.missing(match_ids)
+        if falta:
+            raise KeyError(f"Partidos sin agregados parciales: {falta}")
+        return {level: concat_partials([s.get(m) for m in match_ids]) for level, s in self.levels.items()}
+
+
+def concat_partials(frames: list) -> pd.DataFrame:
+    """
+    Concatena parciales de varios partidos con los tipos que tendría el agregado del df completo:
+      - una suma es decimal si lo es en algún partido, con su mismo float (no float64 por mezclar
+        int64 y float32);
+      - las claves de texto vuelven a categórica con las categorías de restore_event_categories +
+        fillna_zero (texto ordenado y el 0 al final), que fijan el orden de los groupby.
+    """
+    if not frames:
+        return pd.DataFrame()
+    floats = {}
+    for f in frames:
+        for c, t in f.dtypes.items():
+            if t.kind == "f":
+                floats[c] = np.result_type(floats.get(c, t), t)
+    df = pd.concat(frames, ignore_index=True)
+
+    categorias = {}
+    for c in ub.EVENT_CATEGORICAL:
+        if c in df.columns and (df[c].dtype == object or isinstance(df[c].dtype, pd.CategoricalDtype)):
+            valores = set(df[c].dropna().astype(object).unique().tolist())
+            categorias[c] = (valores - {0}, 0 in valores)
+
+    # Columna a columna: astype({...}) partiría el DataFrame en un bloque por columna y los
+    # groupby posteriores irían columna a columna
+    for c, t in {**floats, **ub.event_category_dtypes(categorias)}.items():
+        if df[c].dtype != t:
+            df[c] = df[c].astype(t)
+    return df
+
+
+def window_aggregates(partials: dict[str, pd.DataFrame], engine: str = "pandas") -> dict[str, pd.DataFrame]:
+    """
+    df_agr, df_agr_agg, df_agr_pair y df_jug_team (sin medidas compuestas) sumando los parciales
+    de los partidos de la ventana (PartialStore.load): una llamada a aggregate_sets por nivel.
+    """
+    res = {}
+    for level, p in partials.items():
+        sets = {name: by for name, (lv, by, _) in WINDOW_SETS.items() if lv == level}
+        if not sets:
+            continue
+        extra = {name: WINDOW_SETS[name][2] for name in sets if WINDOW_SETS[name][2]}
+        fuera = set(PARTIAL_SETS[level]) | set(PARTIAL_EXTRA.get(level, {}))
+        cols = [c for c in p.columns if c not in fuera]
+        res.update(aggregate_sets(p, cols, engine, sets, extra))
+    return {name: res[name] for name in WINDOW_SETS}
+
+
+def rival_players(partials: dict[str, pd.DataFrame], rival: str) -> list:
+    """playerId con eventos del rival en los partidos de la ventana (filtro de df_jug_team)."""
+    p = partials["player"]
+    return p.loc[p["teamName"] == rival, "playerId"].dropna().unique().tolist()
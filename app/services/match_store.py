@@ -0,0 +1,110 @@
+# app/services/match_store.py
+# -*- coding: utf-8 -*-
+
+"""
+Almacén persistente de resultados por partido.
+
+Tras transform_events_agg + calcula_medidas_secuencia, el DataFrame de un partido solo depende
+de sus eventos y de los series_config (no del equipo, el rival ni lastn). Se guarda un pickle
+por matchId dentro de una carpeta identificada por la huella de todo lo que da forma a lo
+guardado (configs, columnas de query_scope.txt, esquema de tipos...), de modo que cualquier
+cambio en ello invalida el almacén entero.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Subir si cambia la lógica de cálculo por partido o el formato de lo guardado (columnas, tipos,
+# texto de qualifiers...): invalida los resultados guardados
+MATCH_STORE_VERSION = "2"
+
+
+def config_fingerprint(*paths: str | Path, schema=None) -> str:
+    """
+    Huella (md5 corto) del contenido de los ficheros de configuración, de la versión del cálculo
+    y de `schema` (cualquier estructura serializable en JSON que dé forma a lo guardado, p.ej. el
+    esquema de tipos de los eventos).
+    """
+    h = hashlib.md5(MATCH_STORE_VERSION.encode("utf-8"))
+    for p in paths:
+        h.update(Path(p).read_bytes())
+    if schema is not None:
+        h.update(json.dumps(schema, sort_keys=True, default=str).encode("utf-8"))
+    return h.hexdigest()[:12]
+
+
+def match_key(m) -> str:
+    """Clave de un matchId: 123, 123.0, np.int64(123), "123" y "123.0" son el mismo partido."""
+    if isinstance(m, str):
+        entero = re.fullmatch(r"\s*(-?\d+)(?:\.0*)?\s*", m)
+        return str(int(entero.group(1))) if entero else m.strip()
+    if isinstance(m, (float, np.floating)) and float(m).is_integer():
+        m = int(m)
+    return str(m)
+
+
+# Carpetas de huella: config_fingerprint da 12 caracteres hexadecimales
+_FINGERPRINT_RE = re.compile(r"[0-9a-f]{12}")
+
+
+class MatchStore:
+    """
+    Resultados por partido guardados en `root/<fingerprint>/<matchId>.pkl`: normalmente
+    DataFrames, aunque `put`/`get` aceptan cualquier objeto picklable.
+    """
+
+    def __init__(self, root: str | Path, fingerprint: str):
+        self.dir = Path(root) / fingerprint
+        self.dir.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, match_id) -> Path:
+        return self.dir / f"{re.sub(r'[^A-Za-z0-9_.-]+', '_', match_key(match_id))}.pkl"
+
+    def prune(self) -> list:
+        """
+        Borra las carpetas de otras huellas bajo la misma raíz (resultados que ya nunca se van a
+        leer: cambió alguna config, el esquema o MATCH_STORE_VERSION). Devuelve las borradas.
+        """
+        borradas = []
+        for d in self.dir.parent.iterdir():
+            if d != self.dir and d.is_dir() and _FINGERPRINT_RE.fullmatch(d.name):
+                shutil.rmtree(d, ignore_errors=True)
+                borradas.append(d)
+        return borradas
+
+    def has(self, match_id) -> bool:
+        return self._path(match_id).exists()
+
+    def missing(self, match_ids) -> list:
+        """matchIds (en el orden recibido) que aún no están en el almacén."""
+        return [m for m in match_ids if not self.has(m)]
+
+    def get(self, match_id):
+        p = self._path(match_id)
+        if not p.exists():
+            return None
+        return pd.read_pickle(p)
+
+    def put(self, match_id, obj) -> None:
+        # Escritura atómica: otro proceso nunca ve un pickle a medias
+        p = self._path(match_id)
+        tmp = p.with_suffix(f".{os.getpid()}.tmp")
+        pd.to_pickle(obj, tmp)
+        os.replace(tmp, p)
+
+    def load(self, match_ids) -> pd.DataFrame:
+        """Concatena (en el orden recibido) los resultados guardados de `match_ids`."""
+        frames = [self.get(m) for m in match_ids]
+        frames = [f for f in frames if f is not None]
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, ignore_index=True)
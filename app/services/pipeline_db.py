@@ -8,11 +8,13 @@ data/df_jug_team.csv, data/df_players.csv).
 
 Depende de:
 - app/utils_bbdd.py  (get_conn, clean_df)
+- app/db.py  (register_statement: sentencias con parámetros)
 - app/fun_calculo_metricas.py  (transform_events_agg, calcula_medidas_secuencia, calcula_medidas_compuestas)
 - app/config/config.json
 - app/config/query_scope.txt
 - app/config/series_config_abp.json
 - app/config/series_config_secuencia.json
+- app/config/medidas_compuestas.json
 - Tablas: dim_team, dim_player, dim_position, dim_competition, dim_competition_season, fact_team_stats,
           dim_formation, sw_match_data, sw_player_data, fact_player_season
 """
@@ -20,16 +22,31 @@ Depende de:
 from __future__ import annotations
 
 import os
+import re
 import json
+import logging
+import shutil
+import hashlib
+import time
 import numpy as np
 import pandas as pd
+from collections import OrderedDict
 from datetime import datetime
 
 from app.utils_bbdd import get_conn, clean_df as ub_clean
+from app.db import register_statement
+import app.utils_bbdd as ub
 import app.fun_calculo_metricas as cm
+from app.services.match_store import MatchStore, config_fingerprint, match_key as _match_key
+from app.services.match_executor import calcula_secuencias_por_partido
+import app.services.match_partials as mp
+from app.backend_polars import require_polars
+from app.backend_duckdb import require_duckdb
 import streamlit as st
 from sqlalchemy.engine import Engine
 
+logger = logging.getLogger(__name__)
+
 # ---------------------------------------------------------------------
 # Utilidades equivalentes a las del notebook
 # ---------------------------------------------------------------------
@@ -55,90 +72,231 @@ def get_query(ruta: str = "app/config/query_scope.txt") -> str:
     return query
 
 
+def scope_params(team, local, visitante, season, competition, lastn) -> dict:
+    """Parámetros (:team, :home, :away, :season, :competition, :lastn) de query_scope.txt."""
+    return {
+        "team": team, "home": local, "away": visitante,
+        "season": season, "competition": competition, "lastn": int(lastn),
+    }
+
+
 # ---------------------------------------------------------------------
 # Funciones de acceso a BBDD (equivalentes a las del notebook)
 # ---------------------------------------------------------------------
+# Sentencias con parámetros: el SQL es siempre el mismo y solo cambian los valores
+SQL_LOOPER = register_statement("looper", "select distinct season, competition from dim_team")
+SQL_DIM_COMPETITION_SEASON = register_statement(
+    "dim_competition_season", "select distinct * from dim_competition_season"
+)
+SQL_DIM_COMPETITION = register_statement("dim_competition", "select distinct * from dim_competition")
+SQL_DIM_TEAM = register_statement(
+    "dim_team",
+    """select distinct * 
+         from dim_team 
+        where season = :season and competition = :competition""",
+)
+SQL_MATCH_DATA = register_statement(
+    "match_data",
+    """select distinct * 
+         from sw_match_data 
+        where matchId = :match_id""",
+)
+SQL_PLAYER_DATA = register_statement(
+    "player_data",
+    """select distinct * 
+         from sw_player_data 
+        where matchId = :match_id""",
+)
+SQL_BY_MATCH = {
+    table: register_statement(
+        f"{table}_bulk", f"select distinct * from {table} where matchId in :ids", expanding=("ids",)
+    )
+    for table in ("sw_match_data", "sw_player_data")
+}
+SQL_DIM_PLAYER = register_statement("dim_player", "select distinct * from dim_player where actual_sn = 1")
+SQL_TEAMSTATS = register_statement(
+    "teamstats",
+    """
+    select 
+        ts.field,
+        ts.teamId,
+        ts.teamName,
+        ts.matchId,
+        ts.changes_num,
+        df.*,
+        md.competition,
+        md.season
+    from fact_team_stats ts
+    left join dim_formation df
+           on df.team_formation = ts.team_formation
+    left join sw_match_data md
+           on md.matchId = ts.matchId
+    where ts.teamName = :team_name
+    """,
+)
+SQL_DIM_POSITION = register_statement("dim_position", "select distinct * from dim_position")
+SQL_PLAYERSTATS = register_statement(
+    "playerstats",
+    """
+    with seasons as (
+        select distinct season
+        from dim_competition_season
+        where season like :season_like
+    )
+    select
+        playerId,
+        ss.season,
+        goals_sp, xg_sp, shots_sp,
+        passes_sp, passes_succ_sp,
+        actions_fromcorner, actions_succ_fromcorner,
+        actions_fromifk, actions_succ_fromifk,
+        actions_fromifkbox, actions_succ_fromifkbox,
+        actions_fromthrowinbox, actions_succ_fromthrowinbox,
+        shots_fromdfk, xg_fromdfk,
+        case when shots_fromdfk > 0 then 1 else 0 end as dfk_taker_sn,
+        case when actions_fromifkbox > 0 then 1 else 0 end as ifk_taker_sn,
+        case when actions_fromthrowinbox > 0 then 1 else 0 end as throwin_taker_sn,
+        case when actions_fromcorner > 0 then 1 else 0 end as corner_taker_sn
+    from fact_player_season pp
+    inner join seasons ss on ss.season = pp.season
+    """,
+)
+
 def looper(conn) -> pd.DataFrame:
-    lp = pd.read_sql("""select distinct season, competition from dim_team""", conn)
+    lp = SQL_LOOPER.read(conn)
     return ub_clean(lp)
 
+# Filas por bloque al leer eventos con cursor de servidor
+SCOPE_CHUNK = int(os.getenv("ABP_SCOPE_CHUNK", "50000"))
+
+def iter_events(stmt, params: dict, conn, chunksize: int | None = None):
+    """
+    Eventos de la sentencia `stmt` por bloques de `chunksize` filas (ABP_SCOPE_CHUNK), leídos con
+    un cursor de servidor y pasados cada uno por el esquema tipado (categóricas, enteros/float32
+    estrechos) en lugar del clean_df genérico: nunca se tiene el resultado entero como objetos
+    Python. Mientras se tipa un bloque, el siguiente se va leyendo en otro hilo.
+    """
+    for chunk in stmt.read_chunks(conn, chunksize or SCOPE_CHUNK, **params):
+        yield ub.typed_events(chunk)
+
+def _concat_events(chunks) -> pd.DataFrame:
+    # Las categóricas de bloques distintos quedan object tras el concat: se vuelven a categorizar
+    return ub.restore_event_categories(pd.concat(list(chunks), ignore_index=True))
+
 @st.cache_data(ttl=3600, show_spinner=False, hash_funcs={Engine: lambda _: None})
-def get_events_bbdd(query: str, conn) -> pd.DataFrame:
-    event_data = pd.read_sql(query, conn)
-    return ub_clean(event_data)
+def get_events_bbdd(query: str, params: dict, conn) -> pd.DataFrame:
+    return _concat_events(iter_events(register_statement("scope_events", query), params, conn))
+
+def _split_scope_query(query: str) -> tuple[str, str]:
+    """Separa el SQL compactado del scope en (CTEs, select final de eventos)."""
+    i = query.lower().rfind(" select ee.id,")
+    if i < 0:
+        raise ValueError("query_scope: no se encuentra el select final de eventos ('select ee.id,')")
+    return query[:i], query[i:]
+
+def get_scope_matches(query: str, params: dict, conn) -> list:
+    """matchIds del scope (CTE games) sin traer sus eventos."""
+    ctes, _ = _split_scope_query(query)
+    stmt = register_statement("scope_matches", f"{ctes} select distinct matchId from games")
+    df = stmt.read(conn, **params)
+    return df["matchId"].dropna().tolist()
+
+def get_scope_end_date(query: str, params: dict, conn) -> str | None:
+    """Fecha de corte del scope (CTE lastdate): los partidos del scope son anteriores a ella."""
+    ctes, _ = _split_scope_query(query)
+    stmt = register_statement("scope_end_date", f"{ctes} select max(localdate) as localdate from lastdate")
+    df = stmt.read(conn, **params)
+    return None if df.empty or pd.isna(df["localdate"].iloc[0]) else str(df["localdate"].iloc[0])
+
+def get_events_batch(query: str, params: dict, match_ids: list, conn) -> pd.DataFrame:
+    """
+    Eventos del scope de un lote de partidos. Sin st.cache_data a propósito: en modo streaming
+    cachear cada lote volvería a juntar en memoria todos los eventos del scope.
+    """
+    stmt = register_statement("scope_events_batch", f"{query} where ee.matchId in :ids", expanding=("ids",))
+    return _concat_events(iter_events(stmt, {**params, "ids": [_match_key(m) for m in match_ids]}, conn))
 
 @st.cache_data(ttl=3600, show_spinner=False, hash_funcs={Engine: lambda _: None})
 def get_dim_competition_season(conn) -> pd.DataFrame:
-    df = pd.read_sql("""select distinct * from dim_competition_season""", conn)
+    df = SQL_DIM_COMPETITION_SEASON.read(conn)
     return ub_clean(df)
 
 @st.cache_data(ttl=3600, show_spinner=False, hash_funcs={Engine: lambda _: None})
 def get_dim_competition(conn) -> pd.DataFrame:
-    df = pd.read_sql("""select distinct * from dim_competition""", conn)
+    df = SQL_DIM_COMPETITION.read(conn)
     return ub_clean(df)
 
 @st.cache_data(ttl=3600, show_spinner=False, hash_funcs={Engine: lambda _: None})
 def get_dim_team(season: str, competition: str, conn) -> pd.DataFrame:
-    df = pd.read_sql(
-        f"""select distinct * 
-            from dim_team 
-           where season = '{season}' and competition = '{competition}'""",
-        conn,
-    )
+    df = SQL_DIM_TEAM.read(conn, season=season, competition=competition)
     return ub_clean(df)
 
 @st.cache_data(ttl=3600, show_spinner=False, hash_funcs={Engine: lambda _: None})
 def get_match_data(match_id: str, conn) -> pd.DataFrame:
-    df = pd.read_sql(
-        f"""select distinct * 
-              from sw_match_data 
-             where matchId = '{match_id}'""",
-        conn,
-    )
+    df = SQL_MATCH_DATA.read(conn, match_id=_match_key(match_id))
     return ub_clean(df)
 
 @st.cache_data(ttl=3600, show_spinner=False, hash_funcs={Engine: lambda _: None})
 def get_player_data(match_id: str, conn) -> pd.DataFrame:
-    df = pd.read_sql(
-        f"""select distinct * 
-              from sw_player_data 
-             where matchId = '{match_id}'""",
-        conn,
-    )
+    df = SQL_PLAYER_DATA.read(conn, match_id=_match_key(match_id))
     return ub_clean(df)
 
+# Caché por matchId de sw_match_data / sw_player_data para las cargas en bloque: en construcciones
+# repetidas (otro rival, otro lastn) solo se piden a la BBDD los partidos que faltan. Es una LRU
+# por tabla de como mucho META_MAX partidos (ABP_META_MAX); las entradas caducadas se descartan
+# en cada llamada, así un proceso largo no acumula temporadas enteras en memoria.
+META_TTL = 3600
+META_CHUNK = int(os.getenv("ABP_IN_CHUNK", "500"))
+META_MAX = int(os.getenv("ABP_META_MAX", "5000"))
+_META_CACHE: dict[str, OrderedDict] = {}
+
+def _get_by_match(table: str, match_ids, conn) -> pd.DataFrame:
+    """
+    `select distinct * from <table>` de todos los `match_ids` con consultas `IN (...)` de hasta
+    META_CHUNK ids (ABP_IN_CHUNK), en lugar de una consulta por partido. Cada partido queda en
+    _META_CACHE durante META_TTL segundos. Devuelve los partidos en el orden recibido.
+    """
+    cache = _META_CACHE.setdefault(table, OrderedDict())
+    ahora = time.time()
+    for k in [k for k, (ts, _) in cache.items() if ahora - ts > META_TTL]:
+        del cache[k]
+    keys = list(dict.fromkeys(_match_key(m) for m in match_ids if not pd.isna(m)))
+    pendientes = [k for k in keys if k not in cache]
+    for i in range(0, len(pendientes), META_CHUNK):
+        tanda = pendientes[i:i + META_CHUNK]
+        df = SQL_BY_MATCH[table].read(conn, ids=tanda)
+        df = ub_clean(df)
+        grupos = dict(list(df.groupby(df["matchId"].map(_match_key), sort=False))) if len(df) else {}
+        for k in tanda:
+            cache[k] = (ahora, grupos[k].reset_index(drop=True) if k in grupos else df.iloc[0:0])
+    frames = [cache[k][1] for k in keys]
+    for k in keys:
+        cache.move_to_end(k)
+    while len(cache) > META_MAX:
+        cache.popitem(last=False)
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+def get_match_data_bulk(match_ids, conn) -> pd.DataFrame:
+    """get_match_data de varios partidos en bloque (ver _get_by_match)."""
+    return _get_by_match("sw_match_data", match_ids, conn)
+
+def get_player_data_bulk(match_ids, conn) -> pd.DataFrame:
+    """get_player_data de varios partidos en bloque (ver _get_by_match)."""
+    return _get_by_match("sw_player_data", match_ids, conn)
+
 @st.cache_data(ttl=3600, show_spinner=False, hash_funcs={Engine: lambda _: None})
 def get_dim_player(conn) -> pd.DataFrame:
-    df = pd.read_sql("""select distinct * from dim_player where actual_sn = 1""", conn)
+    df = SQL_DIM_PLAYER.read(conn)
     return ub_clean(df)
 
 @st.cache_data(ttl=3600, show_spinner=False, hash_funcs={Engine: lambda _: None})
 def get_teamstats(team_name: str, conn) -> pd.DataFrame:
-    df = pd.read_sql(
-        f"""
-        select 
-            ts.field,
-            ts.teamId,
-            ts.teamName,
-            ts.matchId,
-            ts.changes_num,
-            df.*,
-            md.competition,
-            md.season
-        from fact_team_stats ts
-        left join dim_formation df
-               on df.team_formation = ts.team_formation
-        left join sw_match_data md
-               on md.matchId = ts.matchId
-        where ts.teamName = '{team_name}'
-        """,
-        conn,
-    )
+    df = SQL_TEAMSTATS.read(conn, team_name=team_name)
     return ub_clean(df)
 
 @st.cache_data(ttl=3600, show_spinner=False, hash_funcs={Engine: lambda _: None})
 def get_dim_position(conn) -> pd.DataFrame:
-    df = pd.read_sql("""select distinct * from dim_position""", conn)
+    df = SQL_DIM_POSITION.read(conn)
     return ub_clean(df)
 
 @st.cache_data(ttl=3600, show_spinner=False, hash_funcs={Engine: lambda _: None})
@@ -148,30 +306,7 @@ def get_playerstats(season: str, conn) -> pd.DataFrame:
     por la primera parte de `season` (p. ej., '2025-2026' -> '2025%').
     """
     base = season.split("-")[0]
-    sql = f"""
-        with seasons as (
-            select distinct season
-            from dim_competition_season
-            where season like '%{base}%'
-        )
-        select
-            playerId,
-            ss.season,
-            goals_sp, xg_sp, shots_sp,
-            passes_sp, passes_succ_sp,
-            actions_fromcorner, actions_succ_fromcorner,
-            actions_fromifk, actions_succ_fromifk,
-            actions_fromifkbox, actions_succ_fromifkbox,
-            actions_fromthrowinbox, actions_succ_fromthrowinbox,
-            shots_fromdfk, xg_fromdfk,
-            case when shots_fromdfk > 0 then 1 else 0 end as dfk_taker_sn,
-            case when actions_fromifkbox > 0 then 1 else 0 end as ifk_taker_sn,
-            case when actions_fromthrowinbox > 0 then 1 else 0 end as throwin_taker_sn,
-            case when actions_fromcorner > 0 then 1 else 0 end as corner_taker_sn
-        from fact_player_season pp
-        inner join seasons ss on ss.season = pp.season
-    """
-    df = pd.read_sql(sql, conn)
+    df = SQL_PLAYERSTATS.read(conn, season_like=f"%{base}%")
     df = ub_clean(df)
     df_gr = (
         df.groupby(
@@ -213,11 +348,9 @@ def get_players(dft: pd.DataFrame, equipo: str, rival: str, season: str, conn) -
     """
     df_players = pd.DataFrame()
 
-    # 1) Squad  dorsales de los partidos implicados por equipo/rival
+    # 1) Squad  dorsales de los partidos implicados por equipo/rival (una consulta en bloque)
     mask = (dft["teamName"] == equipo) | (dft["teamName"] == rival)
-    for m in dft.loc[mask, "matchId"].dropna().unique():
-        pl = get_player_data(m, conn)
-        df_players = pd.concat([df_players, pl], ignore_index=True)
+    df_players = get_player_data_bulk(dft.loc[mask, "matchId"].dropna().unique(), conn)
 
     # 2) Catálogos
     jugadores = get_dim_player(conn)
@@ -269,6 +402,421 @@ def get_players(dft: pd.DataFrame, equipo: str, rival: str, season: str, conn) -
 # ---------------------------------------------------------------------
 # Núcleo del pipeline (equivale al flujo del notebook)
 # ---------------------------------------------------------------------
+ENGINES = ("pandas", "polars", "duckdb")
+
+
+def _check_engine(engine: str) -> str:
+    """Valida el motor pedido y que su dependencia opcional esté instalada."""
+    if engine not in ENGINES:
+        raise ValueError(f"engine debe ser uno de {ENGINES}: {engine!r}")
+    if engine == "polars":
+        require_polars()
+    elif engine == "duckdb":
+        require_duckdb()
+    return engine
+
+
+def _guarda_parciales(df: pd.DataFrame, cols: list, partials: mp.PartialStore, engine: str) -> None:
+    """
+    Paso 9.a: agregados parciales de los partidos de `df` que aún no los tienen en `partials`
+    (df con las medidas sin compactar, ver mp.build_partials).
+    """
+    pendientes = partials.missing(list(df["matchId"].dropna().unique()))
+    if not pendientes:
+        return
+    for m, p in mp.build_partials(df[df["matchId"].isin(pendientes)], cols, engine).items():
+        partials.put(m, p)
+
+
+def _qualifier_index(events: pd.DataFrame, store: MatchStore) -> cm.QualifierIndex:
+    """
+    QualifierIndex de `events` montado con el de cada partido: el guardado en `store` se
+    reutiliza si la huella de sus `qualifiers` coincide (el índice es posicional y la BBDD no
+    garantiza el orden de las filas); si no, se parsea y se guarda.
+    """
+    partes = []
+    for m, pos in events.groupby("matchId", sort=False, dropna=False).indices.items():
+        q = events["qualifiers"].iloc[pos]
+        if pd.isna(m):
+            partes.append((pos, cm.build_qualifier_index(q)))
+            continue
+        digest = cm.qualifier_digest(q)
+        guardado = store.get(m)
+        if guardado is not None and guardado[0] == digest:
+            idx = guardado[1]
+        else:
+            idx = cm.build_qualifier_index(q)
+            store.put(m, (digest, idx))
+        partes.append((pos, idx))
+    return cm.QualifierIndex.combine(len(events), partes)
+
+
+def _pendientes(match_ids: list, store: MatchStore, episodes: MatchStore) -> list:
+    """Partidos de `match_ids` a los que les falta su resultado o su tabla de episodios."""
+    return [m for m in match_ids if not (store.has(m) and episodes.has(m))]
+
+
+def _calcula_partidos(
+    events: pd.DataFrame,
+    match_ids: list,
+    store: MatchStore,
+    episodes: MatchStore,
+    series_plan_abp,
+    series_config_secuencia: dict,
+    engine: str,
+) -> None:
+    """Pasos 5.c-7 para los partidos de `match_ids` que aún no están en el almacén."""
+    pendientes = _pendientes(match_ids, store, episodes)
+    if not pendientes:
+        return
+    ev_p = events[events["matchId"].isin(pendientes)].reset_index(drop=True)
+
+    # 5.c) Índice de qualifiers: se parsea una sola vez por partido (y se reutiliza el guardado
+    #      mientras su texto no cambie) y se materializan como flags los qualifierId que
+    #      consultan los filtros y las secuencias
+    qualifier_index = _qualifier_index(ev_p, _qualifier_store())
+    ev_p = cm.add_qualifier_flags(
+        ev_p,
+        cm.plan_qualifier_ids(series_plan_abp) | set(cm.QUALIFIER_IDS_AUX),
+        qualifier_index,
+    )
+
+    # 6) Transformaciones de eventos a nivel acción/posesión
+    #    El series_config se compila una vez en un plan con predicados compartidos
+    gr_cols = ["id", "teamId", "teamName"]
+    dft_base = cm.transform_events_agg(ev_p, series_plan_abp, gr_cols, engine=engine)
+    dft_base = dft_base[gr_cols + series_plan_abp.names]
+    dft = pd.merge(ev_p, dft_base, how="left", on=gr_cols)
+
+    # 7) Secuencias por partido (solo los pendientes; se guardan en el almacén)
+    #    Los partidos son independientes: se reparten entre procesos (ABP_WORKERS / ABP_CHUNKSIZE)
+    #    y su tabla de episodios ABP (misma ordenación y enlaces que las secuencias)
+    calcula_secuencias_por_partido(dft, series_config_secuencia, pendientes, store=store, episodes=episodes)
+
+
+def _calcula_scope(
+    query: str,
+    params: dict,
+    match_ids: list,
+    conn,
+    store: MatchStore,
+    episodes: MatchStore,
+    series_plan_abp,
+    series_config_secuencia: dict,
+    engine: str,
+) -> list:
+    """
+    Pasos 5-7 para los partidos de `match_ids`: solo se piden a la BBDD los eventos de los que
+    faltan en el almacén (los guardados ya llevan todas las columnas de los eventos). Devuelve,
+    en el orden recibido, los partidos que quedan en el almacén (los que tienen eventos).
+    """
+    pendientes = _pendientes(match_ids, store, episodes)
+    if pendientes:
+        ev = get_events_batch(query, params, pendientes, conn)
+        _calcula_partidos(
+            ev, list(ev["matchId"].dropna().unique()), store, episodes, series_plan_abp, series_config_secuencia, engine,
+        )
+    return [m for m in match_ids if store.has(m)]
+
+
+def _prepara_df(df: pd.DataFrame, fechas: pd.DataFrame | None) -> pd.DataFrame:
+    """
+    Paso 8 sobre el resultado del almacén: df con fillna y localDate. Las medidas se compactan
+    después (paso 7.b, cm.compact_measure_dtypes), una vez guardados los agregados parciales.
+    """
+    df = ub.fillna_zero(df)
+    df = df.drop(columns=cm.qualifier_flag_columns(df))
+
+    # 8) Fecha de partido
+    if fechas is not None:
+        df = pd.merge(df, fechas, how="left", on="matchId")
+    return df
+
+
+def _fechas(df_match: pd.DataFrame) -> pd.DataFrame | None:
+    if not df_match.empty and "matchId" in df_match.columns and "localDate" in df_match.columns:
+        return df_match[["matchId", "localDate"]]
+    return None
+
+
+def _get_gk(events: pd.DataFrame, match_ids: list, teams: pd.DataFrame, conn) -> pd.DataFrame | None:
+    """
+    df_gk de los partidos de `match_ids`, o None (con un aviso en el log) si a los eventos o a
+    sw_player_data les faltan los campos de portero (cm.GK_EVENT_COLUMNS / cm.GK_PLAYER_COLUMNS).
+    Los eventos se comprueban antes de consultar sw_player_data.
+    """
+    faltan = cm.gk_missing_columns(events)
+    if not faltan:
+        player_data = get_player_data_bulk(match_ids, conn)
+        faltan = cm.gk_missing_columns(events, player_data)
+    if faltan:
+        logger.warning("df_gk: sin métricas de portero, faltan columnas %s", faltan)
+        return None
+    return cm.get_gk_events(events, player_data, teams)
+
+
+def _stream_scope(
+    query: str,
+    params: dict,
+    scope: list,
+    conn,
+    store: MatchStore,
+    episodes: MatchStore,
+    series_plan_abp,
+    series_config_secuencia: dict,
+    engine: str,
+    partials: mp.PartialStore,
+    teams: pd.DataFrame,
+    df_path: Path,
+    batch_size: int,
+) -> dict:
+    """
+    Pasos 5-9 en modo streaming para los partidos de `scope`, por lotes de `batch_size`: la
+    memoria depende del tamaño del lote y no de lastn.
+
+    1ª pasada: eventos de los partidos del lote que faltan en el almacén -> series y secuencias
+    al almacén (que hace de volcado a disco por partido); del almacén se reúnen las columnas,
+    categorías y tipos compactos de todo el scope, los equipos por partido (para get_players),
+    df_gk y los KPIs de conducción por jugador, y se lee la info de partido.
+    2ª pasada: cada lote se relee del almacén, se prepara igual que el df completo, se añade a
+    `df_path` y sus partidos nuevos guardan los agregados parciales en `partials`.
+    """
+    measure_cols = series_plan_abp.names + list(series_config_secuencia)
+
+    lotes, columnas, categorias, dtypes = [], {}, {}, {}
+    df_match, equipos, df_gk = [], [], []
+
+    def _primera_pasada():
+        nonlocal dtypes, df_gk
+        for i in range(0, len(scope), batch_size):
+            match_ids = _calcula_scope(
+                query, params, scope[i:i + batch_size], conn, store, episodes, series_plan_abp, series_config_secuencia,
+                engine,
+            )
+            if not match_ids:
+                continue
+            lotes.append(match_ids)
+
+            d = store.load(match_ids)
+            columnas.update(dict.fromkeys(d.columns))
+            ub.collect_event_categories(d, categorias)
+            medidas = [c for c in measure_cols if c in d.columns]
+            dtypes = cm.merge_measure_dtypes(dtypes, cm.measure_dtypes(d[medidas].fillna(0), medidas))
+
+            df_match.append(get_match_data_bulk(match_ids, conn))
+            equipos.append(d[["teamId", "teamName", "matchId"]].drop_duplicates())
+            if df_gk is not None:
+                gk = _get_gk(d, match_ids, teams, conn)
+                df_gk = None if gk is None else df_gk + [gk]
+            yield d
+
+    # 5.e) KPIs de conducción por jugador: se acumulan lote a lote sobre la 1ª pasada
+    df_carries = cm.calcular_kpis_carries_stream(_primera_pasada())
+
+    df_match = pd.concat(df_match, ignore_index=True) if df_match else pd.DataFrame()
+    fechas = _fechas(df_match)
+    columnas = list(columnas)
+    cat_dtypes = {c: t for c, t in ub.event_category_dtypes(categorias).items() if c in columnas}
+    composites = cm.compile_composite_spec()
+
+    medidas = set(measure_cols)
+    cols_df = None
+    header = True
+    for match_ids in lotes:
+        # Mismas columnas y categorías en todos los lotes: cada uno se prepara como lo haría el df completo
+        d = store.load(match_ids).reindex(columns=columnas).astype(cat_dtypes)
+        d = _prepara_df(d, fechas)
+
+        # 9.a) Agregados parciales de los partidos del lote
+        if cols_df is None:
+            cols_df = [c for c in d.columns if c in medidas]
+        _guarda_parciales(d, cols_df, partials, engine)
+
+        # 7.b) Tipos compactos con el plan de todo el scope
+        d = cm.compact_measure_dtypes(d, measure_cols, dtypes=dtypes)
+
+        # 10) Medidas compuestas a nivel evento y volcado del lote a df.csv
+        d = cm.calcula_medidas_compuestas(d, composites, engine=engine)
+        d.to_csv(df_path, mode="w" if header else "a", header=header, index=False)
+        header = False
+
+    if header:
+        pd.DataFrame(columns=columnas).to_csv(df_path, index=False)
+
+    # df_gk: mismo orden que el groupby (playerId, matchId) del scope completo
+    if df_gk:
+        df_gk = pd.concat(df_gk, ignore_index=True).sort_values(["playerId", "matchId"], kind="stable").reset_index(drop=True)
+    else:
+        df_gk = None
+
+    return {
+        "events": pd.concat(equipos, ignore_index=True) if equipos else pd.DataFrame(columns=["teamId", "teamName", "matchId"]),
+        "df_match": df_match,
+        "df_gk": df_gk,
+        "df_carries": df_carries,
+        "match_ids": [m for lote in lotes for m in lote],
+    }
+
+
+# Tabla de episodios ABP del scope y sus métricas por nivel (ver _episode_tables)
+EPISODE_PRODUCTS = ("df_episodes",) + tuple(f"df_episodes_{nivel}" for nivel in cm.EPISODE_LEVELS)
+
+# Productos que no dependen del rival (se guardan en cache/league/...); df_scope son los equipos
+# por partido del scope, que get_players necesita sin volver a leer los eventos
+LEAGUE_PRODUCTS = ("df", "df_team", "df_agr_pair", "df_gk", "df_carries") + EPISODE_PRODUCTS + ("df_scope",)
+
+
+# Los productos de liga se comparten entre rivales con hard links: nunca se reescribe un fichero
+# en su sitio (cambiaría la copia de todos los rivales y un fallo a medias los dejaría corruptos).
+# Siempre se escribe un temporal y se sustituye con os.replace, que crea un fichero nuevo.
+def _tmp(path: Path) -> Path:
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    tmp.unlink(missing_ok=True)
+    return tmp
+
+
+def _guarda_csv(df, path: Path) -> None:
+    """to_csv atómico: temporal + os.replace."""
+    tmp = _tmp(path)
+    pd.DataFrame(df).to_csv(tmp, index=False)
+    os.replace(tmp, path)
+
+
+def _enlaza(src: Path, dst: Path) -> None:
+    """`dst` apunta al mismo fichero que `src` (hard link; copia si el sistema de ficheros no lo admite)."""
+    tmp = _tmp(dst)
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+# Todo lo que da forma a los DataFrames guardados por partido: los series_config, las columnas
+# que trae query_scope.txt, el esquema de tipos de los eventos (y el tipo de texto de
+# `qualifiers`, que depende de pyarrow) y los qualifiers materializados como flags
+STORE_CONFIGS = (
+    "app/config/series_config_abp.json",
+    "app/config/series_config_secuencia.json",
+    "app/config/query_scope.txt",
+)
+
+
+def _store_schema() -> dict:
+    return {
+        "events": ub.EVENT_SCHEMA,
+        "text": ub._text_dtype(),
+        "qualifier_ids_aux": list(cm.QUALIFIER_IDS_AUX),
+    }
+
+
+# Las carpetas de otras huellas no se van a volver a leer: se borran al abrir el almacén
+def _match_store() -> MatchStore:
+    store = MatchStore(DEFAULT_DATA_DIR / "match_store", config_fingerprint(*STORE_CONFIGS, schema=_store_schema()))
+    store.prune()
+    return store
+
+
+def _episode_store() -> MatchStore:
+    # Tablas de episodios ABP por partido: se calculan junto al resultado del almacén de partidos
+    # y comparten su huella (más la especificación de los tipos de ABP)
+    schema = {**_store_schema(), "set_piece_kinds": cm.SET_PIECE_KINDS}
+    store = MatchStore(DEFAULT_DATA_DIR / "match_episodes", config_fingerprint(*STORE_CONFIGS, schema=schema))
+    store.prune()
+    return store
+
+
+def _qualifier_store() -> MatchStore:
+    # Índices de qualifiers por partido, en su propia raíz: solo dependen del texto de
+    # `qualifiers` (que se comprueba al leerlos), así que sobreviven a los cambios de config
+    store = MatchStore(DEFAULT_DATA_DIR / "qualifier_index", config_fingerprint(schema={"qualifier_re": cm._QUALIFIER_RE}))
+    store.prune()
+    return store
+
+
+def _partial_store() -> mp.PartialStore:
+    # Los parciales dependen además de sus niveles de agrupación
+    schema = {
+        **_store_schema(), "partial_sets": mp.PARTIAL_SETS, "partial_extra": mp.PARTIAL_EXTRA, "sum_dtype": "float64",
+    }
+    partials = mp.PartialStore(DEFAULT_DATA_DIR / "match_partials", config_fingerprint(*STORE_CONFIGS, schema=schema))
+    partials.prune()
+    return partials
+
+
+def _episode_tables(df_episodes: pd.DataFrame) -> dict:
+    """
+    df_episodes (una fila por ABP del scope) y sus métricas agregadas por equipo, rival y
+    lanzador (cm.EPISODE_LEVELS): groupbys sobre la tabla de episodios, no sobre los eventos.
+    """
+    if df_episodes.empty:
+        df_episodes = pd.DataFrame(columns=cm.EPISODE_COLS + cm.EPISODE_LINK_COLS)
+    tablas = {"df_episodes": df_episodes}
+    for nivel, by in cm.EPISODE_LEVELS.items():
+        tablas[f"df_episodes_{nivel}"] = cm.episode_metrics(df_episodes, by)
+    return tablas
+
+
+def window_tables(
+    match_ids: list,
+    rival: str,
+    teams: pd.DataFrame,
+    lastn: int,
+    engine: str = "pandas",
+    partials: mp.PartialStore | None = None,
+) -> dict[str, pd.DataFrame]:
+    """
+    df_team, df_agr_pair y df_jug_team de cualquier selección de partidos ya procesados, solo con
+    sus agregados parciales (sin eventos): cambiar lastn o los partidos elegidos es una suma.
+    Lanza KeyError si algún partido no tiene parciales.
+    """
+    partials = _partial_store() if partials is None else partials
+    parciales = partials.load(match_ids)
+    rollup = mp.window_aggregates(parciales, engine)
+    df_agr, df_agr_agg, df_agr_pair = rollup["df_agr"], rollup["df_agr_agg"], rollup["df_agr_pair"]
+
+    # 10) Medidas compuestas en df_agr / df_agr_agg / df_agr_pair
+    composites = cm.compile_composite_spec()
+    df_agr, df_agr_agg, df_agr_pair = (
+        cm.calcula_medidas_compuestas(dd, composites, engine=engine) for dd in (df_agr, df_agr_agg, df_agr_pair)
+    )
+
+    # 11) Prefijo opp_ para df_agr_agg (todas las columnas salvo las de nombres de equipo)
+    df_agr_agg_ren = df_agr_agg.rename(
+        columns={col: f"opp_{col}" for col in df_agr_agg.columns if "team" not in col.lower()}
+    )
+
+    # 12) df_team = merge df_agr (team) con df_agr_agg prefijado (opposition) por teamName/oppositionTeamName
+    df_team = pd.merge(
+        df_agr,
+        df_agr_agg_ren,
+        how="left",
+        left_on="teamName",
+        right_on="oppositionTeamName",
+    )
+
+    # 13) Filtrar df_team a equipos existentes en dim_team
+    if "teamName" in teams.columns:
+        df_team = df_team[df_team["teamName"].isin(teams["teamName"].unique())]
+
+    # 14) df_jug_team: agregación por jugador
+    df_jug_team = rollup["df_jug_team"]
+
+    # 14.1) **Notebook parity**: limitar a jugadores del RIVAL de este análisis
+    # (en el notebook: df_jug_team = df_jug[df_jug.playerId.isin(df[df.teamName==rival].playerId.unique())])
+    df_jug_team = df_jug_team[df_jug_team["playerId"].isin(mp.rival_players(parciales, rival))].copy()
+
+    # 14.2) **Notebook parity**: calcular medidas compuestas (e.g. columnas *_pct) también a nivel jugador
+    # En el notebook existen columnas de % en df_jug_team; aquí replicamos ese paso.
+    df_jug_team = cm.calcula_medidas_compuestas(df_jug_team, composites, engine=engine)
+
+    # 15) Añadir columna games = lastn a df_team y df_jug_team
+    for dd in [df_team, df_jug_team]:
+        dd["games"] = lastn
+
+    return {"df_team": df_team, "df_agr_pair": df_agr_pair, "df_jug_team": df_jug_team}
+
+
 def _compute_local_visitante(field: str, equipo: str, rival: str) -> tuple[str, str]:
     if str(field).strip().lower() == "home":
         return equipo, rival
@@ -287,6 +835,8 @@ def build_all_and_save(
     season: str,
     lastn: int,
     out_dir: str | None = None,
+    engine: str | None = None,
+    stream_batch: int | None = None,
 ) -> dict[str, pd.DataFrame]:
     """
     Ejecuta TODA la lógica del notebook y escribe los CSVs en `out_dir` con los nombres
@@ -298,11 +848,28 @@ def build_all_and_save(
       - df_agr_pair        -> data/df_agr_pair.csv
       - df_jug_team        -> data/df_jug_team.csv
       - df_players         -> data/df_players.csv
+      - df_gk              -> data/df_gk.csv (métricas de portero por partido, ver cm.get_gk_events)
+      - df_carries         -> data/df_carries.csv (KPIs de conducción por jugador del scope)
+      - df_episodes        -> data/df_episodes.csv (una fila por ABP del scope, ver cm.build_set_piece_episodes)
+      - df_episodes_<nivel> -> data/df_episodes_<nivel>.csv (métricas de los episodios por equipo,
+                              rival y lanzador, ver cm.EPISODE_LEVELS)
+
+    engine: "pandas" (por defecto, o la variable de entorno ABP_ENGINE), "polars" para las series,
+    las medidas compuestas y las agregaciones (pasos 6, 9-14) o "duckdb" para resolver los agregados
+    parciales y los de la ventana (pasos 9-14) con consultas GROUPING SETS. Todos producen los
+    mismos CSV.
+
+    stream_batch: nº de partidos por lote (o la variable de entorno ABP_STREAM_BATCH) para el modo
+    streaming: los eventos se traen y procesan por lotes, df.csv se escribe lote a lote y los
+    agregados se acumulan, así que la memoria no crece con lastn. Los CSV son los mismos; en este
+    modo el "df" devuelto es None (está en df.csv).
+
+    Los productos de liga (df, df_team, df_agr_pair, df_gk, df_carries y los de episodios) se guardan una sola vez en
+    cache/league/<competition>__<season>__<fecha de corte>__<lastn>__<huella de partidos> y se
+    enlazan en la carpeta de cada rival; si ya existen, solo se calculan df_jug_team, df_players y
+    df_team_system (y el "df" devuelto es None).
     """
     # --- CACHE HIT: si ya tenemos los CSV para EXACTAMENTE esta combinación, devolvemos al instante
-    import hashlib, shutil, re
-    from pathlib import Path
-
     def _slugify(s: str) -> str:
         return re.sub(r'[^a-z0-9]+', '-', str(s).lower()).strip('-')
 
@@ -320,20 +887,19 @@ def build_all_and_save(
         "df_agr_pair": cache_dir / "df_agr_pair.csv",
         "df_jug_team": cache_dir / "df_jug_team.csv",
         "df_players": cache_dir / "df_players.csv",
+        "df_gk": cache_dir / "df_gk.csv",
+        "df_carries": cache_dir / "df_carries.csv",
+        **{name: cache_dir / f"{name}.csv" for name in EPISODE_PRODUCTS},
     }
     
     if all(p.exists() for p in expected.values()):
         # Devolver directos desde cache (NO copiar a data/)
-        return {
-            "df": pd.read_csv(expected["df"]),
-            "df_team": pd.read_csv(expected["df_team"]),
-            "df_agr_pair": pd.read_csv(expected["df_agr_pair"]),
-            "df_jug_team": pd.read_csv(expected["df_jug_team"]),
-            "df_players": pd.read_csv(expected["df_players"]),
-        }
+        return {name: pd.read_csv(p) for name, p in expected.items()}
 
     # --- Si no hay caché, seguimos con el pipeline normal
     print_header_time("Inicio pipeline_db")
+    engine = _check_engine(engine or os.getenv("ABP_ENGINE", "pandas"))
+    stream_batch = stream_batch or int(os.getenv("ABP_STREAM_BATCH", "0"))
 
     # Nos aseguramos de que la carpeta de cache exista
     cache_dir.mkdir(parents=True, exist_ok=True)
@@ -347,39 +913,89 @@ def build_all_and_save(
     # 3) Cargar config y query
     series_config_abp = get_series_config("app/config/series_config_abp")
     series_config_secuencia = get_series_config("app/config/series_config_secuencia")
-    query_tpl = get_query("app/config/query_scope.txt")
+    query = get_query("app/config/query_scope.txt")
 
-    # 4) Preparar query final (mismo order del notebook: equipo, equipo, local, visitante, season, competition, local, visitante, lastn)
-    #    OJO: se respeta el orden de placeholders de tu query_scope.txt
-    query = query_tpl.format(team, team, local, visitante, season, competition, local, visitante, lastn)
+    # 4) Parámetros de la query (:team, :home, :away, :season, :competition, :lastn): el SQL del
+    #    scope es siempre el mismo texto y solo cambian los valores
+    params = scope_params(team, local, visitante, season, competition, lastn)
 
     # 5) Lecturas base
-    events = get_events_bbdd(query, conn)
     dim_competition_season = get_dim_competition_season(conn)
     dim_competition = get_dim_competition(conn)
     teams = get_dim_team(season, competition, conn)
 
-    # 6) Transformaciones de eventos a nivel acción/posesión
-    dft_base = cm.transform_events_agg(events, series_config_abp, ["id", "teamId", "teamName"])
-    dft = pd.merge(events, dft_base, how="left", on=["id", "teamId", "teamName"])
+    # 5.b) Almacén por partido: el resultado de un partido solo depende de sus eventos y de los
+    #      series_config, así que solo se calculan los partidos que nunca se han visto
+    series_plan_abp = cm.compile_series_config(series_config_abp)
+    store = _match_store()
+    episodes = _episode_store()
+    measure_cols = series_plan_abp.names + list(series_config_secuencia)
+
+    # 5.c) Agregados parciales por partido: los agregados de cualquier ventana son su suma
+    partials = _partial_store()
+
+    # 5.d) Productos de liga (df, df_team, df_agr_pair, df_gk, df_carries): solo dependen de los
+    #      partidos del scope, no del rival, así que se calculan una vez por
+    #      (competition, season, fecha de corte, lastn) y se comparten entre rivales
+    scope = get_scope_matches(query, params, conn)
+    scope_hash = hashlib.md5("|".join(sorted(map(str, scope))).encode("utf-8")).hexdigest()[:10]
+    end_date = get_scope_end_date(query, params, conn)
+    league_dir = cache_root / "league" / (
+        f"{_slugify(competition)}__{_slugify(season)}__{_slugify(end_date)}__{int(lastn)}__{scope_hash}"
+    )
+    league_dir.mkdir(parents=True, exist_ok=True)
+    league = {name: league_dir / f"{name}.csv" for name in LEAGUE_PRODUCTS}
+    reutiliza = all(p.exists() for p in league.values())
+    if reutiliza:
+        events = pd.read_csv(league["df_scope"])
+        match_ids = list(events["matchId"].dropna().unique())
+        # Sin los parciales (almacén borrado) no se puede sacar df_jug_team: se recalcula todo
+        reutiliza = not partials.missing(match_ids)
+
+    if reutiliza:
+        # 5-9.a) Liga ya calculada: solo falta la info de partido para df_team_system
+        df = None
+        df_match = get_match_data_bulk(match_ids, conn)
+    elif stream_batch:
+        # 5-9.a) Modo streaming: lotes de partidos, df.csv escrito por lotes y parciales por partido
+        df_tmp = _tmp(league["df"])
+        res = _stream_scope(
+            query, params, scope, conn, store, episodes, series_plan_abp, series_config_secuencia, engine,
+            partials, teams, df_tmp, int(stream_batch),
+        )
+        os.replace(df_tmp, league["df"])
+        df = None
+        events, df_match, df_gk, df_carries = res["events"], res["df_match"], res["df_gk"], res["df_carries"]
+        match_ids = res["match_ids"]
+    else:
+        # 5-7) Series y secuencias: solo se leen de la BBDD los eventos de los partidos que faltan
+        #      en el almacén; el resto (con sus eventos) se carga de él
+        match_ids = _calcula_scope(
+            query, params, scope, conn, store, episodes, series_plan_abp, series_config_secuencia, engine,
+        )
+        events = ub.restore_event_categories(store.load(match_ids))
 
-    # 7) Secuencias por partido
-    df = pd.DataFrame()
-    for match in dft["matchId"].dropna().unique():
-        dfg = dft[dft["matchId"] == match].copy()
-        dfg = cm.calcula_medidas_secuencia(dfg, series_config_secuencia)
-        df = pd.concat([df, dfg], ignore_index=True)
+        # 8) Info de partido (fechas)
+        df_match = get_match_data_bulk(match_ids, conn)
 
-    df = df.fillna(0)
+        # df_gk: métricas de portero por partido de todos los porteros del scope (toda la competición)
+        df_gk = _get_gk(events, match_ids, teams, conn)
 
-    # 8) Info de partido (fechas) y merge
-    df_match = pd.DataFrame()
-    for m in dft["matchId"].dropna().unique():
-        match_df = get_match_data(m, conn)
-        df_match = pd.concat([df_match, match_df], ignore_index=True)
+        # 5.e) KPIs de conducción por jugador, partido a partido como en el modo streaming
+        df_carries = cm.calcular_kpis_carries_stream(g for _, g in events.groupby("matchId", sort=False))
 
-    if not df_match.empty and "matchId" in df_match.columns and "localDate" in df_match.columns:
-        df = pd.merge(df, df_match[["matchId", "localDate"]], how="left", on="matchId")
+        # 8) fillna y merge de la fecha
+        df = _prepara_df(events, _fechas(df_match))
+        events = events[["teamId", "teamName", "matchId"]].drop_duplicates()
+
+        # 9.a) Agregados parciales de los partidos que aún no los tienen
+        #      Columnas numéricas: las medidas (series y secuencias)
+        medidas = set(measure_cols)
+        cols_df = [c for c in df.columns if c in medidas]
+        _guarda_parciales(df, cols_df, partials, engine)
+
+        # 7.b) Tipos compactos: indicadores 0/1 como int8 y cantidades (xG...) como float32
+        df = cm.compact_measure_dtypes(df, measure_cols)
 
     # === 8.b) REPLICA NOTEBOOK: df_team_system (para Page 4) ===
     #     Equivale a get_team_system(df_match, rival, conn)
@@ -404,112 +1020,53 @@ def build_all_and_save(
             ])
 
         # 3) Guarda EXACTAMENTE lo que tu notebook pasaba al builder
-        df_team_system.to_csv(cache_dir / "df_team_system.csv", index=False)
+        _guarda_csv(df_team_system, cache_dir / "df_team_system.csv")
 
     except Exception as e:
         # No rompas el pipeline por esto; la docgen hará fallback si no está
-        pd.DataFrame().to_csv(cache_dir / "df_team_system.csv", index=False)
-
-    # 9) Agregados (team, opposition, pair)
-    #    Columnas numéricas: todas las que no están en events ni en df_match
-    events_cols = set(events.columns)
-    match_cols = set(df_match.columns) if not df_match.empty else set()
-    cols_df = [c for c in df.columns if c not in events_cols and c not in match_cols]
-
-    # teamName
-    df_agr = df.groupby(by=["teamName"], as_index=False)[cols_df].sum()
-
-    # oppositionTeamName
-    df_agr_agg = df.groupby(by=["oppositionTeamName"], as_index=False)[cols_df].sum()
-
-    # pair (teamName, oppositionTeamName)
-    # - localDate: min
-    # - resto: suma
-    agg_dict = {"localDate": "min"}
-    for c in cols_df:
-        if c != "localDate":
-            agg_dict[c] = "sum"
-
-    df_agr_pair = (
-        df.groupby(by=["teamName", "oppositionTeamName"], as_index=False)
-        .agg(agg_dict)
-        .copy()
-    )
+        _guarda_csv(pd.DataFrame(), cache_dir / "df_team_system.csv")
 
-    # 10) Medidas compuestas en df / df_agr / df_agr_agg / df_agr_pair
-    for dd in [df, df_agr, df_agr_agg, df_agr_pair]:
-        cm.calcula_medidas_compuestas(dd)
+    # 9.b-15) Agregados de la ventana (suma de los parciales de sus partidos) y tablas derivadas
+    tablas = window_tables(match_ids, rival, teams, lastn, engine, partials)
+    df_team, df_agr_pair, df_jug_team = tablas["df_team"], tablas["df_agr_pair"], tablas["df_jug_team"]
 
-    # 11) Prefijo opp_ para df_agr_agg (todas las columnas salvo las de nombres de equipo)
-    df_agr_agg_ren = df_agr_agg.copy()
-    for col in list(df_agr_agg_ren.columns):
-        if "team" not in col.lower():
-            df_agr_agg_ren.rename(columns={col: f"opp_{col}"}, inplace=True)
-
-    # 12) df_team = merge df_agr (team) con df_agr_agg prefijado (opposition) por teamName/oppositionTeamName
-    df_team = pd.merge(
-        df_agr,
-        df_agr_agg_ren,
-        how="left",
-        left_on="teamName",
-        right_on="oppositionTeamName",
-    )
-
-    # 13) Filtrar df_team a equipos existentes en dim_team
-    if "teamName" in teams.columns:
-        df_team = df_team[df_team["teamName"].isin(teams["teamName"].unique())]
-
-    # 14) df_jug_team: agregación por jugador sobre cols_df
-    df_jug_team = (
-        df.groupby(by=["playerId", "playerName"], as_index=False)[cols_df].sum().copy()
-    )
-
-    # 14.1) **Notebook parity**: limitar a jugadores del RIVAL de este análisis
-    # (en el notebook: df_jug_team = df_jug[df_jug.playerId.isin(df[df.teamName==rival].playerId.unique())])
-    rival_player_ids = (
-        df.loc[df["teamName"] == rival, "playerId"].dropna().unique()
-        if "playerId" in df.columns and "teamName" in df.columns else []
-    )
-    df_jug_team = df_jug_team[df_jug_team["playerId"].isin(rival_player_ids)].copy()
-
-    # 14.2) **Notebook parity**: calcular medidas compuestas (e.g. columnas *_pct) también a nivel jugador
-    # En el notebook existen columnas de % en df_jug_team; aquí replicamos ese paso.
-    cm.calcula_medidas_compuestas(df_jug_team)
-
-    # 15) Añadir columna games = lastn a df_team y df_jug_team
-    for dd in [df_team, df_jug_team]:
-        dd["games"] = lastn
+    # 10) Medidas compuestas a nivel evento (en modo streaming ya se han calculado lote a lote)
+    if df is not None:
+        df = cm.calcula_medidas_compuestas(df, cm.compile_composite_spec(), engine=engine)
 
     # 16) df_players: plantilla enriquecida
-    df_players = get_players(dft, team, rival, season, conn)
-
-    # 17) Guardar SOLO en cache
-    pd.DataFrame(df).to_csv(cache_dir / "df.csv", index=False)
-    pd.DataFrame(df_team).to_csv(cache_dir / "df_team.csv", index=False)
-    pd.DataFrame(df_agr_pair).to_csv(cache_dir / "df_agr_pair.csv", index=False)
-    pd.DataFrame(df_jug_team).to_csv(cache_dir / "df_jug_team.csv", index=False)
-    pd.DataFrame(df_players).to_csv(cache_dir / "df_players.csv", index=False)
-
-    # --- CACHE SAVE: guardar también en caché persistente esta combinación
-    import hashlib, re
-    from pathlib import Path
-
-    def _slugify(s: str) -> str:
-        return re.sub(r'[^a-z0-9]+', '-', str(s).lower()).strip('-')
-
-    cache_root = (DEFAULT_DATA_DIR / "cache")
-    cache_root.mkdir(parents=True, exist_ok=True)
+    df_players = get_players(events, team, rival, season, conn)
 
-    key_str = f"{team}|{rival}|{competition}|{field}|{season}|{int(lastn)}"
-    key_hash = hashlib.md5(key_str.encode("utf-8")).hexdigest()[:10]
-    cache_dir = cache_root / f"{_slugify(team)}__{_slugify(rival)}__{_slugify(season)}__{key_hash}"
-    cache_dir.mkdir(parents=True, exist_ok=True)
-
-    pd.DataFrame(df).to_csv(cache_dir / "df.csv", index=False)
-    pd.DataFrame(df_team).to_csv(cache_dir / "df_team.csv", index=False)
-    pd.DataFrame(df_agr_pair).to_csv(cache_dir / "df_agr_pair.csv", index=False)
-    pd.DataFrame(df_jug_team).to_csv(cache_dir / "df_jug_team.csv", index=False)
-    pd.DataFrame(df_players).to_csv(cache_dir / "df_players.csv", index=False)
+    if reutiliza:
+        df_gk = pd.read_csv(league["df_gk"])
+        df_carries = pd.read_csv(league["df_carries"])
+        tablas_episodios = {name: pd.read_csv(league[name]) for name in EPISODE_PRODUCTS}
+    else:
+        # 16.b) df_gk: no rompas el pipeline si sw_player_data no trae los campos de portero
+        if df_gk is None:
+            df_gk = pd.DataFrame(columns=["playerId", "matchId"])
+
+        # 16.c) Episodios ABP del scope (guardados por partido en el almacén) y sus métricas
+        tablas_episodios = _episode_tables(episodes.load(match_ids))
+
+        # 17.a) Productos de liga (en modo streaming df.csv ya está escrito); df_scope el último,
+        #       porque su existencia marca la liga como completa
+        if df is not None:
+            _guarda_csv(df, league["df"])
+        _guarda_csv(df_team, league["df_team"])
+        _guarda_csv(df_agr_pair, league["df_agr_pair"])
+        _guarda_csv(df_gk, league["df_gk"])
+        _guarda_csv(df_carries, league["df_carries"])
+        for name, tabla in tablas_episodios.items():
+            _guarda_csv(tabla, league[name])
+        _guarda_csv(events[["teamId", "teamName", "matchId"]].drop_duplicates(), league["df_scope"])
+
+    # 17.b) Carpeta del rival: sus productos y los de liga enlazados (la docgen lee todo de aquí)
+    _guarda_csv(df_jug_team, cache_dir / "df_jug_team.csv")
+    _guarda_csv(df_players, cache_dir / "df_players.csv")
+    for name in LEAGUE_PRODUCTS:
+        if name != "df_scope":
+            _enlaza(league[name], expected[name])
 
     return {
         "df": df,
@@ -517,4 +1074,7 @@ def build_all_and_save(
         "df_agr_pair": df_agr_pair,
         "df_jug_team": df_jug_team,
         "df_players": df_players,
+        "df_gk": df_gk,
+        "df_carries": df_carries,
+        **tablas_episodios,
     }
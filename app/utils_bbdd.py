@@ -5,25 +5,44 @@ Created on Thu Apr 10 01:39:23 2025
 @author: aleex
 """
 
+import logging
+
+import numpy as np
 import pandas as pd
-from sqlalchemy import create_engine
-import json
+
+logger = logging.getLogger(__name__)
+
+def _db_secrets():
+    """
+    st.secrets["db_watford"], o None si no hay streamlit, no hay fichero de secrets o no tiene
+    esa sección. Cualquier otro error (secrets mal escritos, etc.) se propaga.
+    """
+    try:
+        import streamlit as st
+    except ImportError:
+        return None
+    try:
+        from streamlit.errors import StreamlitSecretNotFoundError
+    except ImportError:  # versiones antiguas: sin secrets.toml lanzan FileNotFoundError
+        StreamlitSecretNotFoundError = FileNotFoundError
+    try:
+        return st.secrets["db_watford"]
+    except (StreamlitSecretNotFoundError, FileNotFoundError, KeyError):
+        return None
 
 def get_conn(ruta_config):
-    user = st.secrets["db_watford"]["user"]
-    password = st.secrets["db_watford"]["password"]
-    host = st.secrets["db_watford"]["host"]
-    port = st.secrets["db_watford"]["port"]
-    database = st.secrets["db_watford"]["database"]
-    #user = os.environ.get("DB_WATFORD__USER")
-    #password = os.environ.get("DB_WATFORD__PASSWORD")
-    #host = os.environ.get("DB_WATFORD__HOST")
-    #port = os.environ.get("DB_WATFORD__PORT")
-    #database = os.environ.get("DB_WATFORD__DATABASE")
-    engine = create_engine(
-        f"mysql+mysqlconnector://{user}:{password}@{host}:{port}/{database}"
-    )
-    return engine
+    """
+    Motor compartido del proceso (app.db.get_engine) con las credenciales de
+    st.secrets["db_watford"]; sin secrets, las de app.config (con un aviso en el log).
+    Una sección db_watford incompleta es un error de configuración y lanza KeyError.
+    """
+    from app.db import get_engine, database_url
+    cfg = _db_secrets()
+    if cfg is None:
+        logger.warning("get_conn: sin st.secrets['db_watford'], se usan las credenciales de app.config")
+        return get_engine()
+    url = database_url(cfg["user"], cfg["password"], cfg["host"], cfg["port"], cfg["database"])
+    return get_engine(url)
 
 def clean_df(df):
     for i in df.columns:
@@ -34,4 +53,182 @@ def clean_df(df):
     for i in df.columns:
         if "top" in i:
             df[i]=df[i].fillna(0)
-    return df
\ No newline at end of file
+    return df
+
+# ---------------------------------------------------------------------
+# Esquema tipado de los eventos (columnas de app/config/query_scope.txt)
+# ---------------------------------------------------------------------
+# Enteros pequeños: si la columna trae NaN se guarda como float32 (nunca Int8 nullable, que
+# cambiaría la semántica de las comparaciones y de np.where aguas abajo)
+EVENT_SCHEMA = {
+    "id": "id",
+    "matchId": "id",
+    "teamId": "id",
+    "playerId": "id",
+    "pase_receptor_id": "id",
+    "season": "category",
+    "competition": "category",
+    "type_displayName": "category",
+    "teamName": "category",
+    "oppositionTeamName": "category",
+    "playerName": "category",
+    "carril_id": "category",
+    "carril_id_end": "category",
+    "bodypart_name": "category",
+    "type_value": "int16",
+    "outcomeType_value": "int8",
+    "period_value": "int8",
+    "team_1": "int8",
+    "tercio_id": "int8",
+    "tercio_id_end": "int8",
+    "bin_x_ini": "int8",
+    "bin_y_ini": "int8",
+    "bin_x_end": "int8",
+    "bin_y_end": "int8",
+    "is_abp": "int8",
+    "isGoal": "int8",
+    "minute": "int16",
+    # Indicadores de qualifier que usa get_gk_events (0/1, NaN si el evento no lo trae)
+    "value_Blocked": "int8",
+    "value_Cross": "int8",
+    "value_BigChance": "int8",
+    "value_HighLeft": "int8",
+    "value_LowRight": "int8",
+    "value_HighRight": "int8",
+    "value_LowLeft": "int8",
+    "value_BoxCentre": "int8",
+    "value_SmallBoxLeft": "int8",
+    "value_SmallBoxRight": "int8",
+    "value_SmallBoxCentre": "int8",
+    "time_seconds": "float64",
+    "time_delta_0": "float64",
+    "time_delta_1": "float64",
+    "x": "float32",
+    "y": "float32",
+    "endX": "float32",
+    "endY": "float32",
+    "xG": "float32",
+    "xA": "float32",
+    "ps_xG": "float32",
+    "qualifiers": "text",
+}
+EVENT_CATEGORICAL = [c for c, t in EVENT_SCHEMA.items() if t == "category"]
+
+
+def _to_number(s):
+    """Como clean_df: coma decimal -> punto; lo que no sea numérico pasa a NaN."""
+    if s.dtype == object:
+        s = s.str.replace(",", ".", regex=False).fillna(s)
+    return pd.to_numeric(s, errors="coerce")
+
+
+def _decimal_point(c, s):
+    """Como clean_df: coma -> punto en los textos de columnas sin "name"/"id" en el nombre."""
+    if s.dtype == object and "name" not in c.lower() and "id" not in c.lower():
+        try:
+            return s.str.replace(",", ".", regex=False).fillna(s)
+        except AttributeError:  # object sin ningún texto
+            pass
+    return s
+
+
+def _to_int(s, dtype):
+    s = _to_number(s)
+    info = np.iinfo(dtype)
+    if s.isna().any():
+        return s.astype(np.float32)
+    if len(s) and (s.min() < info.min or s.max() > info.max or not (s % 1 == 0).all()):
+        return s
+    return s.astype(dtype)
+
+
+def _text_dtype():
+    """Texto Arrow si pyarrow está disponible; si no, se deja como object."""
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return None
+    return pd.StringDtype("pyarrow")
+
+
+def typed_events(df):
+    """
+    Aplica EVENT_SCHEMA a los eventos leídos con query_scope.txt en lugar de clean_df:
+    categóricas para los textos repetidos, enteros/float32 estrechos para códigos y
+    coordenadas y texto Arrow para `qualifiers` (si pyarrow está instalado). Las columnas
+    que no están en el esquema pasan por clean_df.
+    """
+    text = _text_dtype()
+    out = {}
+    for c in df.columns:
+        kind = EVENT_SCHEMA.get(c)
+        s = df[c]
+        if kind is None:
+            continue
+        # Mismo texto que con clean_df (p.ej. `qualifiers`: "'qualifierId': 15." y "'value': 89."
+        # son los patrones que buscan build_qualifier_index y las condiciones por qualifiers)
+        s = _decimal_point(c, s)
+        if kind == "id":
+            try:
+                out[c] = pd.to_numeric(s)
+            except (ValueError, TypeError):
+                out[c] = s
+        elif kind == "category":
+            out[c] = s.astype("category")
+        elif kind in ("int8", "int16"):
+            out[c] = _to_int(s, np.dtype(kind))
+        elif kind in ("float32", "float64"):
+            out[c] = _to_number(s).astype(kind)
+        else:
+            out[c] = s.astype(text) if text is not None else s
+    resto = [c for c in df.columns if c not in out]
+    if resto:
+        out.update(clean_df(df[resto].copy()).to_dict("series"))
+    return pd.DataFrame({c: out[c] for c in df.columns}, index=df.index)
+
+
+def restore_event_categories(df):
+    """
+    Vuelve a categórica las columnas de EVENT_CATEGORICAL que un concat (p.ej. de partidos con
+    categorías distintas) haya dejado como object.
+    """
+    cols = {c: "category" for c in EVENT_CATEGORICAL if c in df.columns and df[c].dtype == object}
+    return df.astype(cols) if cols else df
+
+
+def collect_event_categories(df, acc=None):
+    """
+    Acumula en `acc` ({col: (valores, hay_nulos)}) las categorías de las columnas de
+    EVENT_CATEGORICAL de `df`, para fijar un mismo tipo en todos los lotes de un scope.
+    """
+    acc = {} if acc is None else acc
+    for c in EVENT_CATEGORICAL:
+        if c in df.columns:
+            s = df[c]
+            valores, nulos = acc.get(c, (set(), False))
+            valores.update(s.dropna().unique().tolist())
+            acc[c] = (valores, nulos or bool(s.isna().any()))
+    return acc
+
+
+def event_category_dtypes(acc):
+    """
+    CategoricalDtype de cada columna acumulada por collect_event_categories: las mismas categorías
+    (ordenadas, y la 0 al final si hay nulos) que restore_event_categories + fillna_zero del
+    DataFrame completo.
+    """
+    return {
+        c: pd.CategoricalDtype(sorted(valores) + ([0] if nulos and 0 not in valores else []))
+        for c, (valores, nulos) in acc.items()
+    }
+
+
+def fillna_zero(df):
+    """df.fillna(0) que admite categóricas (añade la categoría 0 donde haga falta, como el object original)."""
+    df = df.copy()
+    cats = [c for c in df.columns if isinstance(df[c].dtype, pd.CategoricalDtype)]
+    for c in cats:
+        if df[c].isna().any():
+            s = df[c]
+            df[c] = (s if 0 in s.cat.categories else s.cat.add_categories([0])).fillna(0)
+    return df.fillna({c: 0 for c in df.columns if c not in cats})
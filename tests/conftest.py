@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+# La app no se instala como paquete: los tests importan `app` desde la raíz del repo
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""rollups() de DuckDB debe dar lo mismo que el groupby de pandas."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import app.utils_bbdd as ub
+
+pytest.importorskip("duckdb")
+from app.backend_duckdb import rollups  # noqa: E402
+
+SETS = {
+    "df_agr": ["teamName"],
+    "df_agr_agg": ["oppositionTeamName"],
+    "df_agr_pair": ["teamName", "oppositionTeamName"],
+    "df_jug_team": ["playerId", "playerName"],
+}
+
+
+def _df():
+    # Eventos con nulos en las claves: tras fillna_zero tienen la categoría 0 (playerId/playerName 0)
+    df = pd.DataFrame({
+        "teamName": ["Beta", "Alpha", "Alpha", "Beta", "Alpha", None],
+        "oppositionTeamName": ["Alpha", "Beta", "Beta", "Alpha", "Beta", "Beta"],
+        "playerId": [2.0, 1.0, np.nan, 2.0, 3.0, np.nan],
+        "playerName": ["P2", "P1", None, "P2", "P3", None],
+        "m1": np.array([1, 0, 1, 1, 0, 1], dtype=np.int8),
+        "m2": np.array([0.5, 1.0, 0.0, 2.0, 0.25, 1.0], dtype=np.float32),
+    })
+    df = df.astype({"teamName": "category", "oppositionTeamName": "category", "playerName": "category"})
+    return ub.fillna_zero(df)
+
+
+def test_rollups_como_pandas_con_categoria_cero():
+    df = _df()
+    res = rollups(df, ["m1", "m2"], SETS)
+    for name, by in SETS.items():
+        esperado = df.groupby(by, as_index=False, observed=True)[["m1", "m2"]].sum()
+        got = res[name]
+        assert len(got) == len(esperado), name
+        pd.testing.assert_frame_equal(
+            got.reset_index(drop=True), esperado.reset_index(drop=True), check_dtype=False
+        )
+    assert 0 in res["df_jug_team"]["playerName"].tolist()
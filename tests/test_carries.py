@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""calcular_kpis_carries_stream (por bloques) debe dar lo mismo que calcular_kpis_carries."""
+
+import numpy as np
+import pandas as pd
+
+import app.fun_calculo_metricas as cm
+
+
+def _eventos(n=400, seed=0):
+    rng = np.random.default_rng(seed)
+    x = rng.uniform(0, 100, n)
+    return pd.DataFrame({
+        "matchId": rng.integers(1, 5, n),
+        "playerId": rng.integers(1, 8, n).astype(float),
+        "season": "2024-2025",
+        "playerName": pd.Categorical(rng.choice(["A", "B", "C"], n)),
+        "type_displayName": rng.choice(["Carry", "Pass", "Shot"], n),
+        "type_value": rng.choice([1, 101], n),
+        "outcomeType_value": rng.integers(0, 2, n),
+        "x": x,
+        "endX": x + rng.uniform(-10, 20, n),
+        "endY": rng.uniform(0, 100, n),
+        "tercio_id": rng.integers(1, 4, n),
+        "carril_id": rng.choice(["EXT", "INT", "CEN"], n),
+    })
+
+
+def test_stream_igual_que_completo_y_sin_tocar_los_bloques():
+    ev = _eventos()
+    ev["progressive_carry"] = (ev["type_value"] == 101) & ((ev["endX"] - ev["x"]) >= 5)
+    esperado = cm.calcular_kpis_carries(ev.copy())
+
+    bloques = [g for _, g in ev.groupby("matchId")]
+    columnas = [list(b.columns) for b in bloques]
+    stream = cm.calcular_kpis_carries_stream(iter(bloques))
+    assert [list(b.columns) for b in bloques] == columnas
+
+    def orden(d):
+        d = d.assign(playerName=d["playerName"].astype(str))
+        return d.sort_values(cm.CARRY_KEYS).reset_index(drop=True)
+
+    pd.testing.assert_frame_equal(orden(stream), orden(esperado), check_dtype=False)
+
+
+def test_stream_vacio():
+    assert list(cm.calcular_kpis_carries_stream([])) == cm.CARRY_KEYS + cm.CARRY_KPIS
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""Tabla de episodios ABP: entrega -> primer contacto del receptor -> primer tiro posterior."""
+
+import numpy as np
+import pandas as pd
+
+import app.fun_calculo_metricas as cm
+from app.services.match_executor import calcula_secuencias_por_partido
+from app.services.match_store import MatchStore
+
+
+def _eventos():
+    # Partido 1: córner de A (jugador 1 -> 2), cabezazo de 2 y tiro (gol) de 2; córner sin receptor.
+    # Partido 2: falta directa de B (es su propio tiro).
+    filas = [
+        # matchId, id, t, team, opp, player, receptor, type_value, outcome, xG, corner, dfk, qualifiers
+        (1, 10, 100, "A", "B", 1, 2, 1, 1, np.nan, 1, np.nan, "[]"),
+        (1, 11, 102, "A", "B", 2, np.nan, 1, 1, np.nan, np.nan, np.nan, "[{'qualifierId': 15}]"),
+        (1, 12, 104, "A", "B", 2, np.nan, 16, 1, 0.3, np.nan, np.nan, "[]"),
+        (1, 13, 900, "A", "B", 1, np.nan, 1, 0, np.nan, 1, np.nan, "[]"),
+        (2, 20, 50, "B", "A", 5, np.nan, 13, 1, 0.1, np.nan, 1, "[]"),
+    ]
+    df = pd.DataFrame(filas, columns=[
+        "matchId", "id", "time_seconds", "teamName", "oppositionTeamName", "playerId", "pase_receptor_id",
+        "type_value", "outcomeType_value", "xG", "actions_fromcorner", "shots_fromdfk", "qualifiers",
+    ])
+    df["period_value"] = 1
+    df["playerName"] = "P" + df["playerId"].astype(str)
+    return df
+
+
+def test_enlaces_del_episodio():
+    ep = cm.build_set_piece_episodes(_eventos()).set_index("id")
+    assert ep.loc[10, "kind"] == "corner" and ep.loc[10, "contact_id"] == 11 and ep.loc[10, "contact_header"]
+    assert ep.loc[10, "shot_id"] == 12 and ep.loc[10, "goal"] and ep.loc[10, "shot_xG"] == 0.3
+    assert np.isnan(ep.loc[13, "contact_id"]) and np.isnan(ep.loc[13, "shot_id"])
+    assert ep.loc[20, "kind"] == "dfk" and ep.loc[20, "shot_id"] == 20 and not ep.loc[20, "goal"]
+
+    m = cm.episode_metrics(ep.reset_index(), ["teamName", "kind"]).set_index(["teamName", "kind"])
+    assert m.loc[("A", "corner"), ["episodes", "contacts", "contacts_header", "shots", "goals"]].tolist() == [2, 1, 1, 1, 1]
+    assert m.loc[("B", "dfk"), "xg"] == 0.1
+
+
+def test_episodios_por_partido_en_el_almacen(tmp_path):
+    ev = _eventos()
+    episodes = MatchStore(tmp_path, "0123456789ab")
+    calcula_secuencias_por_partido(ev, {}, episodes=episodes, workers=1)
+    por_partido = episodes.load([1, 2])
+    pd.testing.assert_frame_equal(por_partido, cm.build_set_piece_episodes(ev), check_dtype=False)
+
+
+def test_sin_episodios():
+    ep = cm.build_set_piece_episodes(_eventos().drop(columns=["actions_fromcorner", "shots_fromdfk"]))
+    assert ep.empty and list(cm.episode_metrics(ep, ["teamName", "kind"]).columns)[:2] == ["teamName", "kind"]
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""get_conn solo cae a las credenciales de app.config si faltan los secrets, y lo avisa."""
+
+import logging
+import sys
+import types
+
+import pytest
+
+import app.db
+import app.utils_bbdd as ub
+
+
+class _Secrets(dict):
+    def __init__(self, data=None, error=None):
+        super().__init__(data or {})
+        self.error = error
+
+    def __getitem__(self, key):
+        if self.error is not None:
+            raise self.error
+        return super().__getitem__(key)
+
+
+@pytest.fixture
+def urls(monkeypatch):
+    pedidas = []
+    monkeypatch.setattr(app.db, "get_engine", lambda url=None: pedidas.append(url) or "engine")
+    return pedidas
+
+
+def _streamlit(monkeypatch, secrets):
+    monkeypatch.setitem(sys.modules, "streamlit", types.SimpleNamespace(secrets=secrets))
+
+
+def test_con_secrets_usa_sus_credenciales(monkeypatch, urls):
+    cfg = {"user": "u", "password": "p", "host": "h", "port": 3307, "database": "d"}
+    _streamlit(monkeypatch, _Secrets({"db_watford": cfg}))
+    assert ub.get_conn("app/config") == "engine"
+    assert urls[0].username == "u" and urls[0].host == "h" and urls[0].port == 3307
+
+
+@pytest.mark.parametrize("secrets", [_Secrets(), _Secrets(error=FileNotFoundError("secrets.toml"))])
+def test_sin_secrets_avisa_y_usa_app_config(monkeypatch, urls, caplog, secrets):
+    _streamlit(monkeypatch, secrets)
+    with caplog.at_level(logging.WARNING, logger="app.utils_bbdd"):
+        ub.get_conn("app/config")
+    assert urls == [None]
+    assert "db_watford" in caplog.text
+
+
+def test_secrets_incompletos_o_rotos_no_se_tragan(monkeypatch, urls):
+    _streamlit(monkeypatch, _Secrets({"db_watford": {"user": "u"}}))
+    with pytest.raises(KeyError):
+        ub.get_conn("app/config")
+    _streamlit(monkeypatch, _Secrets(error=ValueError("toml mal escrito")))
+    with pytest.raises(ValueError):
+        ub.get_conn("app/config")
+    assert urls == []
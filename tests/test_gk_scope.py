@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""df_gk con las columnas que trae de verdad query_scope.txt."""
+
+import logging
+import re
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import app.fun_calculo_metricas as cm
+
+QUERY = Path(__file__).resolve().parents[1] / "app" / "config" / "query_scope.txt"
+
+
+def scope_columns():
+    """Columnas del select final de eventos de query_scope.txt."""
+    sql = QUERY.read_text(encoding="utf-8")
+    i = sql.lower().rindex("select ee.id")
+    return re.findall(r"\bee\.(\w+)", sql[i:sql.lower().index("from fact_events", i)])
+
+
+def _eventos(columnas):
+    # Beta tira tres veces contra Alpha (parada, gol y bloqueado) y da un pase
+    ev = pd.DataFrame({c: [np.nan] * 4 for c in columnas})
+    ev = ev.assign(
+        id=[1, 2, 3, 4], matchId=100, teamName="Beta", oppositionTeamName="Alpha",
+        type_value=[15, 16, 15, 1], minute=[10, 20, 30, 40], tercio_id=3, x=90.0, y=50.0,
+        xG=[0.1, 0.3, 0.2, np.nan], ps_xG=[0.2, 0.5, 0.4, np.nan], qualifiers="[]",
+        value_Blocked=[0, 0, 1, np.nan], value_HighLeft=[1, 0, 0, np.nan], value_Cross=[0, 0, 0, 1],
+    )
+    return ev
+
+
+def _players():
+    return pd.DataFrame({"matchId": [100], "teamId": [10], "keeperId": [7], "subbedInExpandedMinute": [95]})
+
+
+TEAMS = pd.DataFrame({"teamId": [10, 20], "teamName": ["Alpha", "Beta"]})
+
+
+def test_query_scope_trae_las_columnas_de_portero():
+    assert cm.gk_missing_columns(pd.DataFrame(columns=scope_columns())) == []
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    pytest.importorskip("streamlit")
+    import app.services.pipeline_db as pdb
+    consultas = []
+    monkeypatch.setattr(pdb, "get_player_data_bulk", lambda ids, conn: consultas.append(list(ids)) or _players())
+    return pdb, consultas
+
+
+def test_get_gk_con_las_columnas_del_scope(pipeline):
+    pdb, consultas = pipeline
+    gk = pdb._get_gk(_eventos(scope_columns()), [100], TEAMS, conn=None)
+    assert consultas == [[100]]
+    fila = gk.set_index(["playerId", "matchId"]).loc[(7, 100)]
+    assert fila["opp_shot"] == 3 and fila["opp_goal"] == 1 and fila["opp_sot"] == 2
+    assert fila["opp_cross"] == 1
+    np.testing.assert_allclose(fila["opp_psxG"], 0.7)
+
+
+def test_get_gk_sin_columnas_no_consulta_sw_player_data(pipeline, caplog):
+    pdb, consultas = pipeline
+    columnas = [c for c in scope_columns() if c != "minute"]
+    with caplog.at_level(logging.WARNING, logger=pdb.__name__):
+        assert pdb._get_gk(_eventos(columnas).drop(columns="minute"), [100], TEAMS, conn=None) is None
+    assert consultas == []
+    assert "minute" in caplog.text
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""map_ordered: orden de entrada, un solo pool por proceso y sin procesos dentro de Streamlit."""
+
+import operator
+import threading
+
+import pytest
+
+import app.services.match_executor as mx
+
+
+@pytest.fixture(autouse=True)
+def pools_limpios(monkeypatch):
+    for var in ("ABP_WORKERS", "ABP_EXECUTOR", "ABP_CHUNKSIZE"):
+        monkeypatch.delenv(var, raising=False)
+    mx.shutdown_executors()
+    yield
+    mx.shutdown_executors()
+
+
+def test_procesos_orden_y_pool_reutilizado():
+    items = list(range(50))
+    assert mx.map_ordered(operator.neg, items, workers=2, executor="process") == [-i for i in items]
+    pool = mx._POOLS[("process", 2)]
+    assert mx.map_ordered(operator.neg, items[:7], workers=2, executor="process") == [-i for i in items[:7]]
+    assert list(mx._POOLS) == [("process", 2)] and mx._POOLS[("process", 2)] is pool
+
+
+def test_dentro_de_streamlit_usa_hilos(monkeypatch):
+    monkeypatch.setattr(mx, "running_in_streamlit", lambda: True)
+    assert mx.default_executor() == "thread"
+    # Con hilos vale cualquier callable (no hace falta picklarlo) y no se arranca ningún proceso
+    hilos = mx.map_ordered(lambda i: (i, threading.current_thread().name), range(20), workers=2)
+    assert [i for i, _ in hilos] == list(range(20))
+    assert list(mx._POOLS) == [("thread", 2)]
+
+
+def test_abp_executor(monkeypatch):
+    monkeypatch.setenv("ABP_EXECUTOR", "serial")
+    assert mx.map_ordered(lambda i: i * 2, [1, 2, 3], workers=4) == [2, 4, 6]
+    assert mx._POOLS == {}
+    monkeypatch.setenv("ABP_EXECUTOR", "hilos")
+    with pytest.raises(ValueError):
+        mx.default_executor()
+
+
+def test_fuera_de_streamlit_usa_procesos():
+    assert not mx.running_in_streamlit()
+    assert mx.default_executor() == "process"
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""Agregados parciales por partido: sumas en float64 y el mismo resultado con cualquier motor."""
+
+import importlib.util
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import app.utils_bbdd as ub
+import app.services.match_partials as mp
+
+ENGINES = ["pandas"] + [e for e in ("polars", "duckdb") if importlib.util.find_spec(e)]
+
+
+def _df(n=400, seed=0):
+    rng = np.random.default_rng(seed)
+    equipos = np.array(["Alpha", "Beta", "Gamma"])
+    t = rng.integers(0, 3, n)
+    df = pd.DataFrame({
+        "matchId": rng.choice([100, 101, 102], n),
+        "teamName": equipos[t],
+        "oppositionTeamName": equipos[(t + 1) % 3],
+        "playerId": np.where(rng.random(n) < 0.1, np.nan, rng.integers(1, 9, n).astype(float)),
+        "localDate": "2025-01-01",
+        "xg": rng.random(n).astype(np.float32) / 7,
+        "ind": rng.integers(0, 2, n).astype(np.float64),
+        "n": rng.integers(0, 2, n).astype(np.int8),
+    })
+    df["playerName"] = np.where(df["playerId"].isna(), None, "P" + df["playerId"].astype(str))
+    df.loc[df["matchId"] == 102, "ind"] = 0.5
+    cats = ["teamName", "oppositionTeamName", "playerName"]
+    return ub.fillna_zero(df.astype(dict.fromkeys(cats, "category")))
+
+
+COLS = ["xg", "ind", "n"]
+
+
+def test_build_partials_suma_en_float64():
+    df = _df()
+    partials = mp.build_partials(df, COLS)
+    assert sorted(partials) == [100, 101, 102]
+    team = partials[100]["team"]
+    esperado = df[df["matchId"] == 100].astype({"xg": np.float64}).groupby(
+        ["teamName", "oppositionTeamName"], observed=True)["xg"].sum()
+    np.testing.assert_array_equal(team["xg"].to_numpy(), esperado.to_numpy())
+    assert team["xg"].dtype == np.float64
+    # Indicador en 100 (entero en su parcial), decimal en 102
+    assert team["ind"].dtype == np.int64 and partials[102]["team"]["ind"].dtype == np.float64
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_motores_como_pandas(engine):
+    df = _df()
+    esperado = mp.build_partials(df, COLS)
+    got = mp.build_partials(df, COLS, engine)
+    for m in esperado:
+        for level in mp.PARTIAL_SETS:
+            pd.testing.assert_frame_equal(got[m][level], esperado[m][level], check_dtype=False)
+
+    ventana = {level: mp.concat_partials([esperado[m][level] for m in (100, 102)]) for level in mp.PARTIAL_SETS}
+    ref = mp.window_aggregates(ventana)
+    res = mp.window_aggregates(ventana, engine)
+    assert list(res) == list(mp.WINDOW_SETS)
+    for name in mp.WINDOW_SETS:
+        pd.testing.assert_frame_equal(res[name], ref[name], check_dtype=False)
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""MatchStore: una misma clave para cualquier forma del matchId y limpieza de huellas antiguas."""
+
+import numpy as np
+import pandas as pd
+
+from app.services.match_partials import PartialStore
+from app.services.match_store import MatchStore, config_fingerprint, match_key
+
+
+def test_match_key_normaliza():
+    assert {match_key(m) for m in (123, np.int64(123), 123.0, np.float32(123), "123", "123.0", " 123 ")} == {"123"}
+    assert match_key("abc-1") == "abc-1"
+    assert match_key(123.5) == "123.5"
+
+
+def test_lecturas_y_escrituras_con_la_misma_clave(tmp_path):
+    store = MatchStore(tmp_path, "0123456789ab")
+    store.put(np.int64(123), pd.DataFrame({"a": [1]}))
+    assert store.has(123) and store.has("123.0") and store.has(123.0)
+    assert store.missing([123.0, "124"]) == ["124"]
+    assert store.load(["123"])["a"].tolist() == [1]
+    assert len(list(store.dir.iterdir())) == 1
+
+
+def test_prune_borra_otras_huellas(tmp_path):
+    viejo = MatchStore(tmp_path, "aaaaaaaaaaaa")
+    viejo.put(1, pd.DataFrame({"a": [1]}))
+    (tmp_path / "notas").mkdir()
+    store = MatchStore(tmp_path, config_fingerprint(schema={"v": 2}))
+    store.put(1, pd.DataFrame({"a": [2]}))
+    assert store.prune() == [viejo.dir]
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted([store.dir.name, "notas"])
+    assert store.has(1)
+
+
+def test_prune_parciales(tmp_path):
+    PartialStore(tmp_path, "aaaaaaaaaaaa")
+    partials = PartialStore(tmp_path, "bbbbbbbbbbbb")
+    assert len(partials.prune()) == len(partials.levels)
+    for s in partials.levels.values():
+        assert [p.name for p in s.dir.parent.iterdir()] == ["bbbbbbbbbbbb"]
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""typed_events debe dejar los mismos valores que clean_df (salvo los tipos)."""
+
+import numpy as np
+import pandas as pd
+
+import app.fun_calculo_metricas as cm
+import app.utils_bbdd as ub
+
+
+def _eventos_bbdd():
+    # Como llegan de la BBDD: todo texto y con coma decimal
+    return pd.DataFrame({
+        "id": ["1", "2", "3", "4"],
+        "matchId": ["100", "100", "101", "101"],
+        "teamName": ["Alpha", "Beta", "Alpha", None],
+        "season": ["2024-2025"] * 4,
+        "competition": ["championship"] * 4,
+        "type_value": ["1", "15", "10", "1"],
+        "outcomeType_value": ["1", "0", "1", None],
+        "x": ["12,5", "50", None, "99,9"],
+        "xG": [None, "0,12", None, None],
+        "qualifiers": [
+            "[{'type': {'value': 15, 'displayName': 'Head'}, 'qualifierId': 15, 'value': 1,5}]",
+            "[{'qualifierId': 89, 'value': 89,}, {'qualifierId': 2}]",
+            "[{'value': 89,}]",
+            "[]",
+        ],
+        "extra_col": ["1,5", "2", "x", None],
+    })
+
+
+def _valores(s):
+    s = s.astype(object) if isinstance(s.dtype, pd.CategoricalDtype) else s
+    return [None if pd.isna(v) else (float(v) if isinstance(v, (int, float, np.number)) else v) for v in s]
+
+
+def test_typed_events_mismos_valores_que_clean_df():
+    raw = _eventos_bbdd()
+    esperado = ub.clean_df(raw.copy())
+    typed = ub.typed_events(raw.copy())
+    assert list(typed.columns) == list(esperado.columns)
+    for c in raw.columns:
+        a, b = _valores(esperado[c]), _valores(typed[c])
+        if c in ("x", "xG"):
+            np.testing.assert_allclose(np.array(a, dtype=float), np.array(b, dtype=float), rtol=1e-6)
+        else:
+            assert a == b, c
+
+
+def test_typed_events_qualifiers_como_clean_df():
+    raw = _eventos_bbdd()
+    esperado = ub.clean_df(raw.copy())["qualifiers"].astype(str)
+    typed = ub.typed_events(raw.copy())["qualifiers"].astype(str)
+    pd.testing.assert_series_equal(esperado, typed)
+
+    a, b = cm.build_qualifier_index(esperado), cm.build_qualifier_index(typed)
+    np.testing.assert_array_equal(a.row, b.row)
+    np.testing.assert_array_equal(a.qualifier_id, b.qualifier_id)
+    np.testing.assert_array_equal(a.form, b.form)
+    assert typed.str.contains("'value': 89.", regex=False).sum() == 2
+
+
+def test_qualifier_index_por_partido_igual_al_global(tmp_path):
+    from app.services.match_store import MatchStore
+
+    q = ub.typed_events(_eventos_bbdd())[["matchId", "qualifiers"]]
+    q = q.iloc[[2, 0, 3, 1]].reset_index(drop=True)  # partidos intercalados
+    completo = cm.build_qualifier_index(q["qualifiers"])
+
+    store = MatchStore(tmp_path, "0123456789ab")
+    partes = []
+    for m, pos in q.groupby("matchId", sort=False).indices.items():
+        sub = q["qualifiers"].iloc[pos]
+        store.put(m, (cm.qualifier_digest(sub), cm.build_qualifier_index(sub)))
+        digest, idx = store.get(m)
+        assert digest == cm.qualifier_digest(sub)
+        partes.append((pos, idx))
+    combinado = cm.QualifierIndex.combine(len(q), partes)
+    for qid in (2, 15, 89):
+        np.testing.assert_array_equal(combinado.flag(qid), completo.flag(qid))
+
+    # Otro orden de filas (o texto distinto) => otra huella: el índice guardado no vale
+    sub = q.loc[q["matchId"] == q["matchId"].iloc[1], "qualifiers"]
+    assert cm.qualifier_digest(sub) != cm.qualifier_digest(sub.iloc[::-1])